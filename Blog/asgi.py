@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Blog.settings')
+# Async post views; see Blog/asgi_urls.py.
+os.environ.setdefault('ROOT_URLCONF', 'Blog.asgi_urls')
+# Each request queries from a thread of its own; see Blog/database.py.
+os.environ.setdefault('DATABASE_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
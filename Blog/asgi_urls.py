@@ -0,0 +1,18 @@
+"""
+URL configuration under ASGI (see Blog/asgi.py): the async views of
+post/async_views.py ahead of Blog.urls, which they hand the requests they
+do not serve to.
+"""
+from django.urls import include, path
+
+from post.async_views import CommentListView, PostDetailView, PostListView, PostReactionView
+
+
+urlpatterns = [
+    path('api/posts/', PostListView.as_view(), name='post-list'),
+    path('api/posts/<int:pk>/', PostDetailView.as_view(), name='post-detail'),
+    path('api/posts/<int:pk>/like/', PostReactionView.as_view(actions={'post': 'like'}), name='post-like'),
+    path('api/posts/<int:pk>/dislike/', PostReactionView.as_view(actions={'post': 'dislike'}), name='post-dislike'),
+    path('api/posts/<int:post_pk>/comments/', CommentListView.as_view(), name='post-comments'),
+    path('', include('Blog.urls')),
+]
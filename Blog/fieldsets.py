@@ -0,0 +1,105 @@
+from rest_framework import serializers
+
+
+def parse_fieldset(value):
+    """
+    Turn a comma-separated list of possibly dotted names into a tree:
+    'id,author.username,author.email' gives
+    {'id': {}, 'author': {'username': {}, 'email': {}}}.
+    """
+    tree = {}
+    for name in (value or '').split(','):
+        node = tree
+        for part in name.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def fieldset_params(request):
+    """
+    The `fields` and `expand` trees of a request's query string, as keyword
+    arguments for a SparseFieldsetsMixin serializer.
+    """
+    if request is None:
+        return {}
+    params = {}
+    for name in ('fields', 'expand'):
+        if name in request.query_params:
+            params[name] = parse_fieldset(','.join(request.query_params.getlist(name)))
+    return params
+
+
+class SparseFieldsetsMixin:
+    """
+    Let clients choose what a serializer renders: `fields` limits the output
+    to the given names, `expand` replaces related ids with nested objects.
+    Both take trees from `parse_fieldset`, so dotted names reach into nested
+    serializers (`fields=id,comments.text`, `expand=comments.author`).
+
+    `Meta.default_fields` lists what is rendered when `fields` is not given
+    (all fields by default). `Meta.expandable_fields` maps a name to the
+    serializer class and keyword arguments used when it is expanded;
+    expanding a name not in the defaults adds it. Write-only fields are
+    always kept.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        self.requested_fields = fields
+        self.requested_expand = expand or {}
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def get_expandable_fields(cls):
+        return getattr(cls.Meta, 'expandable_fields', {})
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expandable = self.get_expandable_fields()
+        nested = {
+            name: field.child if isinstance(field, serializers.ListSerializer) else field
+            for name, field in fields.items()
+        }
+        nested = {name: field for name, field in nested.items() if isinstance(field, SparseFieldsetsMixin)}
+
+        if self.requested_fields:
+            selected = dict(self.requested_fields)
+            unknown = set(selected) - set(fields) - set(expandable)
+            if unknown:
+                raise serializers.ValidationError({'fields': f'Unknown fields: {", ".join(sorted(unknown))}.'})
+        else:
+            selected = dict.fromkeys(getattr(self.Meta, 'default_fields', fields), {})
+        expand = self.requested_expand
+        unknown = set(expand) - set(expandable) - set(nested)
+        if unknown:
+            raise serializers.ValidationError({'expand': f'Cannot expand: {", ".join(sorted(unknown))}.'})
+        for name in expand:
+            selected.setdefault(name, {})
+        # Asking for a field that only exists expanded expands it.
+        expand = {**{name: {} for name in selected if name not in fields}, **expand}
+
+        for name, subtree in expand.items():
+            if name in nested and name not in expandable:
+                nested[name].requested_expand = subtree
+                continue
+            serializer_class, kwargs = expandable[name]
+            if issubclass(serializer_class, SparseFieldsetsMixin):
+                kwargs = {**kwargs, 'fields': selected[name], 'expand': subtree}
+            fields[name] = serializer_class(read_only=True, **kwargs)
+        for name, field in nested.items():
+            if selected.get(name) and name not in expandable:
+                field.requested_fields = selected[name]
+        return {name: field for name, field in fields.items() if name in selected or field.write_only}
+
+
+class SparseFieldsetsViewMixin:
+    """
+    Pass the request's `?fields=` and `?expand=` to the view's serializer
+    when it supports them.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), SparseFieldsetsMixin):
+            for name, value in fieldset_params(getattr(self, 'request', None)).items():
+                kwargs.setdefault(name, value)
+        return super().get_serializer(*args, **kwargs)
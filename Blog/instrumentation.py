@@ -0,0 +1,282 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware counts and times every SQL query issued while a
+request is handled, adds a Server-Timing header and feeds per-route rolling
+histograms that `metrics_view` exposes in the Prometheus text format.
+Views using InstrumentedViewMixin also report serialization time and can
+declare query budgets.
+
+Under ASGI the middleware runs asynchronously and queries execute in
+sync_to_async threads rather than the request's, so every connection also
+records into the metrics of the request in `current_metrics`, a context
+variable that sync_to_async carries into those threads.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.query_budget = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    # First in the list, so the per-request wrappers entered and exited
+    # around it by the sync middleware still pop their own entry.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_recorder)
+for _connection in connections.all(initialized_only=True):
+    install_query_recorder(_connection)
+
+
+class RollingHistogram:
+    """
+    Histogram over the most recent `window` observations, so it reflects
+    current behaviour rather than everything since the process started.
+    """
+
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.samples.append(value)
+
+    def snapshot(self):
+        samples = list(self.samples)
+        counts = [sum(1 for sample in samples if sample <= bound) for bound in self.buckets]
+        return counts, sum(samples), len(samples)
+
+
+METRICS = {
+    'blog_request_duration_seconds': (
+        'Request duration over the recent window.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+    ),
+    'blog_db_queries': (
+        'SQL queries per request over the recent window.',
+        (0, 1, 2, 5, 10, 20, 50, 100),
+    ),
+    'blog_db_duration_seconds': (
+        'Time spent in SQL per request over the recent window.',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    ),
+    'blog_serialize_duration_seconds': (
+        'Time spent serializing per request over the recent window.',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    ),
+    'blog_response_bytes': (
+        'Response body size over the recent window.',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576),
+    ),
+}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, route, values):
+        window = getattr(settings, 'PERFORMANCE_METRICS_WINDOW', 1000)
+        for name, value in values.items():
+            key = (name, route)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                with self.lock:
+                    histogram = self.histograms.setdefault(key, RollingHistogram(METRICS[name][1], window))
+            histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        lines = []
+        histograms = sorted(self.histograms.items())
+        for name, (help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, route), histogram in histograms:
+                if metric != name:
+                    continue
+                counts, total, count = histogram.snapshot()
+                label = route.replace('\\', '\\\\').replace('"', '\\"')
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{{route="{label}",le="{bound}"}} {bucket_count}')
+                lines.append(f'{name}_bucket{{route="{label}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{route="{label}"}} {total}')
+                lines.append(f'{name}_count{{route="{label}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = request.performance_metrics = RequestMetrics()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = request.performance_metrics = RequestMetrics()
+        start = time.perf_counter()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    def finish(self, request, response, metrics, duration):
+        size = 0 if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.sql_time * 1000:.2f};desc="{metrics.queries} queries"',
+            f'serialize;dur={metrics.serialize_time * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}',
+        ])
+        route = get_route(request)
+        registry.observe(route, {
+            'blog_request_duration_seconds': duration,
+            'blog_db_queries': metrics.queries,
+            'blog_db_duration_seconds': metrics.sql_time,
+            'blog_serialize_duration_seconds': metrics.serialize_time,
+            'blog_response_bytes': size,
+        })
+        self.check_query_budget(request, route, metrics)
+        return response
+
+    def check_query_budget(self, request, route, metrics):
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(route, metrics.query_budget)
+        if budget is None or metrics.queries <= budget:
+            return
+        message = f'{request.method} {request.path} ({route}) ran {metrics.queries} queries, budget is {budget}.'
+        if getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class InstrumentedViewMixin:
+    """
+    Report serialization time to PerformanceMiddleware and declare query
+    budgets per action, as an int or a {action: int} dict. The
+    QUERY_BUDGETS setting overrides them by route name.
+    """
+    query_budget = None
+
+    def get_request_metrics(self):
+        return getattr(self.request._request, 'performance_metrics', None)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.set_query_budget()
+
+    def set_query_budget(self):
+        metrics = self.get_request_metrics()
+        if metrics is not None:
+            budget = self.query_budget
+            if isinstance(budget, dict):
+                budget = budget.get(self.action)
+            metrics.query_budget = budget
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        metrics = self.get_request_metrics()
+        if metrics is None:
+            return serializer
+
+        to_representation = serializer.to_representation
+
+        def timed_to_representation(instance):
+            start = time.perf_counter()
+            try:
+                return to_representation(instance)
+            finally:
+                metrics.serialize_time += time.perf_counter() - start
+
+        serializer.to_representation = timed_to_representation
+        return serializer
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return str(data).encode(self.charset)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics_view(request):
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
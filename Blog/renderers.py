@@ -0,0 +1,59 @@
+"""
+JSON rendering and parsing through orjson when it is installed, falling
+back to DRF's stdlib implementation otherwise. Enable them in
+REST_FRAMEWORK's DEFAULT_RENDERER_CLASSES and DEFAULT_PARSER_CLASSES.
+"""
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def orjson_enabled():
+    return orjson is not None and getattr(settings, 'FAST_JSON', True)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Write UTF-8 JSON with orjson. Anything orjson does not handle natively
+    (lazy translations, Decimals, and datetimes, to keep DRF's format) goes
+    through DRF's encoder. Indented output, which orjson only supports with
+    two spaces, and values orjson rejects use the stdlib renderer.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson is not None else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not orjson_enabled() or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits, for example.
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class FastJSONParser(JSONParser):
+    """
+    Parse UTF-8 request bodies with orjson; other encodings use the stdlib
+    parser.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if not orjson_enabled() or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
@@ -0,0 +1,154 @@
+"""
+Read replicas. Views with ReplicaReadMixin run the queries of safe requests
+on one of the databases in READ_REPLICAS['DATABASES'], an {alias: weight}
+dict; ReplicaRouter sends every write to 'default', the primary.
+
+The replica is chosen once per request, by smooth weighted round robin, so
+a request reads from a single copy. Reads stay on the primary:
+
+- for requests with unsafe methods, which may read back what they write;
+- for STICKY_SECONDS after a user's last write, so users see their own
+  changes despite replication lag. Writes are recorded in the default
+  cache, which has to be shared for this to hold across processes;
+- when a cached post response is rebuilt within STICKY_SECONDS of the
+  change that invalidated it (see post/cache.py), so a lagging replica's
+  copy is not cached as the current one.
+"""
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+
+read_database = ContextVar('read_database', default=None)
+
+
+def get_replica_settings():
+    return {
+        'DATABASES': {},
+        'STICKY_SECONDS': 5,
+        **getattr(settings, 'READ_REPLICAS', {}),
+    }
+
+
+@contextmanager
+def use_read_database(alias):
+    """
+    Route the reads made in this block to `alias`, or the primary if None.
+    """
+    token = read_database.set(alias)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def primary_reads_since(changed_at):
+    """
+    Read from the primary in this block if `changed_at` (a timestamp in
+    seconds) is too recent for the replicas to have caught up.
+    """
+    if read_database.get() is not None and time.time() - changed_at < get_replica_settings()['STICKY_SECONDS']:
+        return use_read_database(None)
+    return nullcontext()
+
+
+class WeightedRoundRobin:
+    """
+    Smooth weighted round robin, as in nginx: with weights {a: 1, b: 3}
+    it picks b, a, b, b rather than a, b, b, b.
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.total = sum(weights.values())
+        self.current = dict.fromkeys(weights, 0)
+        self.lock = threading.Lock()
+
+    def choose(self):
+        with self.lock:
+            for alias, weight in self.weights.items():
+                self.current[alias] += weight
+            alias = max(self.current, key=self.current.get)
+            self.current[alias] -= self.total
+            return alias
+
+
+_balancer = None
+
+
+def choose_replica():
+    """
+    Return the replica the next request reads from, or None without any.
+    """
+    global _balancer
+    weights = {alias: weight for alias, weight in get_replica_settings()['DATABASES'].items() if weight > 0}
+    if not weights:
+        return None
+    if _balancer is None or _balancer.weights != weights:
+        _balancer = WeightedRoundRobin(weights)
+    return _balancer.choose()
+
+
+def written_key(user_id):
+    return f'replicas:written:{user_id}'
+
+
+def record_write(user_id):
+    cache.set(written_key(user_id), True, get_replica_settings()['STICKY_SECONDS'])
+
+
+def wrote_recently(user_id):
+    return cache.get(written_key(user_id), False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        # Also for objects read from a replica, which would be saved back
+        # to it otherwise.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replica_settings()['DATABASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Read from a replica while serving safe requests, and keep the user on
+    the primary for a while after a successful unsafe one.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.route_reads(request)
+
+    def route_reads(self, request):
+        self.read_database_token = read_database.set(self.get_read_database(request))
+
+    def get_read_database(self, request):
+        if request.method not in SAFE_METHODS or not get_replica_settings()['DATABASES']:
+            return None
+        if request.user.is_authenticated and wrote_recently(request.user.pk):
+            return None
+        return choose_replica()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'read_database_token', None)
+        if token is not None:
+            read_database.reset(token)
+            self.read_database_token = None
+        if (request.method not in SAFE_METHODS and response.status_code < 400 and
+                get_replica_settings()['DATABASES'] and request.user.is_authenticated):
+            record_write(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
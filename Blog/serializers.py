@@ -0,0 +1,33 @@
+from django.utils.functional import cached_property
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+
+class PlainRepresentationMixin:
+    """
+    Build each object's representation as a plain dict rather than an
+    OrderedDict (dicts keep insertion order), walking a list of the readable
+    fields made once per serializer instead of a generator over every
+    field per object. The output is the same; lists of posts and comments
+    just spend less time per row. Set `plain_representation = False` to
+    compare with DRF's own implementation.
+    """
+    plain_representation = True
+
+    @cached_property
+    def readable_fields(self):
+        return [(field.field_name, field) for field in self.fields.values() if not field.write_only]
+
+    def to_representation(self, instance):
+        if not self.plain_representation:
+            return super().to_representation(instance)
+        ret = {}
+        for name, field in self.readable_fields:
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            # PKOnlyObject stands in for a related object when only its pk is needed.
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
@@ -15,6 +15,8 @@ import os
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 
+from Blog.database import database_from_env, replicas_from_env
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Blog.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -63,7 +66,9 @@ MIDDLEWARE = [
 
 ]
 
-ROOT_URLCONF = 'Blog.urls'
+# Blog/asgi.py switches to Blog.asgi_urls, which serves the busiest post
+# endpoints with async views.
+ROOT_URLCONF = os.environ.get('ROOT_URLCONF', 'Blog.urls')
 
 TEMPLATES = [
     {
@@ -86,14 +91,48 @@ WSGI_APPLICATION = 'Blog.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+#
+# From DATABASE_URL and the variables described in Blog/database.py. By
+# default db.sqlite3, with connections kept for a minute; WAL mode is opt-in
+# with sqlite:///db.sqlite3?journal_mode=wal.
+
+REPLICA_DATABASES, REPLICA_WEIGHTS = replicas_from_env(BASE_DIR)
 
 DATABASES = {
+    'default': database_from_env(BASE_DIR),
+    **REPLICA_DATABASES,
+}
+
+# Safe requests to views with ReplicaReadMixin read from DATABASES, an
+# {alias: weight} dict; a user's reads stay on the primary for
+# STICKY_SECONDS after they write (see Blog/replicas.py).
+DATABASE_ROUTERS = ['Blog.replicas.ReplicaRouter']
+READ_REPLICAS = {
+    'DATABASES': REPLICA_WEIGHTS,
+    'STICKY_SECONDS': int(os.environ.get('READ_REPLICA_STICKY_SECONDS', 5)),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#
+# Local memory by default. Point CACHE_BACKEND/CACHE_LOCATION at
+# 'django.core.cache.backends.filebased.FileBasedCache' with a directory,
+# or 'django.core.cache.backends.redis.RedisCache' with a redis:// URL, to
+# share the cache between worker processes.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
+POST_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': int(os.environ.get('POST_CACHE_TIMEOUT', 300)),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -130,6 +169,30 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Chunked uploads (see post/uploads.py). Sizes are in bytes; sessions not
+# completed within TTL seconds are removed by purge_uploads. Partial files
+# go to MEDIA_ROOT/uploads/partial unless DIRECTORY is set.
+UPLOADS = {
+    'CHUNK_SIZE': 5 * 1024 * 1024,
+    'MIN_CHUNK_SIZE': 256 * 1024,
+    'MAX_CHUNK_SIZE': 64 * 1024 * 1024,
+    'MAX_SIZE': 2 * 1024 * 1024 * 1024,
+    'TTL': 24 * 60 * 60,
+}
+
+# Media serving (see post/media.py). Behind nginx, set BACKEND to
+# 'x-accel-redirect' with an internal location at ACCEL_REDIRECT_PREFIX
+# aliased to MEDIA_ROOT; behind Apache or lighttpd, use 'x-sendfile'.
+MEDIA_SERVING = {
+    'BACKEND': os.environ.get('MEDIA_SERVING_BACKEND', 'django'),
+    'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+    'MAX_AGE': 60 * 60,
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+}
 # STATIC_ROOT = '/home/MohamedAzab007/Blog/staticfiles/'
 
 # Default primary key field type
@@ -139,11 +202,18 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-
-
+        'user.authentication.AuthorizationSchemeAuthentication',
+    ],
+    # orjson when installed, the stdlib otherwise or with FAST_JSON = False
+    # (see Blog/renderers.py).
+    'DEFAULT_RENDERER_CLASSES': [
+        'Blog.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'Blog.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
 }
 
@@ -171,6 +241,8 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
     'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser',
+    'TOKEN_OBTAIN_SERIALIZER': 'user.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'user.serializers.ClaimsTokenRefreshSerializer',
 
     'JTI_CLAIM': 'jti',
 
@@ -181,6 +253,13 @@ SIMPLE_JWT = {
 
 AUTH_USER_MODEL = 'user.User'
 
+# In-process cache of authenticated users for non-safe JWT requests; a
+# MAX_SIZE or TTL (seconds) of 0 disables it.
+AUTH_USER_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 60,
+}
+
 LANGUAGES = [
     ('en', _('English')),
     ('ar', _('Arabic')),
@@ -195,4 +274,45 @@ LOCALE_PATHS = [
 
 USE_I18N = True
 USE_L10N = True
-USE_TZ = True
\ No newline at end of file
+USE_TZ = True
+
+
+# Category and author feeds: 'db' reads pages from the FeedEntry table,
+# 'memory' also keeps feeds read by this process in memory for a minute.
+POST_FEED_STORE = os.environ.get('POST_FEED_STORE', 'db')
+
+# Notification fan-out queue: 'db' (drained by run_notification_worker),
+# 'memory' (background thread in the web process) or 'sync'.
+NOTIFICATION_QUEUE = os.environ.get('NOTIFICATION_QUEUE', 'db')
+
+# Image variants (see post/images.py): 'pool' (worker threads in the web
+# process), 'sync' or 'command' (left to generate_image_variants). Originals
+# over MAX_PIXELS are not decoded.
+IMAGE_VARIANT_QUEUE = os.environ.get('IMAGE_VARIANT_QUEUE', 'pool')
+IMAGE_VARIANTS = {
+    'WIDTHS': (320, 640, 1280),
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'MAX_PIXELS': 40_000_000,
+    'WORKERS': int(os.environ.get('IMAGE_VARIANT_WORKERS', 2)),
+}
+
+# Server-Sent Event streams of comments and notifications (see
+# notification/streams.py). Each connection keeps at most MAX_PENDING
+# events, reads the database after POLL_INTERVAL idle seconds to pick up
+# rows written by other processes and closes after MAX_DURATION seconds;
+# clients reconnect with Last-Event-ID.
+EVENT_STREAMS = {
+    'MAX_PENDING': 100,
+    'POLL_INTERVAL': int(os.environ.get('EVENT_STREAM_POLL_INTERVAL', 10)),
+    'MAX_DURATION': 300,
+}
+
+
+# Per-request instrumentation (see Blog/instrumentation.py). QUERY_BUDGETS
+# maps route names such as 'post-list' to a maximum number of queries and
+# overrides the budgets declared on the views; QUERY_BUDGET_ACTION is 'log'
+# or 'raise'.
+PERFORMANCE_METRICS_WINDOW = int(os.environ.get('PERFORMANCE_METRICS_WINDOW', 1000))
+QUERY_BUDGETS = {}
+QUERY_BUDGET_ACTION = os.environ.get('QUERY_BUDGET_ACTION', 'log')
@@ -15,10 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.conf import settings
 from django.urls import include, path
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from Blog.instrumentation import metrics_view
+from post.media import serve_media
 
 
 
@@ -42,7 +45,9 @@ urlpatterns = [
     path('', include('user.urls')),
     path('', include('post.urls')), 
     path('', include('notification.urls')), 
+    path('api/metrics/', metrics_view, name='metrics'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
 path('accounts/', include('django.contrib.auth.urls')),
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:path>', serve_media, name='media'),
 
 ]
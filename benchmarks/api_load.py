@@ -0,0 +1,273 @@
+"""
+Load benchmark for the main API endpoints.
+
+Seeds a scratch SQLite database (never the project's db.sqlite3) with
+`manage.py seed_blog` and drives these scenarios through the Django test
+client, or against a running server with --url:
+
+    post-list          GET  /api/posts/ (served from the response cache)
+    post-list-uncached GET  /api/posts/?_=<n> (new cache key every time)
+    category-feed      GET  /api/posts/?categories=<name>&_=<n>
+    post-retrieve      GET  /api/posts/<id>/
+    post-like          POST /api/posts/<id>/like/
+    comment-create     POST /api/posts/<id>/comments/
+    token-obtain       POST /api/token/
+    token-refresh      POST /api/token/refresh/
+
+and prints p50/p95/p99 latency, throughput and database queries per
+request, read from the Server-Timing header. With --baseline the run is
+compared to a stored report (see --output) and the script exits non-zero
+when a scenario makes more queries than before or its p95 grew by more
+than --tolerance. --url targets must be seeded with seed_blog first, using
+the same --prefix and --password. benchmarks/baseline.json was recorded
+with the defaults; latencies depend on the machine, so record a baseline
+on the one you compare on.
+
+Usage:
+    python benchmarks/api_load.py [--posts 5000] [--requests 200]
+        [--output report.json] [--baseline benchmarks/baseline.json]
+    python benchmarks/api_load.py --url http://127.0.0.1:8000
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Blog.settings')
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def configure(path):
+    from django.conf import settings
+    import django
+
+    settings.DATABASES['default']['NAME'] = path
+    # DEBUG keeps every query in memory and slows each one down.
+    settings.DEBUG = False
+    django.setup()
+
+
+class LocalTransport:
+    """Requests made in-process through the Django test client."""
+
+    def __init__(self):
+        from django.test import Client
+        from django.test.utils import setup_test_environment
+
+        setup_test_environment(debug=False)
+        self.client = Client()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        if method == 'POST':
+            response = self.client.post(path, data, content_type='application/json', **headers)
+        else:
+            response = self.client.get(path, **headers)
+        return response.status_code, response.get('Server-Timing', ''), response.content
+
+
+class HTTPTransport:
+    """Requests made over HTTP to a running server."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        request = urllib.request.Request(self.url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers.get('Server-Timing', ''), response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers.get('Server-Timing', ''), error.read()
+
+
+def obtain_token(transport, username, password):
+    status, _, body = transport.request('POST', '/api/token/', {'username': username, 'password': password})
+    if status != 200:
+        raise SystemExit(f'Could not obtain a token for {username}: {status} {body[:200]!r}')
+    return json.loads(body)
+
+
+def build_scenarios(transport, args):
+    tokens = obtain_token(transport, f'{args.prefix}-user-0', args.password)
+    access = tokens['access']
+    status, _, body = transport.request('GET', '/api/posts/?page_size=100', token=access)
+    if status != 200:
+        raise SystemExit(f'Could not list posts: {status}')
+    post_ids = [post['id'] for post in json.loads(body)['results']]
+    if not post_ids:
+        raise SystemExit('No posts to benchmark; seed the database with seed_blog first.')
+    category = urlencode({'categories': f'{args.prefix} category 0'})
+
+    def post_id(n):
+        return post_ids[n % len(post_ids)]
+
+    # Each scenario maps a request number to (method, path, data, token).
+    return {
+        'post-list': lambda n: ('GET', '/api/posts/', None, access),
+        'post-list-uncached': lambda n: ('GET', f'/api/posts/?_={n}', None, access),
+        'category-feed': lambda n: ('GET', f'/api/posts/?{category}&_={n}', None, access),
+        'post-retrieve': lambda n: ('GET', f'/api/posts/{post_id(n)}/', None, access),
+        'post-like': lambda n: ('POST', f'/api/posts/{post_id(n)}/like/', None, access),
+        'comment-create': lambda n: ('POST', f'/api/posts/{post_id(n)}/comments/', {'text': f'Load comment {n}'}, access),
+        'token-obtain': lambda n: ('POST', '/api/token/', {'username': f'{args.prefix}-user-0', 'password': args.password}, None),
+        'token-refresh': lambda n: ('POST', '/api/token/refresh/', {'refresh': tokens['refresh']}, None),
+    }
+
+
+def percentile(cut_points, p):
+    return cut_points[p - 1] * 1000
+
+
+def run_scenario(transport, make_request, requests, warmup):
+    for n in range(warmup):
+        transport.request(*make_request(-n - 1))
+
+    timings, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for n in range(requests):
+        method, path, data, token = make_request(n)
+        start = time.perf_counter()
+        status, server_timing, _ = transport.request(method, path, data, token)
+        timings.append(time.perf_counter() - start)
+        if status >= 400:
+            errors += 1
+        match = QUERIES.search(server_timing)
+        if match:
+            queries.append(int(match.group(1)))
+    elapsed = time.perf_counter() - started
+
+    cut_points = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(cut_points, 50), 3),
+        'p95_ms': round(percentile(cut_points, 95), 3),
+        'p99_ms': round(percentile(cut_points, 99), 3),
+        'rps': round(requests / elapsed, 1),
+        'queries': max(queries) if queries else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return a line for every scenario that regressed against `baseline`.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if result['errors'] > before.get('errors', 0):
+            regressions.append(f'{name}: {result["errors"]} errors, baseline {before.get("errors", 0)}')
+        if None not in (result['queries'], before.get('queries')) and result['queries'] > before['queries']:
+            regressions.append(f'{name}: {result["queries"]} queries per request, baseline {before["queries"]}')
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {result["p95_ms"]:.2f} ms, baseline {before["p95_ms"]:.2f} ms')
+    return regressions
+
+
+def report(results, baseline=None):
+    print(f'\n{"scenario":<20} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"req/s":>8} {"queries":>8} {"errors":>7}'
+          + ('   p95 vs baseline' if baseline else ''))
+    for name, result in results.items():
+        line = (f'{name:<20} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+                f'{result["rps"]:>8.1f} {str(result["queries"]):>8} {result["errors"]:>7}')
+        before = (baseline or {}).get('scenarios', {}).get(name)
+        if before:
+            line += f'   {(result["p95_ms"] / before["p95_ms"] - 1) * 100:+.0f}%'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process test client.')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', default='seed')
+    parser.add_argument('--password', default='seed-password')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests run before each scenario.')
+    parser.add_argument('--scenario', action='append', help='Run only these scenarios (repeatable).')
+    parser.add_argument('--output', help='Write the results as JSON to this path.')
+    parser.add_argument('--baseline', help='Compare against the JSON written by an earlier --output.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth over the baseline.')
+    parser.add_argument('--keep', help='Path of the seeded database to keep instead of a temporary file.')
+    args = parser.parse_args()
+
+    path = None
+    if args.url:
+        transport = HTTPTransport(args.url)
+    else:
+        path = args.keep or os.path.join(tempfile.mkdtemp(prefix='blog-bench-'), 'bench.sqlite3')
+        reuse = os.path.exists(path)
+        configure(path)
+
+        from django.core.management import call_command
+
+        if not reuse:
+            call_command('migrate', verbosity=0)
+            print(f'Seeding {args.posts} posts into {path}', flush=True)
+            start = time.perf_counter()
+            call_command('seed_blog', users=args.users, posts=args.posts, seed=args.seed, prefix=args.prefix,
+                         password=args.password, stdout=open(os.devnull, 'w'))
+            print(f'Seeded in {time.perf_counter() - start:.1f} s')
+        transport = LocalTransport()
+
+    try:
+        scenarios = build_scenarios(transport, args)
+        unknown = set(args.scenario or ()) - set(scenarios)
+        if unknown:
+            raise SystemExit(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        results = {}
+        for name, make_request in scenarios.items():
+            if args.scenario and name not in args.scenario:
+                continue
+            print(f'Running {name}', flush=True)
+            results[name] = run_scenario(transport, make_request, args.requests, args.warmup)
+    finally:
+        if path and not args.keep:
+            from django.db import connections
+            connections.close_all()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            os.rmdir(os.path.dirname(path))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.output:
+        meta = {'url': args.url, 'users': args.users, 'posts': args.posts, 'seed': args.seed,
+                'requests': args.requests, 'warmup': args.warmup}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'scenarios': results}, f, indent=2)
+            f.write('\n')
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
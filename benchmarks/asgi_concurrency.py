@@ -0,0 +1,265 @@
+"""
+Benchmark of how many slow clients one process serves at once under WSGI
+and under ASGI.
+
+Seeds a scratch SQLite database (never the project's db.sqlite3) with
+`manage.py seed_blog`, then opens --clients connections to each handler,
+--rate a second. Every client takes --delay seconds (give or take half) to
+send its request, like a phone on a poor connection:
+
+    wsgi  Django's WSGI handler and Blog.urls on a pool of --threads
+          worker threads, as under gunicorn's gthread worker. A worker
+          stays blocked reading from its client until the request is in,
+          so at most --threads clients are read at once.
+    asgi  Django's ASGI handler and Blog.asgi_urls (the async post views)
+          on one event loop, as under uvicorn. A waiting client is a
+          suspended coroutine.
+
+Both run in this process so no server needs installing; a real server
+adds its own parsing cost to each request but does not change how waiting
+clients are held. The mix is the post list, one of the --hot most read
+posts and a like. For each handler it prints the wall time, throughput,
+latency percentiles from when the client connected (time queued for a
+worker counts), the most connections open at once and the most threads
+alive at once.
+
+Usage:
+    python benchmarks/asgi_concurrency.py [--clients 600] [--rate 100] [--delay 2] [--threads 32]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Blog.settings')
+
+
+def configure(path):
+    from django.conf import settings
+    import django
+
+    settings.DATABASES['default']['NAME'] = path
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['testserver']
+    django.setup()
+
+
+def seed(args):
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    call_command('seed_blog', users=args.users, posts=args.posts, comments=args.comments, seed=0,
+                 stdout=open(os.devnull, 'w'))
+
+
+def build_requests(args):
+    """
+    (method, path, Authorization header) of each client's request.
+    """
+    from post.models import Post
+    from user.models import User
+    from user.authentication import ClaimsRefreshToken
+
+    rng = random.Random(0)
+    post_ids = list(Post.objects.order_by('-pub_date').values_list('pk', flat=True)[:args.hot])
+    tokens = [f'Bearer {ClaimsRefreshToken.for_user(user).access_token}' for user in User.objects.all()[:50]]
+    requests = []
+    for _ in range(args.clients):
+        roll = rng.random()
+        if roll < 0.5:
+            requests.append(('GET', '/api/posts/', None))
+        elif roll < 0.9:
+            requests.append(('GET', f'/api/posts/{rng.choice(post_ids)}/', None))
+        else:
+            requests.append(('POST', f'/api/posts/{rng.choice(post_ids)}/like/', rng.choice(tokens)))
+    delays = [args.delay * rng.uniform(0.5, 1.5) for _ in requests]
+    arrivals = [index / args.rate for index in range(args.clients)]
+    return requests, delays, arrivals
+
+
+class Peaks:
+    """
+    Track open connections, and sample live threads until stopped.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = self.peak_connections = 0
+        self.peak_threads = threading.active_count()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while self.running:
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            time.sleep(0.005)
+
+    def connect(self):
+        with self.lock:
+            self.connections += 1
+            self.peak_connections = max(self.peak_connections, self.connections)
+
+    def disconnect(self):
+        with self.lock:
+            self.connections -= 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+
+
+class SlowInput(BytesIO):
+    """
+    wsgi.input of a client that takes `delay` seconds to send its request.
+    """
+
+    def __init__(self, delay):
+        super().__init__(b'')
+        self.delay = delay
+
+    def read(self, *args):
+        if self.delay:
+            time.sleep(self.delay)
+            self.delay = 0
+        return super().read(*args)
+
+
+def run_wsgi(requests, delays, arrivals, threads, peaks):
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+
+    settings.ROOT_URLCONF = 'Blog.urls'
+    application = get_wsgi_application()
+
+    def serve(request, delay, arrival):
+        method, path, authorization = request
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+            'wsgi.input': SlowInput(delay), 'CONTENT_LENGTH': '0',
+        }
+        if authorization:
+            environ['HTTP_AUTHORIZATION'] = authorization
+        # A sync server reads the whole request before calling the app.
+        environ['wsgi.input'].read()
+        statuses = []
+        body = b''.join(application(environ, lambda status, headers: statuses.append(status)))
+        assert statuses[0].startswith('200'), (path, statuses[0], body[:200])
+        peaks.disconnect()
+        return time.perf_counter() - arrival
+
+    start = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(threads) as pool:
+        for request, delay, arrival in zip(requests, delays, arrivals):
+            time.sleep(max(0, start + arrival - time.perf_counter()))
+            peaks.connect()
+            futures.append(pool.submit(serve, request, delay, start + arrival))
+    return [future.result() for future in futures]
+
+
+def run_asgi(requests, delays, arrivals, peaks):
+    from django.conf import settings
+    from django.core.asgi import get_asgi_application
+
+    settings.ROOT_URLCONF = 'Blog.asgi_urls'
+    application = get_asgi_application()
+
+    async def serve(request, delay, arrival):
+        await asyncio.sleep(arrival)
+        connected = time.perf_counter()
+        peaks.connect()
+        method, path, authorization = request
+        headers = [(b'host', b'testserver')]
+        if authorization:
+            headers.append((b'authorization', authorization.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'root_path': '', 'headers': headers, 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+        }
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(delay)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await application(scope, receive, send)
+        assert messages[0]['status'] == 200, (path, messages[0]['status'])
+        peaks.disconnect()
+        return time.perf_counter() - connected
+
+    async def serve_all():
+        return await asyncio.gather(*map(serve, requests, delays, arrivals))
+
+    return asyncio.run(serve_all())
+
+
+def report(name, wall, latencies, peaks):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{name:<6} {wall:>8.2f} {len(latencies) / wall:>9.1f} {statistics.median(latencies) * 1000:>9.0f}'
+          f' {p99 * 1000:>9.0f} {peaks.peak_connections:>12} {peaks.peak_threads:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=5, help='Average comments per post.')
+    parser.add_argument('--hot', type=int, default=20, help='Posts the retrieves and likes go to.')
+    parser.add_argument('--clients', type=int, default=600, help='Clients, one request each.')
+    parser.add_argument('--rate', type=float, default=100, help='New clients per second.')
+    parser.add_argument('--delay', type=float, default=2, help='Seconds each client takes to send its request.')
+    parser.add_argument('--threads', type=int, default=32, help='WSGI worker threads.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='blog-bench-')
+    path = os.path.join(directory, 'bench.sqlite3')
+    configure(path)
+    try:
+        print(f'Seeding {args.posts} posts into {path}', flush=True)
+        seed(args)
+        requests, delays, arrivals = build_requests(args)
+        print(f'{args.clients} clients at {args.rate:g}/s, {args.delay:g}s per request, '
+              f'{args.threads} WSGI threads\n')
+        print(f'{"server":<6} {"wall s":>8} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"connections":>12} {"threads":>8}')
+
+        from django.core.cache import cache
+        for name in ('wsgi', 'asgi'):
+            cache.clear()
+            with Peaks() as peaks:
+                start = time.perf_counter()
+                if name == 'wsgi':
+                    latencies = run_wsgi(requests, delays, arrivals, args.threads, peaks)
+                else:
+                    latencies = run_asgi(requests, delays, arrivals, peaks)
+                wall = time.perf_counter() - start
+            report(name, wall, latencies, peaks)
+    finally:
+        from django.db import connections
+        connections.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
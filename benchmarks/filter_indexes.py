@@ -0,0 +1,181 @@
+"""
+Check that date-range, category and tag browsing stay on indexes at scale.
+
+Seeds a scratch SQLite database (never the project's db.sqlite3) with
+--posts posts spread over authors, categories and tags, then prints the
+query plan and median time of the queries behind:
+
+    /api/posts/?publication_date__gte=..&publication_date__lte=..
+    /api/posts/?categories=..&publication_date__gte=..&publication_date__lte=..
+    /api/posts/?tags=..&publication_date__gte=..
+
+for the first page and for a page deep into the range. Exits non-zero if a
+plan scans a table or sorts in a temporary B-tree. The join path the
+category filter took before feeds is shown for comparison only.
+
+Usage:
+    python benchmarks/filter_indexes.py [--posts 1000000] [--keep PATH]
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Blog.settings')
+
+START = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+SPAN = datetime.timedelta(days=5 * 365)
+PAGE = 21
+
+
+def configure(path):
+    from django.conf import settings
+    import django
+
+    settings.DATABASES['default']['NAME'] = path
+    django.setup()
+
+
+def seed(posts, authors=200, categories=50, tags=500, batch_size=50000, rng=None):
+    from django.db import connection, transaction
+    from post.models import Category, Tag
+    from user.models import User
+
+    rng = rng or random.Random(0)
+    User.objects.bulk_create(User(username=f'author{i}', password='!') for i in range(authors))
+    Category.objects.bulk_create(Category(name=f'Category {i}') for i in range(categories))
+    Tag.objects.bulk_create(Tag(name=f'tag{i}') for i in range(tags))
+    author_ids = list(User.objects.values_list('pk', flat=True))
+    category_ids = list(Category.objects.values_list('pk', flat=True))
+    tag_ids = list(Tag.objects.values_list('pk', flat=True))
+
+    step = SPAN / posts
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, posts, batch_size):
+            rows, post_categories, post_tags = [], [], []
+            for pk in range(start + 1, min(start + batch_size, posts) + 1):
+                pub_date = (START + step * pk).strftime('%Y-%m-%d %H:%M:%S.%f')
+                rows.append((pk, f'Post {pk}', 'Seeded content.', pub_date, rng.choice(author_ids), 0, 0))
+                post_categories += [(pk, category) for category in rng.sample(category_ids, rng.randint(1, 2))]
+                post_tags += [(pk, tag) for tag in rng.sample(tag_ids, rng.randint(0, 3))]
+            cursor.executemany(
+                'INSERT INTO post_post (id, title, content, pub_date, author_id, like_count, dislike_count) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s)', rows,
+            )
+            cursor.executemany('INSERT INTO post_post_categories (post_id, category_id) VALUES (%s, %s)', post_categories)
+            cursor.executemany('INSERT INTO post_post_tags (post_id, tag_id) VALUES (%s, %s)', post_tags)
+            print(f'  seeded {min(start + batch_size, posts)} posts', flush=True)
+
+        # Same rows post.feeds maintains, built in bulk.
+        cursor.execute(
+            "INSERT INTO post_feedentry (kind, key, post_id, pub_date) "
+            "SELECT 'author', author_id, id, pub_date FROM post_post"
+        )
+        for kind, table, column in (('category', 'post_post_categories', 'category_id'), ('tag', 'post_post_tags', 'tag_id')):
+            cursor.execute(
+                f"INSERT INTO post_feedentry (kind, key, post_id, pub_date) "
+                f"SELECT '{kind}', r.{column}, r.post_id, p.pub_date FROM {table} r JOIN post_post p ON p.id = r.post_id"
+            )
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(queryset, repeat=20):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(queryset.all())
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def check(label, queryset, strict=True):
+    plan = queryset.explain()
+    elapsed = measure(queryset)
+    lines = [line.strip() for line in plan.splitlines() if line.strip()]
+    bad = [
+        line for line in lines
+        if 'TEMP B-TREE' in line or ('SCAN' in line and 'USING' not in line)
+    ]
+    covering = any('COVERING INDEX' in line for line in lines)
+    status = 'ok' if not bad else ('FAIL' if strict else 'info')
+    print(f'\n[{status}] {label}: {elapsed:.2f} ms{" (index-only)" if covering else ""}')
+    for line in lines:
+        print(f'    {line}')
+    return not (bad and strict)
+
+
+def run():
+    from post.feeds import DatabaseFeedStore
+    from post.models import Category, FeedEntry, Post, Tag
+    from post.pagination import seek_queryset
+    from post.views import PostFilter
+
+    since = START + SPAN * 0.4
+    until = START + SPAN * 0.6
+    middle = START + SPAN * 0.5
+    category = Category.objects.get(name='Category 7')
+    tag = Tag.objects.get(name='tag42')
+    store = DatabaseFeedStore()
+    ordering = ('-pub_date', '-id')
+
+    def posts(queryset=None, **params):
+        return PostFilter(params, queryset=Post.objects.all() if queryset is None else queryset).qs.order_by(*ordering)
+
+    # A cursor halfway into the range, as a next link would carry it.
+    position = list(Post.objects.filter(pub_date__lte=middle).order_by(*ordering).values_list('pub_date', 'pk')[0])
+    date_range = {'publication_date__gte': since.isoformat(), 'publication_date__lte': until.isoformat()}
+    results = [
+        check('date range, first page', posts(**date_range)[:PAGE]),
+        # The cursor before the filters, as PostViewSet applies it.
+        check('date range, deep page',
+              posts(seek_queryset(Post.objects.all(), ordering, position), **date_range)[:PAGE]),
+        check('category feed + date range, first page',
+              store.get_queryset(FeedEntry.CATEGORY, category.pk, since=since, until=until)[:PAGE]),
+        check('category feed + date range, deep page',
+              store.get_queryset(FeedEntry.CATEGORY, category.pk, position, since=since, until=until)[:PAGE]),
+        check('tag feed + since, first page', store.get_queryset(FeedEntry.TAG, tag.pk, since=since)[:PAGE]),
+        check('category join + date range (pre-feed path)',
+              posts(categories=category.name, **date_range)[:PAGE], strict=False),
+    ]
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=1_000_000)
+    parser.add_argument('--keep', help='Path of the seeded database to keep instead of a temporary file.')
+    args = parser.parse_args()
+
+    path = args.keep or os.path.join(tempfile.mkdtemp(prefix='blog-bench-'), 'bench.sqlite3')
+    reuse = os.path.exists(path)
+    configure(path)
+
+    from django.core.management import call_command
+
+    if not reuse:
+        call_command('migrate', verbosity=0)
+        print(f'Seeding {args.posts} posts into {path}', flush=True)
+        start = time.perf_counter()
+        seed(args.posts)
+        print(f'Seeded in {time.perf_counter() - start:.1f} s')
+
+    ok = run()
+    if not args.keep:
+        from django.db import connections
+        connections.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.rmdir(os.path.dirname(path))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
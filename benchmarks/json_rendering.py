@@ -0,0 +1,214 @@
+"""
+Microbenchmark of the serialization and JSON stages of the main read
+endpoints.
+
+Seeds a scratch SQLite database (never the project's db.sqlite3) with
+`manage.py seed_blog`, rewriting post content and comments in Arabic
+unless --language en, loads each endpoint's objects once, then times
+without touching the database:
+
+    serialize  building the response data, with PlainRepresentationMixin
+               and with DRF's OrderedDict representation
+    render     FastJSONRenderer (orjson) and DRF's stdlib JSONRenderer
+    parse      FastJSONParser and DRF's stdlib JSONParser, on the rendered
+               body
+
+for these endpoints:
+
+    post-list           GET /api/posts/?page_size=<page> (summaries)
+    post-list-expanded  GET /api/posts/?page_size=<page>&expand=author,comments,attachments,images
+    post-retrieve       GET /api/posts/<id>/ (the post with most comments)
+    comment-list        GET /api/posts/<id>/comments/?page_size=<page>
+
+and prints the median time of each, the speed-up and the rendered size.
+
+Usage:
+    python benchmarks/json_rendering.py [--posts 500] [--page 100] [--rounds 50]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Blog.settings')
+
+ARABIC_WORDS = (
+    'مدونة مقال تعليق تصنيف وسم خلاصة ذاكرة استعلام فهرس صفحة مؤلف قارئ سرعة '
+    'بيانات نموذج عرض إشعار اشتراك بحث رمز مستخدم محتوى عنوان نشر'
+).split()
+
+
+def configure(path):
+    from django.conf import settings
+    import django
+
+    settings.DATABASES['default']['NAME'] = path
+    settings.DEBUG = False
+    # Paginated responses build absolute links from the request factory's host.
+    settings.ALLOWED_HOSTS = ['testserver']
+    django.setup()
+
+
+def seed(args):
+    import random
+
+    from django.core.management import call_command
+    from post.models import Comment, Post
+
+    call_command('migrate', verbosity=0)
+    call_command('seed_blog', users=args.users, posts=args.posts, comments=args.comments, seed=0,
+                 stdout=open(os.devnull, 'w'))
+    if args.language == 'ar':
+        rng = random.Random(0)
+
+        def text(low, high):
+            return ' '.join(rng.choice(ARABIC_WORDS) for _ in range(rng.randint(low, high)))
+
+        posts = list(Post.objects.only('id'))
+        for post in posts:
+            post.title, post.content = text(3, 8), text(20, 120)
+        Post.objects.bulk_update(posts, ['title', 'content'], batch_size=500)
+        comments = list(Comment.objects.only('id'))
+        for comment in comments:
+            comment.text = text(3, 30)
+        Comment.objects.bulk_update(comments, ['text'], batch_size=500)
+
+
+def load(viewset, action, path, **kwargs):
+    """
+    Return a view set up as for a GET of `path` and the objects its
+    serializer would get, with every prefetch done.
+    """
+    from django.contrib.auth.models import AnonymousUser
+    from rest_framework.test import APIRequestFactory
+
+    view = viewset(action_map={'get': action}, format_kwarg=None, kwargs=kwargs)
+    request = view.initialize_request(APIRequestFactory().get(path))
+    request.user = AnonymousUser()
+    view.request = request
+    queryset = view.filter_queryset(view.get_queryset())
+    if action == 'list':
+        objects = view.paginate_queryset(queryset)
+    else:
+        objects = [queryset.get(pk=kwargs['pk'])]
+    return view, list(objects)
+
+
+def serializer_classes(view):
+    """
+    Every PlainRepresentationMixin class the view's serializer uses.
+    """
+    from rest_framework.serializers import ListSerializer
+    from Blog.serializers import PlainRepresentationMixin
+
+    found, pending = set(), [view.get_serializer()]
+    while pending:
+        serializer = pending.pop()
+        if isinstance(serializer, ListSerializer):
+            serializer = serializer.child
+        if isinstance(serializer, PlainRepresentationMixin):
+            found.add(type(serializer))
+        pending.extend(field for field in serializer.fields.values() if hasattr(field, 'fields') or
+                       isinstance(field, ListSerializer))
+    return found
+
+
+def median_ms(func, rounds):
+    func()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def measure(view, objects, many, rounds):
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from Blog.renderers import FastJSONParser, FastJSONRenderer
+
+    def serialize():
+        return view.get_serializer(objects if many else objects[0], many=many).data
+
+    classes = serializer_classes(view)
+    plain = median_ms(serialize, rounds)
+    for cls in classes:
+        cls.plain_representation = False
+    try:
+        ordered = median_ms(serialize, rounds)
+    finally:
+        for cls in classes:
+            cls.plain_representation = True
+
+    data = serialize()
+    body = JSONRenderer().render(data)
+    context = {'encoding': 'utf-8'}
+    return {
+        'serialize': (plain, ordered),
+        'render': (median_ms(lambda: FastJSONRenderer().render(data), rounds),
+                   median_ms(lambda: JSONRenderer().render(data), rounds)),
+        'parse': (median_ms(lambda: FastJSONParser().parse(io.BytesIO(body), parser_context=context), rounds),
+                  median_ms(lambda: JSONParser().parse(io.BytesIO(body), parser_context=context), rounds)),
+        'bytes': len(body),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=5, help='Average comments per post.')
+    parser.add_argument('--page', type=int, default=100, help='Page size of the list endpoints.')
+    parser.add_argument('--rounds', type=int, default=50, help='Timed runs of each stage.')
+    parser.add_argument('--language', choices=['ar', 'en'], default='ar')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='blog-bench-')
+    path = os.path.join(directory, 'bench.sqlite3')
+    configure(path)
+    try:
+        print(f'Seeding {args.posts} posts into {path}', flush=True)
+        seed(args)
+
+        from django.db.models import Count
+        from Blog.renderers import orjson_enabled
+        from post.models import Post
+        from post.views import CommentViewSet, PostViewSet
+
+        if not orjson_enabled():
+            print('orjson is not installed: the fast renderer and parser fall back to the stdlib.')
+        busiest = Post.objects.annotate(n=Count('comments')).order_by('-n', 'pk').values_list('pk', flat=True)[0]
+        page = f'page_size={args.page}'
+        endpoints = {
+            'post-list': (PostViewSet, 'list', f'/api/posts/?{page}', {}),
+            'post-list-expanded': (PostViewSet, 'list',
+                                   f'/api/posts/?{page}&expand=author,comments,attachments,images', {}),
+            'post-retrieve': (PostViewSet, 'retrieve', f'/api/posts/{busiest}/', {'pk': busiest}),
+            'comment-list': (CommentViewSet, 'list', f'/api/posts/{busiest}/comments/?{page}',
+                             {'post_pk': busiest}),
+        }
+
+        print(f'\n{"endpoint":<20} {"stage":<10} {"fast ms":>9} {"stdlib ms":>10} {"speed-up":>9} {"bytes":>9}')
+        for name, (viewset, action, url, kwargs) in endpoints.items():
+            view, objects = load(viewset, action, url, **kwargs)
+            result = measure(view, objects, action == 'list', args.rounds)
+            for stage in ('serialize', 'render', 'parse'):
+                fast, slow = result[stage]
+                print(f'{name:<20} {stage:<10} {fast:>9.3f} {slow:>10.3f} {slow / fast:>8.2f}x {result["bytes"]:>9}')
+    finally:
+        from django.db import connections
+        connections.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
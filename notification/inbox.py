@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Notification, NotificationInbox
+
+
+def add_unread(counts):
+    """
+    Add `counts` ({user_id: new unread notifications}) to the users' inbox
+    counters, with one update per distinct increment.
+    """
+    counts = {user_id: count for user_id, count in counts.items() if count}
+    if not counts:
+        return
+    NotificationInbox.objects.bulk_create(
+        [NotificationInbox(user_id=user_id) for user_id in counts],
+        ignore_conflicts=True,
+    )
+    users_by_count = defaultdict(list)
+    for user_id, count in counts.items():
+        users_by_count[count].append(user_id)
+    for count, user_ids in users_by_count.items():
+        NotificationInbox.objects.filter(user_id__in=user_ids).update(unread_count=F('unread_count') + count)
+
+
+def remove_unread(user_id, count):
+    if count:
+        NotificationInbox.objects.filter(user_id=user_id).update(
+            unread_count=Greatest(F('unread_count') - count, 0),
+        )
+
+
+def get_unread_count(user_id):
+    return NotificationInbox.objects.filter(user_id=user_id).values_list('unread_count', flat=True).first() or 0
+
+
+def mark_read(user_id, up_to_id=None, before=None, ids=None):
+    """
+    Mark the user's unread notifications with an id up to `up_to_id`,
+    created before `before`, or listed in `ids` as read. Returns the number
+    of notifications that changed.
+    """
+    notifications = Notification.objects.filter(user_id=user_id, is_read=False)
+    if up_to_id is not None:
+        notifications = notifications.filter(pk__lte=up_to_id)
+    if before is not None:
+        notifications = notifications.filter(created_at__lt=before)
+    if ids is not None:
+        notifications = notifications.filter(pk__in=ids)
+
+    with transaction.atomic():
+        updated = notifications.update(is_read=True)
+        remove_unread(user_id, updated)
+    return updated
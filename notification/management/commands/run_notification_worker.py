@@ -0,0 +1,41 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from notification.pipeline import get_queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued notification events to subscribers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of polling.')
+
+    def handle(self, *args, batch_size, interval, once, **options):
+        queue = get_queue()
+        delivered = 0
+        while True:
+            close_old_connections()
+            try:
+                processed = queue.drain(batch_size)
+            except Exception:
+                # The batch stays queued; it is retried after the interval.
+                logger.exception('Failed to drain the notification queue')
+                processed = 0
+            delivered += processed
+            if processed:
+                continue
+            if once:
+                break
+            time.sleep(interval)
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {delivered} notification events.'))
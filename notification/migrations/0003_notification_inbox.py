@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def backfill_inboxes(apps, schema_editor):
+    Notification = apps.get_model('notification', 'Notification')
+    NotificationInbox = apps.get_model('notification', 'NotificationInbox')
+    counts = Notification.objects.values('user_id').annotate(unread=Count('*')).order_by()
+    NotificationInbox.objects.bulk_create(
+        (NotificationInbox(user_id=row['user_id'], unread_count=row['unread']) for row in counts),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_remove_post_attachments_remove_post_author_and_more'),
+        ('notification', '0002_notificationevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationInbox',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='is_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notification_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at', '-id'], name='notification_unread_idx'),
+        ),
+        migrations.RunPython(backfill_inboxes, migrations.RunPython.noop),
+    ]
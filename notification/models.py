@@ -4,8 +4,48 @@ class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
+    is_read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_inbox_idx'),
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                condition=models.Q(is_read=False),
+                name='notification_unread_idx',
+            ),
+        ]
+
+class NotificationInbox(models.Model):
+    """
+    Per-user unread counter, kept in step with Notification writes so the
+    badge count is a primary key lookup.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    unread_count = models.PositiveIntegerField(default=0)
 
 class Subscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     category = models.CharField(max_length=50, blank=True, null=True)
     is_post_update = models.BooleanField(default=False)
+
+class NotificationEvent(models.Model):
+    """
+    A pending fan-out job, written in the same transaction as the change
+    that caused it and consumed by `run_notification_worker`. An event that
+    keeps failing is kept with `failed_at` set, out of the queue's way.
+    """
+    COMMENT_CREATED = 'comment_created'
+    POST_CREATED = 'post_created'
+    POST_UPDATED = 'post_updated'
+    KIND_CHOICES = [
+        (COMMENT_CREATED, 'Comment created'),
+        (POST_CREATED, 'Post created'),
+        (POST_UPDATED, 'Post updated'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    failed_at = models.DateTimeField(null=True, blank=True)
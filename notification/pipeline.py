@@ -0,0 +1,259 @@
+import logging
+import queue
+import threading
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from post.models import Comment, Post
+from .inbox import add_unread
+from .models import Notification, NotificationEvent, Subscription
+
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['kind', 'object_id'])
+
+# Sent with `notifications` after process_events() inserts them with
+# bulk_create, which bypasses post_save.
+notifications_bulk_created = Signal()
+
+MESSAGE_LENGTH = Notification._meta.get_field('message').max_length
+
+
+def build_message(template, text):
+    return Truncator(template.format(text)).chars(MESSAGE_LENGTH)
+
+
+def resolve_comment_notifications(comment_ids):
+    comments = Comment.objects.filter(pk__in=comment_ids).values_list('post__author_id', 'text')
+    return [
+        Notification(user_id=author_id, message=build_message('New comment on your post: {}', text))
+        for author_id, text in comments
+    ]
+
+
+def resolve_post_notifications(post_ids, updated):
+    """
+    Match posts against subscriptions in three queries however many
+    subscribers there are. A subscription receives new posts in its category
+    (any category when it has none), and also their edits when
+    `is_post_update` is set.
+    """
+    posts = list(Post.objects.filter(pk__in=post_ids).values_list('id', 'title', 'author_id'))
+    if not posts:
+        return []
+
+    categories = {}
+    for post_id, name in Post.categories.through.objects.filter(
+            post_id__in=[post[0] for post in posts]).values_list('post_id', 'category__name'):
+        categories.setdefault(post_id, set()).add(name)
+    names = set().union(*categories.values()) if categories else set()
+
+    subscriptions = Subscription.objects.filter(Q(category__isnull=True) | Q(category='') | Q(category__in=names))
+    if updated:
+        subscriptions = subscriptions.filter(is_post_update=True)
+    subscriptions = list(subscriptions.values_list('user_id', 'category'))
+
+    template = 'Post updated: {}' if updated else 'New post: {}'
+    notifications = []
+    for post_id, title, author_id in posts:
+        post_categories = categories.get(post_id, set())
+        recipients = {
+            user_id for user_id, category in subscriptions
+            if user_id != author_id and (not category or category in post_categories)
+        }
+        message = build_message(template, title)
+        notifications.extend(Notification(user_id=user_id, message=message) for user_id in sorted(recipients))
+    return notifications
+
+
+def insert_batch_size(notifications):
+    """
+    Notifications per INSERT: as many as one statement can bind on this
+    backend (999 parameters on SQLite, so 249), up to 1000.
+    """
+    fields = [field for field in Notification._meta.concrete_fields if not field.primary_key]
+    return min(1000, connection.ops.bulk_batch_size(fields, notifications))
+
+
+def process_events(events):
+    """
+    Turn a batch of events into notifications, inserted in as few
+    statements as the backend allows, and bump the recipients' unread
+    counters.
+    """
+    by_kind = {}
+    for event in events:
+        by_kind.setdefault(event.kind, set()).add(event.object_id)
+
+    notifications = []
+    if NotificationEvent.COMMENT_CREATED in by_kind:
+        notifications += resolve_comment_notifications(by_kind[NotificationEvent.COMMENT_CREATED])
+    if NotificationEvent.POST_CREATED in by_kind:
+        notifications += resolve_post_notifications(by_kind[NotificationEvent.POST_CREATED], updated=False)
+    if NotificationEvent.POST_UPDATED in by_kind:
+        notifications += resolve_post_notifications(by_kind[NotificationEvent.POST_UPDATED], updated=True)
+
+    with transaction.atomic():
+        notifications = Notification.objects.bulk_create(notifications, batch_size=insert_batch_size(notifications))
+        add_unread(Counter(notification.user_id for notification in notifications))
+        notifications_bulk_created.send(sender=Notification, notifications=notifications)
+    return notifications
+
+
+class DatabaseQueue:
+    """
+    Events are rows in the NotificationEvent table, so they commit or roll
+    back with the change that produced them and survive restarts.
+
+    When a batch fails, its events are retried one by one so the others are
+    still delivered. A failing event stays queued for the next drain and
+    after `max_attempts` failures is dead-lettered: kept, with `failed_at`
+    set, but no longer taken.
+    """
+
+    def __init__(self, max_attempts=5):
+        self.max_attempts = max_attempts
+
+    def put(self, events):
+        NotificationEvent.objects.bulk_create(
+            NotificationEvent(kind=event.kind, object_id=event.object_id) for event in events
+        )
+
+    def drain(self, batch_size=500):
+        """
+        Process one batch and return the number of events consumed:
+        delivered or dead-lettered.
+        """
+        with transaction.atomic():
+            pending = NotificationEvent.objects.filter(failed_at=None).order_by('pk')
+            if connection.features.has_select_for_update_skip_locked:
+                pending = pending.select_for_update(skip_locked=True)
+            batch = list(pending[:batch_size])
+            if not batch:
+                return 0
+            try:
+                with transaction.atomic():
+                    process_events(batch)
+                delivered = batch
+            except Exception:
+                logger.exception('Failed to deliver %d notification events; retrying them one by one', len(batch))
+                delivered = self.process_each(batch)
+            NotificationEvent.objects.filter(pk__in=[event.pk for event in delivered]).delete()
+        return len(delivered) + sum(event.failed_at is not None for event in batch)
+
+    def process_each(self, batch):
+        delivered = []
+        for event in batch:
+            try:
+                with transaction.atomic():
+                    process_events([event])
+            except Exception:
+                self.record_failure(event)
+            else:
+                delivered.append(event)
+        return delivered
+
+    def record_failure(self, event):
+        event.attempts += 1
+        if event.attempts >= self.max_attempts:
+            event.failed_at = timezone.now()
+            logger.exception('Dead-lettered notification event %d (%s %d) after %d attempts',
+                             event.pk, event.kind, event.object_id, event.attempts)
+        NotificationEvent.objects.filter(pk=event.pk).update(attempts=event.attempts, failed_at=event.failed_at)
+
+
+class InProcessQueue:
+    """
+    Events go to a background thread in this process once the producing
+    transaction commits. Nothing is persisted: events still queued when the
+    process exits are lost.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, events):
+        events = list(events)
+        transaction.on_commit(lambda: self.enqueue(events))
+
+    def enqueue(self, events):
+        for event in events:
+            self.queue.put(event)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='notification-worker', daemon=True)
+                self.thread.start()
+
+    def take_batch(self, timeout=None):
+        batch = [self.queue.get(timeout=timeout)]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def drain(self, batch_size=None):
+        try:
+            batch = self.take_batch(timeout=0)
+        except queue.Empty:
+            return 0
+        process_events(batch)
+        return len(batch)
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            close_old_connections()
+            try:
+                process_events(batch)
+            except Exception:
+                logger.exception('Failed to deliver %d notification events', len(batch))
+            finally:
+                close_old_connections()
+
+
+class SynchronousQueue:
+    """
+    Deliver right after the producing transaction commits, in the request
+    thread. Useful for development and tests.
+    """
+
+    def put(self, events):
+        events = list(events)
+        transaction.on_commit(lambda: process_events(events))
+
+    def drain(self, batch_size=None):
+        return 0
+
+
+QUEUES = {
+    'db': DatabaseQueue,
+    'memory': InProcessQueue,
+    'sync': SynchronousQueue,
+}
+
+_queue = None
+_queue_name = None
+
+
+def get_queue():
+    global _queue, _queue_name
+    name = getattr(settings, 'NOTIFICATION_QUEUE', 'db')
+    if _queue is None or _queue_name != name:
+        _queue, _queue_name = QUEUES[name](), name
+    return _queue
+
+
+def enqueue(kind, object_ids):
+    get_queue().put(Event(kind, object_id) for object_id in object_ids)
@@ -1,9 +1,25 @@
 # serializers.py
 
 from rest_framework import serializers
-from .models import Subscription
+from .models import Notification, Subscription
 
 class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
         fields = '__all__'
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ('id', 'message', 'created_at', 'is_read')
+        read_only_fields = fields
+
+class MarkReadSerializer(serializers.Serializer):
+    up_to_id = serializers.IntegerField(required=False, min_value=1)
+    before = serializers.DateTimeField(required=False)
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=1000)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError('Provide up_to_id, before or ids.')
+        return attrs
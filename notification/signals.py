@@ -1,12 +1,48 @@
 # signals.py
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import Notification
-from post.models import Comment
+from .inbox import add_unread, remove_unread
+from .models import Notification, NotificationEvent
+from .pipeline import enqueue, notifications_bulk_created
+from .streams import COMMENTS, NOTIFICATIONS
+from post.models import Comment, Post
+from post.signals import posts_bulk_created
 
 @receiver(post_save, sender=Comment)
-def send_comment_notification(sender, instance, created, **kwargs):
-    if created:
-        post_author = instance.post.author
-        Notification.objects.create(user=post_author, message=f'New comment on your post: {instance.text}')
+def send_comment_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue(NotificationEvent.COMMENT_CREATED, [instance.pk])
+
+@receiver(post_save, sender=Comment)
+def stream_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        COMMENTS.publish([instance])
+
+@receiver(post_save, sender=Post)
+def send_post_notification(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        enqueue(NotificationEvent.POST_CREATED if created else NotificationEvent.POST_UPDATED, [instance.pk])
+
+@receiver(posts_bulk_created, sender=Post)
+def send_bulk_post_notification(sender, posts, **kwargs):
+    enqueue(NotificationEvent.POST_CREATED, [post.pk for post in posts])
+
+@receiver(post_save, sender=Notification)
+def count_unread_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not instance.is_read:
+        add_unread({instance.user_id: 1})
+
+@receiver(post_save, sender=Notification)
+def stream_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        NOTIFICATIONS.publish([instance])
+
+@receiver(notifications_bulk_created, sender=Notification)
+def stream_bulk_created_notifications(sender, notifications, **kwargs):
+    NOTIFICATIONS.publish(notifications)
+
+@receiver(post_delete, sender=Notification)
+def uncount_unread_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        remove_unread(instance.user_id, 1)
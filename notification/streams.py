@@ -0,0 +1,326 @@
+"""
+Server-Sent Event streams of new comments on a post and new notifications
+for a user.
+
+Saved rows reach open streams through an in-process hub once their
+transaction commits (see notification/signals.py). Every stream also reads
+the database: on connect to resume after the client's Last-Event-ID,
+when it fell more than MAX_PENDING events behind, and after POLL_INTERVAL
+idle seconds, which is how it sees rows written by other processes such
+as run_notification_worker. A connection therefore holds at most
+MAX_PENDING pending events and never more than BATCH_SIZE rows, and
+closes after MAX_DURATION seconds so the client reconnects and resumes.
+
+Rows reach the hub in commit order, which need not be primary key order:
+with concurrent writers, id 10 can commit after id 11. A stream therefore
+remembers the REORDER_WINDOW highest ids it sent rather than only the
+highest, and reads the database from below them, so a late lower id is
+still sent once. An id is given up only when it is still uncommitted
+after REORDER_WINDOW higher ones were sent.
+
+Under ASGI a stream is an async generator on the event loop; under WSGI
+it occupies a worker thread for as long as it stays open.
+"""
+import asyncio
+import heapq
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.renderers import BaseRenderer
+
+from Blog.renderers import FastJSONRenderer
+from post.models import Comment
+from post.serializers import CommentSerializer
+from .models import Notification
+from .serializers import NotificationSerializer
+
+
+KEEPALIVE = b': keepalive\n\n'
+
+
+def get_event_stream_settings():
+    return {
+        'MAX_PENDING': 100,
+        'BATCH_SIZE': 100,
+        'POLL_INTERVAL': 10,
+        'MAX_DURATION': 300,
+        'RETRY': 3000,
+        'REORDER_WINDOW': 100,
+        **getattr(settings, 'EVENT_STREAMS', {}),
+    }
+
+
+def format_event(event_id, event, data):
+    return b'id: %d\nevent: %s\ndata: %s\n\n' % (event_id, event.encode(), FastJSONRenderer().render(data))
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets stream views accept `Accept: text/event-stream`. Streams are sent
+    as they are; anything else, such as an error, becomes an `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b'event: error\ndata: %s\n\n' % FastJSONRenderer().render(data)
+
+
+class Subscription:
+    """
+    The events published to one connection's channel, waiting to be sent.
+    Past `max_pending` they are dropped and the subscription is marked
+    lagged, so the stream re-reads what it missed from the database.
+    Pass the event loop of an async stream so publishers in other threads
+    can wake it.
+    """
+
+    def __init__(self, max_pending, loop=None):
+        self.max_pending = max_pending
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.events = deque()
+        self.lagged = False
+        self.ready = asyncio.Event() if loop is not None else threading.Event()
+
+    def push(self, event_id, frame):
+        with self.lock:
+            if len(self.events) >= self.max_pending:
+                self.events.clear()
+                self.lagged = True
+            else:
+                self.events.append((event_id, frame))
+        if self.loop is None:
+            self.ready.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            # The loop closed under a stream that had not unsubscribed yet.
+            pass
+
+    def take(self):
+        """
+        Return the pending events and whether any were dropped.
+        """
+        # Cleared first: an event pushed from now on sets it again.
+        self.ready.clear()
+        with self.lock:
+            events, self.events = list(self.events), deque()
+            lagged, self.lagged = self.lagged, False
+        return events, lagged
+
+
+class Hub:
+    """
+    In-process publish/subscribe of SSE frames by channel.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def subscribe(self, channel, subscription):
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+
+    def unsubscribe(self, channel, subscription):
+        with self.lock:
+            subscriptions = self.channels.get(channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.channels[channel]
+
+    def subscriber_count(self, channel):
+        with self.lock:
+            return len(self.channels.get(channel, ()))
+
+    def publish(self, channel, event_id, frame):
+        with self.lock:
+            subscriptions = list(self.channels.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.push(event_id, frame)
+
+
+hub = Hub()
+
+
+class StreamSource:
+    """
+    Rows of `model` streamed per value of `key_field`, in primary key
+    order, as `event` events rendered by `serializer_class`.
+    """
+
+    def __init__(self, name, event, model, key_field, serializer_class):
+        self.name = name
+        self.event = event
+        self.model = model
+        self.key_field = key_field
+        self.serializer_class = serializer_class
+
+    def channel(self, key):
+        return (self.name, key)
+
+    def frame(self, instance):
+        return format_event(instance.pk, self.event, self.serializer_class(instance).data)
+
+    def queryset(self, key):
+        return self.model._default_manager.filter(**{self.key_field: key})
+
+    def page(self, key, after, limit):
+        return self.queryset(key).filter(pk__gt=after).order_by('pk')[:limit]
+
+    def latest(self, key):
+        return self.queryset(key).order_by('-pk').values_list('pk', flat=True)
+
+    def publish(self, instances):
+        """
+        Send `instances` to the open streams of their channels once the
+        current transaction commits.
+        """
+        instances = [instance for instance in instances if instance.pk is not None]
+        if instances:
+            transaction.on_commit(lambda: self.send(instances))
+
+    def send(self, instances):
+        for instance in instances:
+            channel = self.channel(getattr(instance, self.key_field))
+            # Only serialized when someone is listening.
+            if hub.subscriber_count(channel):
+                hub.publish(channel, instance.pk, self.frame(instance))
+
+
+COMMENTS = StreamSource('comments', 'comment', Comment, 'post_id', CommentSerializer)
+NOTIFICATIONS = StreamSource('notifications', 'notification', Notification, 'user_id', NotificationSerializer)
+
+
+class EventStream:
+    """
+    The SSE stream of `source` for `key`, starting after `last_event_id`,
+    or after the newest row when it is None. `events()` is the WSGI
+    iterator, `aevents()` the ASGI one.
+
+    Every id up to `floor` counts as sent; above it, `sent` holds the ids
+    that were, at most REORDER_WINDOW of them.
+    """
+
+    def __init__(self, source, key, last_event_id=None):
+        self.source = source
+        self.key = key
+        if last_event_id is None:
+            # Read here, in the view, so rows saved before the response
+            # starts streaming are still sent.
+            last_event_id = source.latest(key).first() or 0
+        self.floor = last_event_id
+        self.sent = set()
+        self.window = []
+        self.options = get_event_stream_settings()
+
+    def opening(self):
+        return b'retry: %d\n\n' % self.options['RETRY']
+
+    def claim(self, event_id):
+        """
+        Record `event_id` as sent and return True, or False if it already
+        was.
+        """
+        if event_id <= self.floor or event_id in self.sent:
+            return False
+        self.sent.add(event_id)
+        heapq.heappush(self.window, event_id)
+        if len(self.window) > self.options['REORDER_WINDOW']:
+            self.floor = heapq.heappop(self.window)
+            self.sent.discard(self.floor)
+        return True
+
+    def deliver(self, events):
+        for event_id, frame in events:
+            if self.claim(event_id):
+                yield frame
+
+    def unsent(self, rows):
+        for row in rows:
+            if self.claim(row.pk):
+                yield self.source.frame(row)
+
+    def expired(self, started):
+        duration = self.options['MAX_DURATION']
+        return duration and time.monotonic() - started >= duration
+
+    def events(self):
+        subscription = Subscription(self.options['MAX_PENDING'])
+        channel = self.source.channel(self.key)
+        hub.subscribe(channel, subscription)
+        started = time.monotonic()
+        try:
+            yield self.opening()
+            # Subscribed first, so nothing saved in between is missed.
+            yield from self.catch_up()
+            while not self.expired(started):
+                events, lagged = subscription.take()
+                if lagged:
+                    yield from self.catch_up()
+                yield from self.deliver(events)
+                if not subscription.ready.wait(self.options['POLL_INTERVAL']):
+                    sent = False
+                    for frame in self.catch_up():
+                        sent = True
+                        yield frame
+                    if not sent:
+                        yield KEEPALIVE
+        finally:
+            hub.unsubscribe(channel, subscription)
+
+    def catch_up(self):
+        # From the floor: rows committed late, below ids already sent, are
+        # only found there.
+        batch_size, after = self.options['BATCH_SIZE'], self.floor
+        while True:
+            rows = list(self.source.page(self.key, after, batch_size))
+            yield from self.unsent(rows)
+            if len(rows) < batch_size:
+                return
+            after = rows[-1].pk
+
+    async def aevents(self):
+        subscription = Subscription(self.options['MAX_PENDING'], loop=asyncio.get_running_loop())
+        channel = self.source.channel(self.key)
+        hub.subscribe(channel, subscription)
+        started = time.monotonic()
+        try:
+            yield self.opening()
+            async for frame in self.acatch_up():
+                yield frame
+            while not self.expired(started):
+                events, lagged = subscription.take()
+                if lagged:
+                    async for frame in self.acatch_up():
+                        yield frame
+                for frame in self.deliver(events):
+                    yield frame
+                try:
+                    await asyncio.wait_for(subscription.ready.wait(), self.options['POLL_INTERVAL'])
+                except asyncio.TimeoutError:
+                    sent = False
+                    async for frame in self.acatch_up():
+                        sent = True
+                        yield frame
+                    if not sent:
+                        yield KEEPALIVE
+        finally:
+            hub.unsubscribe(channel, subscription)
+
+    async def acatch_up(self):
+        batch_size, after = self.options['BATCH_SIZE'], self.floor
+        while True:
+            rows = [row async for row in self.source.page(self.key, after, batch_size)]
+            for frame in self.unsent(rows):
+                yield frame
+            if len(rows) < batch_size:
+                return
+            after = rows[-1].pk
@@ -1,3 +1,271 @@
-from django.test import TestCase
+import math
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from post.models import Category, Comment, Post
+from post.serializers import CommentSerializer
+from user.models import User
+from .inbox import get_unread_count
+from .models import Notification, NotificationEvent, NotificationInbox, Subscription
+from .pipeline import get_queue, insert_batch_size, notifications_bulk_created
+from .streams import COMMENTS, KEEPALIVE, format_event, hub
+from . import streams
+
+
+class NotificationPipelineTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.category = Category.objects.create(name='News')
+
+    def create_post(self, title='A post'):
+        post = Post.objects.create(title=title, content='Content.', author=self.author)
+        post.categories.add(self.category)
+        return post
+
+    def test_comment_is_queued_and_delivered_by_worker(self):
+        post = self.create_post()
+        NotificationEvent.objects.all().delete()
+
+        Comment.objects.create(post=post, author=self.reader, text='Nice post')
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+
+        call_command('run_notification_worker', once=True, stdout=StringIO())
+        notification = Notification.objects.get()
+        self.assertEqual(notification.user, self.author)
+        self.assertEqual(notification.message, 'New comment on your post: Nice post')
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_failing_event_does_not_block_the_queue(self):
+        def fail(sender, notifications, **kwargs):
+            if any('Broken' in notification.message for notification in notifications):
+                raise RuntimeError('Delivery failed')
+        notifications_bulk_created.connect(fail)
+        self.addCleanup(notifications_bulk_created.disconnect, fail)
+        post = self.create_post()
+        NotificationEvent.objects.all().delete()
+        Comment.objects.create(post=post, author=self.reader, text='Broken')
+        Comment.objects.create(post=post, author=self.reader, text='Fine')
+
+        # The worker survives, delivers the other event, and retries the
+        # failing one until the queue has nothing else to offer.
+        with self.assertLogs('notification.pipeline', 'ERROR'):
+            call_command('run_notification_worker', once=True, stdout=StringIO())
+        self.assertEqual(Notification.objects.get().message, 'New comment on your post: Fine')
+        event = NotificationEvent.objects.get()
+        self.assertEqual((event.attempts, event.failed_at), (2, None))
+
+        with self.assertLogs('notification.pipeline', 'ERROR') as logs:
+            self.assertEqual([get_queue().drain() for _ in range(4)], [0, 0, 1, 0])
+        self.assertIn('Dead-lettered notification event', logs.output[-1])
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 5)
+        self.assertIsNotNone(event.failed_at)
+
+    def test_post_fan_out_matches_subscriptions(self):
+        Subscription.objects.create(user=self.reader, category='News')
+        sports = User.objects.create_user(username='sports', password='pass')
+        Subscription.objects.create(user=sports, category='Sports')
+        everything = User.objects.create_user(username='everything', password='pass')
+        Subscription.objects.create(user=everything, category=None, is_post_update=True)
+        # Authors are not notified about their own posts.
+        Subscription.objects.create(user=self.author, category='News')
+
+        post = self.create_post('Breaking')
+        get_queue().drain()
+        self.assertEqual(
+            set(Notification.objects.values_list('user__username', 'message')),
+            {('reader', 'New post: Breaking'), ('everything', 'New post: Breaking')},
+        )
+
+        Notification.objects.all().delete()
+        post.title = 'Breaking, updated'
+        post.save()
+        get_queue().drain()
+        self.assertEqual(list(Notification.objects.values_list('user__username', flat=True)), ['everything'])
+
+    def test_fan_out_query_count_grows_only_per_insert_batch(self):
+        subscribers = User.objects.bulk_create(User(username=f'subscriber{i}') for i in range(50))
+        Subscription.objects.bulk_create(Subscription(user=user, category='News') for user in subscribers)
+        for i in range(5):
+            self.create_post(f'Post {i}')
+
+        # Select and lock the batch, posts, categories, subscriptions, the
+        # inserts, two inbox counter writes and the batch delete, inside
+        # savepoints. The 250 notifications take one insert per batch the
+        # backend can bind (two on SQLite), not one per subscriber.
+        batch_size = insert_batch_size([Notification()] * 250)
+        with self.assertNumQueries(13 + math.ceil(250 / batch_size)):
+            get_queue().drain()
+        self.assertEqual(Notification.objects.count(), 250)
+
+    @override_settings(NOTIFICATION_QUEUE='sync')
+    def test_sync_queue_delivers_on_commit(self):
+        post = self.create_post()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=post, author=self.reader, text='Hello')
+        self.assertEqual(Notification.objects.get().user, self.author)
+
+
+class NotificationInboxTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        refresh = RefreshToken.for_user(self.user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {refresh.access_token}'}
+        self.notifications = [
+            Notification.objects.create(user=self.user, message=f'Message {i}') for i in range(5)
+        ]
+        Notification.objects.create(user=self.other, message='Not yours')
+
+    def test_inbox_lists_own_notifications_newest_first(self):
+        response = self.client.get('/api/notifications/?page_size=3', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [n['id'] for n in response.data['results']],
+            [n.pk for n in reversed(self.notifications)][:3],
+        )
+        response = self.client.get(response.data['next'], **self.headers)
+        self.assertEqual([n['id'] for n in response.data['results']], [n.pk for n in self.notifications[1::-1]])
+
+    def test_unread_count_is_a_single_lookup(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/notifications/unread_count/', **self.headers)
+        self.assertEqual(response.data, {'unread_count': 5})
+
+    def test_mark_read_by_id_range(self):
+        response = self.client.post(
+            '/api/notifications/mark_read/', {'up_to_id': self.notifications[2].pk}, **self.headers)
+        self.assertEqual(response.data, {'updated': 3, 'unread_count': 2})
+
+        response = self.client.get('/api/notifications/?is_read=false', **self.headers)
+        self.assertEqual([n['id'] for n in response.data['results']], [n.pk for n in self.notifications[:2:-1]])
+
+        # Marking again is a no-op and the counter never goes negative.
+        response = self.client.post(
+            '/api/notifications/mark_read/', {'up_to_id': self.notifications[2].pk}, **self.headers)
+        self.assertEqual(response.data, {'updated': 0, 'unread_count': 2})
+
+    def test_mark_read_requires_a_selector(self):
+        response = self.client.post('/api/notifications/mark_read/', {}, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_counter_follows_pipeline_and_deletes(self):
+        post = Post.objects.create(title='Post', content='Content.', author=self.user)
+        Comment.objects.create(post=post, author=self.other, text='Hi')
+        get_queue().drain()
+        self.assertEqual(get_unread_count(self.user.pk), 6)
+
+        self.notifications[0].delete()
+        self.assertEqual(NotificationInbox.objects.get(user=self.user).unread_count, 5)
+
+
+@override_settings(EVENT_STREAMS={'POLL_INTERVAL': 0.05, 'MAX_DURATION': 10})
+class EventStreamTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.post = Post.objects.create(title='Post', content='Content.', author=self.author)
+        refresh = RefreshToken.for_user(self.author)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {refresh.access_token}'}
+        self.path = f'/api/posts/{self.post.pk}/comments/stream/'
+
+    def comment(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Comment.objects.create(post=self.post, author=self.reader, text=text)
+
+    def open(self, path, **extra):
+        response = self.client.get(path, HTTP_ACCEPT='text/event-stream', **extra)
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        events = iter(response.streaming_content)
+        self.assertEqual(next(events), b'retry: 3000\n\n')
+        return response, events
+
+    def next_event(self, events):
+        return next(chunk for chunk in events if chunk != KEEPALIVE)
+
+    def test_comment_stream_resumes_then_follows_new_comments(self):
+        first, second = self.comment('First'), self.comment('Second')
+        response, events = self.open(self.path, HTTP_LAST_EVENT_ID=str(first.pk))
+        self.assertEqual(self.next_event(events), format_event(second.pk, 'comment', CommentSerializer(second).data))
+
+        third = self.comment('Third')
+        self.assertEqual(self.next_event(events), format_event(third.pk, 'comment', CommentSerializer(third).data))
+
+        channel = COMMENTS.channel(self.post.pk)
+        self.assertEqual(hub.subscriber_count(channel), 1)
+        response.close()
+        self.assertEqual(hub.subscriber_count(channel), 0)
+
+    def test_new_stream_starts_after_the_newest_comment(self):
+        self.comment('Old')
+        response, events = self.open(self.path)
+        new = self.comment('New')
+        self.assertTrue(self.next_event(events).startswith(b'id: %d\n' % new.pk))
+
+    @override_settings(EVENT_STREAMS={'MAX_PENDING': 2, 'POLL_INTERVAL': 60})
+    def test_lagging_stream_catches_up_from_the_database(self):
+        response, events = self.open(self.path)
+        comments = [self.comment(f'Comment {i}') for i in range(5)]
+        received = [self.next_event(events) for _ in comments]
+        self.assertEqual([int(frame.split(b'\n')[0][4:]) for frame in received], [c.pk for c in comments])
+
+        subscription = streams.Subscription(max_pending=2)
+        for event_id in range(3):
+            subscription.push(event_id, b'')
+        self.assertEqual(subscription.take(), ([], True))
+
+    @override_settings(EVENT_STREAMS={'REORDER_WINDOW': 2})
+    def test_ids_committed_out_of_order_are_sent_once(self):
+        stream = streams.EventStream(COMMENTS, self.post.pk, last_event_id=0)
+        lower, higher = Comment.objects.bulk_create(
+            [Comment(post=self.post, author=self.reader, text=text) for text in ('Lower', 'Higher')])
+        # The higher id is pushed first; the lower one is still read back.
+        self.assertEqual(list(stream.deliver([(higher.pk, b'higher')])), [b'higher'])
+        self.assertEqual([frame.split(b'\n')[0] for frame in stream.catch_up()], [b'id: %d' % lower.pk])
+        self.assertEqual(list(stream.deliver([(lower.pk, b'lower'), (higher.pk, b'higher')])), [])
+
+        # Past the window, the lowest id sent becomes the floor.
+        newest, = Comment.objects.bulk_create([Comment(post=self.post, author=self.reader, text='Newest')])
+        self.assertEqual(len(list(stream.catch_up())), 1)
+        self.assertEqual(stream.floor, lower.pk)
+        self.assertEqual(stream.sent, {higher.pk, newest.pk})
+
+    def test_rows_from_other_processes_arrive_by_polling(self):
+        response, events = self.open(self.path)
+        # bulk_create sends no signal, like a write in another process.
+        comment, = Comment.objects.bulk_create([Comment(post=self.post, author=self.reader, text='Elsewhere')])
+        self.assertTrue(self.next_event(events).startswith(b'id: %d\nevent: comment\n' % comment.pk))
+
+    def test_notification_stream(self):
+        self.assertEqual(self.client.get('/api/notifications/stream/', HTTP_ACCEPT='text/event-stream').status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get('/api/posts/0/comments/stream/').status_code, status.HTTP_404_NOT_FOUND)
+
+        response, events = self.open('/api/notifications/stream/', **self.headers)
+        Comment.objects.create(post=self.post, author=self.reader, text='Hello')
+        with self.captureOnCommitCallbacks(execute=True):
+            get_queue().drain()
+        frame = self.next_event(events)
+        notification = Notification.objects.get(user=self.author)
+        self.assertTrue(frame.startswith(b'id: %d\nevent: notification\n' % notification.pk))
+        self.assertIn(b'New comment on your post: Hello', frame)
+
+    async def test_async_stream(self):
+        response = await self.async_client.get(self.path, headers={'Accept': 'text/event-stream'})
+        events = aiter(response.streaming_content)
+        self.assertEqual(await anext(events), b'retry: 3000\n\n')
+        comment = await sync_to_async(self.comment)('Live')
+        frame = await anext(events)
+        while frame == KEEPALIVE:
+            frame = await anext(events)
+        self.assertTrue(frame.startswith(b'id: %d\n' % comment.pk))
+        await events.aclose()
@@ -2,11 +2,14 @@
 
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SubscriptionViewSet
+from .views import CommentStreamView, NotificationStreamView, NotificationViewSet, SubscriptionViewSet
 
 router = DefaultRouter()
 router.register(r'subscriptions', SubscriptionViewSet, basename='subscription')
+router.register(r'notifications', NotificationViewSet, basename='notification')
 
 urlpatterns = [
+    path('api/posts/<int:post_pk>/comments/stream/', CommentStreamView.as_view(), name='post-comment-stream'),
+    path('api/notifications/stream/', NotificationStreamView.as_view(), name='notification-stream'),
     path('api/', include(router.urls)),
 ]
@@ -1,14 +1,26 @@
 # views.py
 
+from Blog.instrumentation import InstrumentedViewMixin
+from Blog.replicas import ReplicaReadMixin
+from Blog.renderers import FastJSONRenderer
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Subscription
-from .serializers import SubscriptionSerializer
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+from .inbox import get_unread_count, mark_read
+from .models import Notification, Subscription
+from .serializers import MarkReadSerializer, NotificationSerializer, SubscriptionSerializer
+from .streams import COMMENTS, NOTIFICATIONS, EventStream, EventStreamRenderer
+from post.models import Post
+from post.pagination import KeysetPagination
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from django.utils.translation import activate
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(InstrumentedViewMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     activate('ar')    
     queryset = Subscription.objects.all()
     serializer_class = SubscriptionSerializer
@@ -21,3 +33,83 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         serializer.save(user=request.user)
         return Response(serializer.data, status=201)
+
+
+class NotificationPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+
+
+class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Notification.objects.all()
+    serializer_class = NotificationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = NotificationPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['is_read']
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user_id=self.request.user.pk)
+
+    @action(detail=False)
+    def unread_count(self, request):
+        return Response({'unread_count': get_unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'], serializer_class=MarkReadSerializer)
+    def mark_read(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = mark_read(request.user.pk, **serializer.validated_data)
+        return Response({'updated': updated, 'unread_count': get_unread_count(request.user.pk)})
+
+
+def get_last_event_id(request):
+    """
+    The id the client last received, from the Last-Event-ID header
+    EventSource sends on reconnect or a `last_event_id` parameter.
+    """
+    value = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('last_event_id')
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class EventStreamView(APIView):
+    """
+    Serve the EventStream `get_stream()` returns as text/event-stream,
+    asynchronously under ASGI.
+    """
+    renderer_classes = [EventStreamRenderer, FastJSONRenderer]
+
+    def get_stream(self, request, **kwargs):
+        raise NotImplementedError
+
+    def get(self, request, **kwargs):
+        stream = self.get_stream(request, **kwargs)
+        events = stream.aevents() if isinstance(request._request, ASGIRequest) else stream.events()
+        response = StreamingHttpResponse(events, content_type='text/event-stream; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class CommentStreamView(EventStreamView):
+    """
+    New comments on a post.
+    """
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get_stream(self, request, post_pk):
+        post = get_object_or_404(Post.objects.only('id'), pk=post_pk)
+        return EventStream(COMMENTS, post.pk, get_last_event_id(request))
+
+
+class NotificationStreamView(EventStreamView):
+    """
+    New notifications for the current user.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_stream(self, request):
+        return EventStream(NOTIFICATIONS, request.user.pk, get_last_event_id(request))
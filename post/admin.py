@@ -5,7 +5,11 @@ from post.models import *
 
 admin.site.register(Post)
 admin.site.register(Category)
+admin.site.register(Tag)
 admin.site.register(Image)
+admin.site.register(ImageVariant)
 admin.site.register(Attachment)
+admin.site.register(Upload)
+admin.site.register(Blob)
 admin.site.register(Comment)
 
@@ -0,0 +1,205 @@
+"""
+Async versions of the busiest post endpoints, routed by Blog/asgi_urls.py
+when the project runs under ASGI (see Blog/asgi.py).
+
+They drive PostViewSet and CommentViewSet instead of reimplementing them:
+the view set still picks the serializer, builds the queryset, paginates,
+keys the cache and lists the permissions. What changes is the I/O. Rows
+are read and written through Django's async ORM, and authentication and
+permission checks that need no database run on the event loop, so a slow
+client holds a coroutine rather than a thread. Requests these views do not
+serve (other methods, filtered or searched lists, the browsable API) are
+handed to the regular view in a thread.
+"""
+from collections.abc import Mapping
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.urls import resolve
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from user.authentication import aauthenticate_request
+
+from .models import Comment, Post
+from .permissions import acheck_permissions
+from .views import CommentViewSet, PostViewSet, toggle_reaction
+
+
+SYNC_URLCONF = 'Blog.urls'
+
+
+async def delegate(request):
+    """
+    Answer `request` with the view Blog.urls routes it to, rendered in the
+    same thread.
+    """
+    match = resolve(request.path_info, urlconf=SYNC_URLCONF)
+    request.resolver_match = match
+
+    def respond():
+        response = match.func(request, *match.args, **match.kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+
+    return await sync_to_async(respond)()
+
+
+class AsyncViewSetView:
+    """
+    Serve some actions of `viewset` asynchronously. `actions` maps request
+    methods to actions, each implemented as
+    `async def <action>(self, view, request, **kwargs)` returning a DRF
+    Response; `view` is the view set, set up as for that request.
+    """
+    viewset = None
+    basename = None
+    detail = False
+    actions = {}
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        async def view(request, *args, **kwargs):
+            return await cls(**initkwargs).dispatch(request, *args, **kwargs)
+
+        # csrf_exempt() only wraps async views from Django 5.0 on. As with
+        # APIView, session authentication enforces CSRF itself.
+        view.csrf_exempt = True
+        return view
+
+    def handles(self, view, request):
+        return True
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        action = self.actions.get(method)
+        if action is None:
+            return await delegate(request)
+
+        view = self.viewset(action_map={method: action}, basename=self.basename, detail=self.detail, format_kwarg=None)
+        view.args, view.kwargs = args, kwargs
+        view.request = drf_request = view.initialize_request(request)
+        view.headers = view.default_response_headers
+        renderer, media_type = view.perform_content_negotiation(drf_request, force=True)
+        if not isinstance(renderer, JSONRenderer) or not self.handles(view, drf_request):
+            return await delegate(request)
+
+        try:
+            drf_request.accepted_renderer, drf_request.accepted_media_type = renderer, media_type
+            drf_request.version, drf_request.versioning_scheme = view.determine_version(drf_request)
+            await aauthenticate_request(drf_request)
+            await acheck_permissions(view, drf_request)
+            view.check_throttles(drf_request)
+            view.set_query_budget()
+            view.route_reads(drf_request)
+            response = await getattr(self, action)(view, drf_request, **kwargs)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        return self.finalize_response(view, drf_request, response)
+
+    def finalize_response(self, view, request, response):
+        response = view.finalize_response(request, response)
+        if not isinstance(response, Response):
+            return response
+        # Django renders a response left unrendered in a thread.
+        rendered = HttpResponse(response.rendered_content, status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
+
+    async def aget_object(self, view, request, queryset, **lookup):
+        """
+        GenericAPIView.get_object() through the async ORM.
+        """
+        try:
+            obj = await queryset.aget(**lookup)
+        except queryset.model.DoesNotExist:
+            raise Http404
+        await acheck_permissions(view, request, obj)
+        return obj
+
+
+class PostListView(AsyncViewSetView):
+    viewset = PostViewSet
+    basename = 'post'
+    actions = {'get': 'list'}
+
+    def handles(self, view, request):
+        # Filters and searches, and the feeds behind them, stay synchronous.
+        params = {view.paginator.cursor_query_param, view.paginator.page_size_query_param, 'fields', 'expand'}
+        return set(request.query_params) <= params
+
+    async def list(self, view, request):
+        async def build(request):
+            queryset = view.get_queryset()
+            page = await view.paginator.apaginate_queryset(queryset, request, view=view)
+            if page is None:
+                return Response(view.get_serializer([post async for post in queryset], many=True).data)
+            return view.paginator.get_paginated_response(view.get_serializer(page, many=True).data)
+
+        return await view.aget_cached_response(view.get_generation_keys(), build, request)
+
+
+class PostDetailView(AsyncViewSetView):
+    viewset = PostViewSet
+    basename = 'post'
+    detail = True
+    actions = {'get': 'retrieve'}
+
+    def handles(self, view, request):
+        return set(request.query_params) <= {'fields', 'expand'}
+
+    async def retrieve(self, view, request, pk):
+        async def build(request):
+            post = await self.aget_object(view, request, view.get_queryset(), pk=pk)
+            return Response(view.get_serializer(post).data)
+
+        return await view.aget_cached_response(view.get_generation_keys(), build, request)
+
+
+class PostReactionView(AsyncViewSetView):
+    viewset = PostViewSet
+    basename = 'post'
+    detail = True
+
+    async def like(self, view, request, pk):
+        return await self.react(view, request, pk, 'likes')
+
+    async def dislike(self, view, request, pk):
+        return await self.react(view, request, pk, 'dislikes')
+
+    async def react(self, view, request, pk, reaction):
+        post = await self.aget_object(view, request, Post.objects.only('id', 'author_id'), pk=pk)
+        # The toggle is one transaction, and transactions cannot span async
+        # ORM calls: it runs in a single thread hop.
+        data = await sync_to_async(toggle_reaction)(post, request.user, reaction)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class CommentListView(AsyncViewSetView):
+    viewset = CommentViewSet
+    actions = {'post': 'create'}
+
+    async def create(self, view, request, post_pk):
+        serializer = view.get_serializer(data=request.data)
+        data = serializer.initial_data
+        if not isinstance(data, Mapping) or data.get('parent') is None:
+            # No query needed, nor for a body that is not an object, which
+            # fails validation.
+            serializer.is_valid(raise_exception=True)
+        else:
+            # Validating a reply loads the comment it replies to.
+            await sync_to_async(serializer.is_valid)(raise_exception=True)
+        if not await Post.objects.filter(pk=post_pk).aexists():
+            raise Http404
+        serializer.instance = await Comment.objects.acreate(
+            post_id=post_pk, author=request.user, **serializer.validated_data,
+        )
+        headers = view.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import tempfile
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import F, ProtectedError
+from django.utils import timezone
+
+from .models import Attachment, Blob, Image
+
+
+logger = logging.getLogger(__name__)
+
+# The file field of each model whose content is stored as blobs.
+FILE_FIELDS = {
+    Attachment: 'file',
+    Image: 'image',
+}
+
+
+class HashedFile(File):
+    """
+    A temporary copy made while hashing. FileSystemStorage moves it into
+    place instead of copying it; other storages read it in chunks.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def blob_name(sha256, filename):
+    extension = os.path.splitext(filename)[1].lower()[:16]
+    return f'{Blob._meta.get_field("file").upload_to}{sha256[:2]}/{sha256}{extension}'
+
+
+def acquire_existing(sha256):
+    """
+    Return the blob holding `sha256` with one more reference, or None.
+    """
+    while True:
+        blob = Blob.objects.filter(sha256=sha256).first()
+        if blob is None:
+            return None
+        # Zero rows means it was garbage collected in between.
+        if Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+            blob.ref_count += 1
+            return blob
+
+
+def acquire(sha256, size, filename, write):
+    """
+    Return the blob holding `sha256` with one more reference, calling
+    `write(name)` to store the content (and get its final name) only when
+    no blob has it yet.
+    """
+    while True:
+        blob = acquire_existing(sha256)
+        if blob is not None:
+            return blob
+
+        name = write(blob_name(sha256, filename))
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(sha256=sha256, size=size, file=name, ref_count=1)
+        except IntegrityError:
+            # Stored concurrently by someone else: keep theirs.
+            Blob._meta.get_field('file').storage.delete(name)
+
+
+def acquire_path(path, sha256, size, filename):
+    """
+    Reference the blob for the local file at `path`, whose SHA-256 is known,
+    storing the file only if the content is new.
+    """
+    storage = Blob._meta.get_field('file').storage
+
+    def write(name):
+        with open(path, 'rb') as f:
+            return storage.save(name, HashedFile(f))
+
+    return acquire(sha256, size, filename, write)
+
+
+def acquire_content(content, filename):
+    """
+    Reference the blob for `content` (a File), hashing it while copying it
+    to a temporary file, so the storage write is skipped for known content.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(prefix='blob-', delete=False) as temp:
+        try:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+            temp.flush()
+            return acquire_path(temp.name, digest.hexdigest(), size, filename)
+        finally:
+            if os.path.exists(temp.name):
+                os.remove(temp.name)
+
+
+def ingest(instance):
+    """
+    Point a new Attachment or Image file at its blob instead of writing a
+    copy of its own. Returns the blob id the row stopped referencing, if
+    any.
+    """
+    field = getattr(instance, FILE_FIELDS[type(instance)])
+    if not field or field._committed:
+        return None
+    previous = instance.blob_id
+    blob = acquire_content(field, os.path.basename(field.name))
+    field.name = blob.file.name
+    field._committed = True
+    instance.blob = blob
+    return previous
+
+
+def release(blob_ids):
+    """
+    Drop one reference per occurrence in `blob_ids` and delete the blobs
+    left unreferenced, with their files once the transaction commits.
+    """
+    counts = Counter(blob_id for blob_id in blob_ids if blob_id is not None)
+    for blob_id, count in counts.items():
+        Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - count)
+    collect_blobs(Blob.objects.filter(pk__in=counts))
+
+
+def collect_blobs(blobs=None):
+    """
+    Delete the unreferenced blobs among `blobs` (all by default) and return
+    how many went.
+    """
+    blobs = (Blob.objects.all() if blobs is None else blobs).filter(ref_count=0)
+    storage = Blob._meta.get_field('file').storage
+    deleted = 0
+    for blob in blobs.only('id', 'file'):
+        try:
+            # Checked again: a reference may have been taken since the query.
+            removed, _ = Blob.objects.filter(pk=blob.pk, ref_count=0).delete()
+        except ProtectedError:
+            logger.error('Blob %s has ref_count 0 but is still referenced', blob.pk)
+            continue
+        if removed:
+            name = blob.file.name
+            transaction.on_commit(lambda name=name: storage.delete(name))
+            deleted += 1
+    return deleted
+
+
+def collect_orphans(attachment_ids=None, image_ids=None, grace=None):
+    """
+    Delete the given Attachments and Images (all by default) that no post
+    uses any more, releasing their blobs. Rows from an upload completed
+    less than `grace` ago are kept, as the post using them may not exist
+    yet.
+    """
+    deleted = 0
+    for model, ids in ((Attachment, attachment_ids), (Image, image_ids)):
+        orphans = model.objects.filter(posts__isnull=True)
+        if ids is not None:
+            orphans = orphans.filter(pk__in=ids)
+        if grace is not None:
+            orphans = orphans.exclude(upload__created_at__gt=timezone.now() - timedelta(seconds=grace))
+        for orphan in orphans:
+            orphan.delete()
+            deleted += 1
+    return deleted
@@ -0,0 +1,165 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.translation import get_language
+from rest_framework import status
+from rest_framework.response import Response
+
+from Blog.replicas import primary_reads_since
+
+
+KEY_PREFIX = 'post-cache'
+GLOBAL_GENERATION = f'{KEY_PREFIX}:generation'
+LIST_GENERATION = f'{KEY_PREFIX}:generation:list'
+
+
+def get_post_cache_settings():
+    return {
+        'ALIAS': 'default',
+        'TIMEOUT': 300,
+        **getattr(settings, 'POST_CACHE', {}),
+    }
+
+
+def get_post_cache():
+    return caches[get_post_cache_settings()['ALIAS']]
+
+
+def post_generation_key(post_id):
+    return f'{KEY_PREFIX}:generation:post:{post_id}'
+
+
+def get_generations(keys):
+    """
+    Return the generation stamp of every key, initialising missing ones.
+
+    A generation is the time (in nanoseconds) of the last change to what
+    the key covers, so it doubles as the Last-Modified date.
+    """
+    cache = get_post_cache()
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        generations.update(cache.get_many(missing))
+    return [generations.get(key, 0) for key in keys]
+
+
+def bump_generations(keys):
+    cache = get_post_cache()
+
+    def bump():
+        now = time.time_ns()
+        cache.set_many({key: now for key in keys}, timeout=None)
+
+    # Bump now so this process stops serving stale pages, and again once the
+    # transaction commits so a read that raced the write cannot re-cache them.
+    bump()
+    transaction.on_commit(bump)
+
+
+def invalidate_posts(post_ids):
+    bump_generations([LIST_GENERATION] + [post_generation_key(pk) for pk in post_ids])
+
+
+def invalidate_all_posts():
+    bump_generations([GLOBAL_GENERATION])
+
+
+class CachedReadMixin:
+    """
+    Serve `list` and `retrieve` from the post cache.
+
+    Entries are keyed by the action, object, active language, normalized
+    query parameters and the generation stamps the response depends on, so
+    bumping a generation (see `invalidate_posts`) makes every affected entry
+    unreachable. Responses carry an ETag and Last-Modified derived from the
+    same stamps and conditional requests get a 304 without serializing.
+    Entries rebuilt just after a change read from the primary database, not
+    a replica that may lag behind it (see Blog/replicas.py).
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(self.get_generation_keys(), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(self.get_generation_keys(), super().retrieve, request, *args, **kwargs)
+
+    def get_generation_keys(self):
+        if self.action == 'list':
+            return [GLOBAL_GENERATION, LIST_GENERATION]
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return [GLOBAL_GENERATION, post_generation_key(lookup)]
+
+    def get_cache_key(self, request, generations):
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        parts = [self.basename, self.action, request.path, get_language() or '', query]
+        parts.extend(str(generation) for generation in generations)
+        digest = hashlib.md5('|'.join(parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+        return f'{KEY_PREFIX}:response:{digest}'
+
+    def get_cache_validators(self, request, generation_keys):
+        """
+        Return the cache key, ETag and Last-Modified timestamp of the
+        response over `generation_keys`.
+        """
+        generations = get_generations(generation_keys)
+        key = self.get_cache_key(request, generations)
+        return key, '"%s"' % key.rsplit(':', 1)[-1], max(generations) // 1_000_000_000
+
+    def get_cached_response(self, generation_keys, handler, request, *args, **kwargs):
+        key, etag, last_modified = self.get_cache_validators(request, generation_keys)
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        cache = get_post_cache()
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+        else:
+            with primary_reads_since(last_modified):
+                response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, get_post_cache_settings()['TIMEOUT'])
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    async def aget_cached_response(self, generation_keys, handler, request, *args, **kwargs):
+        """
+        get_cached_response() for async views, with a coroutine `handler`.
+        The cache itself is read in place: a memory or local-network round
+        trip costs less than handing the request to a thread.
+        """
+        key, etag, last_modified = self.get_cache_validators(request, generation_keys)
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        cache = get_post_cache()
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+        else:
+            with primary_reads_since(last_modified):
+                response = await handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, get_post_cache_settings()['TIMEOUT'])
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,103 @@
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from user.models import User
+from .models import Attachment, Category, Comment, Image, Post, Tag
+from .pagination import build_seek_filter
+
+
+EXPORT_ORDERING = ('pub_date', 'id')
+
+
+def parse_watermark(since_date=None, since_id=None):
+    """
+    Turn the `since_date`/`since_id` strings of an incremental export into
+    a position. Returns None for a full export; raises ValueError when the
+    values are malformed.
+    """
+    if not since_date:
+        if since_id:
+            raise ValueError('since_id requires since_date.')
+        return None
+    pub_date = parse_datetime(since_date)
+    if pub_date is None:
+        raise ValueError(f'Invalid since_date: {since_date!r}')
+    if timezone.is_naive(pub_date):
+        pub_date = timezone.make_aware(pub_date, datetime.timezone.utc)
+    if not since_id:
+        return Q(pub_date__gt=pub_date)
+    return build_seek_filter(EXPORT_ORDERING, [pub_date, int(since_id)])
+
+
+def export_queryset(watermark=None):
+    queryset = Post.objects.order_by(*EXPORT_ORDERING).prefetch_related(
+        Prefetch('categories', queryset=Category.objects.only('id')),
+        Prefetch('tags', queryset=Tag.objects.only('id', 'name')),
+        Prefetch('likes', queryset=User.objects.only('id')),
+        Prefetch('dislikes', queryset=User.objects.only('id')),
+        Prefetch('attachments', queryset=Attachment.objects.only('id', 'file')),
+        Prefetch('images', queryset=Image.objects.only('id', 'image')),
+        Prefetch(
+            'comments',
+            queryset=Comment.objects.only('id', 'post_id', 'author_id', 'parent_id', 'text', 'created_at')
+            .order_by('created_at', 'id'),
+        ),
+    )
+    if watermark is not None:
+        queryset = queryset.filter(watermark)
+    return queryset
+
+
+def export_post(post):
+    return {
+        'id': post.pk,
+        'title': post.title,
+        'content': post.content,
+        'pub_date': post.pub_date,
+        'author': post.author_id,
+        'like_count': post.like_count,
+        'dislike_count': post.dislike_count,
+        'categories': [category.pk for category in post.categories.all()],
+        'tags': [tag.name for tag in post.tags.all()],
+        'likes': [user.pk for user in post.likes.all()],
+        'dislikes': [user.pk for user in post.dislikes.all()],
+        'attachments': [attachment.file.name for attachment in post.attachments.all()],
+        'images': [image.image.name for image in post.images.all()],
+        'comments': [
+            {
+                'id': comment.pk,
+                'author': comment.author_id,
+                'parent': comment.parent_id,
+                'text': comment.text,
+                'created_at': comment.created_at,
+            }
+            for comment in post.comments.all()
+        ],
+    }
+
+
+def iter_ndjson(watermark=None, chunk_size=500):
+    """
+    Yield every post after `watermark` as one JSON line, ordered by
+    (pub_date, id). Rows are fetched `chunk_size` at a time with their
+    relations prefetched per chunk, so memory stays flat however large the
+    table is. The last line's pub_date and id form the next watermark.
+    """
+    for post in export_queryset(watermark).iterator(chunk_size=chunk_size):
+        yield json.dumps(export_post(post), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def iter_json_array(watermark=None, chunk_size=500):
+    """
+    Like `iter_ndjson`, framed as a single JSON array.
+    """
+    separator = '['
+    for line in iter_ndjson(watermark, chunk_size):
+        yield separator + line
+        separator = ','
+    yield '[]\n' if separator == '[' else ']\n'
@@ -0,0 +1,187 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import transaction
+
+from user.models import User
+from .models import Category, FeedEntry, Post, Tag
+from .pagination import invert_ordering, seek_queryset
+
+
+FEED_ORDERING = ('-pub_date', '-post_id')
+
+# Feeds kept for each Post M2M relation, as (field name, FeedEntry kind).
+FEED_RELATIONS = (
+    ('categories', FeedEntry.CATEGORY),
+    ('tags', FeedEntry.TAG),
+)
+
+
+def feed_entries_for(posts):
+    """
+    FeedEntry rows placing `posts` in their author's feed and in the feed
+    of every category and tag they have.
+    """
+    pub_dates = {post.pk: post.pub_date for post in posts}
+    entries = [
+        FeedEntry(kind=FeedEntry.AUTHOR, key=post.author_id, post_id=post.pk, pub_date=post.pub_date)
+        for post in posts
+    ]
+    for name, kind in FEED_RELATIONS:
+        field = Post._meta.get_field(name)
+        source, target = field.m2m_column_name(), field.m2m_reverse_name()
+        entries += [
+            FeedEntry(kind=kind, key=key, post_id=post_id, pub_date=pub_dates[post_id])
+            for post_id, key in field.remote_field.through.objects.filter(**{f'{source}__in': pub_dates})
+            .values_list(source, target)
+        ]
+    return entries
+
+
+def feeds_changed(feeds):
+    """
+    Tell the feed store which (kind, key) feeds changed, or None for any.
+    """
+    store = get_feed_store()
+
+    # Now for this process, and again on commit so a read that raced the
+    # write cannot keep the old rows.
+    store.changed(feeds)
+    transaction.on_commit(lambda: store.changed(feeds))
+
+
+def add_entries(entries):
+    entries = list(entries)
+    if not entries:
+        return
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    feeds_changed({(entry.kind, entry.key) for entry in entries})
+
+
+def remove_entries(kind, keys=None, post_ids=None):
+    entries = FeedEntry.objects.filter(kind=kind)
+    if keys is not None:
+        entries = entries.filter(key__in=keys)
+    if post_ids is not None:
+        entries = entries.filter(post_id__in=post_ids)
+    entries.delete()
+    feeds_changed(None if keys is None else {(kind, key) for key in keys})
+
+
+def add_posts(posts):
+    add_entries(feed_entries_for(posts))
+
+
+def move_author(post):
+    moved = FeedEntry.objects.filter(kind=FeedEntry.AUTHOR, post_id=post.pk).exclude(key=post.author_id).update(
+        key=post.author_id,
+    )
+    if moved:
+        feeds_changed(None)
+
+
+def resolve_feed(kind, value):
+    """
+    Return the feed key for a category or tag name or an author username,
+    or None when the name does not pick out exactly one row.
+    """
+    if kind == FeedEntry.CATEGORY:
+        keys = Category.objects.filter(name=value).values_list('pk', flat=True)
+    elif kind == FeedEntry.TAG:
+        keys = Tag.objects.filter(name=value).values_list('pk', flat=True)
+    else:
+        keys = User.objects.filter(username=value).values_list('pk', flat=True)
+    keys = list(keys[:2])
+    return keys[0] if len(keys) == 1 else None
+
+
+class DatabaseFeedStore:
+    """
+    Pages are read from the FeedEntry table with a seek on its
+    (kind, key, pub_date, post) index.
+    """
+
+    def page(self, kind, key, position, reverse, limit, since=None, until=None):
+        """
+        Return up to `limit` post ids of the feed after `position`, a
+        (pub_date, id) pair, newest first or oldest first when `reverse`,
+        keeping to posts published between `since` and `until` inclusive.
+        """
+        return list(self.get_queryset(kind, key, position, reverse, since, until)[:limit])
+
+    def get_queryset(self, kind, key, position=None, reverse=False, since=None, until=None):
+        ordering = [invert_ordering(field) for field in FEED_ORDERING] if reverse else list(FEED_ORDERING)
+        entries = FeedEntry.objects.filter(kind=kind, key=key).order_by(*ordering)
+        if since is not None:
+            entries = entries.filter(pub_date__gte=since)
+        if until is not None:
+            entries = entries.filter(pub_date__lte=until)
+        if position is not None:
+            entries = seek_queryset(entries, ordering, position)
+        return entries.values_list('post_id', flat=True)
+
+    def changed(self, feeds):
+        pass
+
+
+class MemoryFeedStore:
+    """
+    Keeps each feed read in this process as a sorted list loaded from the
+    FeedEntry table. Local writes drop the affected feeds; writes made by
+    other processes show up once a feed is older than `ttl` seconds.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.feeds = {}
+
+    def get_rows(self, kind, key):
+        with self.lock:
+            cached = self.feeds.get((kind, key))
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        rows = list(
+            FeedEntry.objects.filter(kind=kind, key=key).order_by('pub_date', 'post_id').values_list('pub_date', 'post_id')
+        )
+        with self.lock:
+            self.feeds[(kind, key)] = (time.monotonic() + self.ttl, rows)
+        return rows
+
+    def page(self, kind, key, position, reverse, limit, since=None, until=None):
+        rows = self.get_rows(kind, key)
+        # (date,) sorts before every (date, id) row and (date, inf) after.
+        low = 0 if since is None else bisect_left(rows, (since,))
+        high = len(rows) if until is None else bisect_right(rows, (until, float('inf')))
+        if reverse:
+            start = low if position is None else max(low, bisect_right(rows, tuple(position)))
+            return [post_id for _, post_id in rows[start:min(start + limit, high)]]
+        end = high if position is None else min(high, bisect_left(rows, tuple(position)))
+        return [post_id for _, post_id in reversed(rows[max(end - limit, low):end])]
+
+    def changed(self, feeds):
+        with self.lock:
+            if feeds is None:
+                self.feeds.clear()
+            else:
+                for feed in feeds:
+                    self.feeds.pop(feed, None)
+
+
+FEED_STORES = {
+    'db': DatabaseFeedStore,
+    'memory': MemoryFeedStore,
+}
+
+_store = None
+_store_name = None
+
+
+def get_feed_store():
+    global _store, _store_name
+    name = getattr(settings, 'POST_FEED_STORE', 'db')
+    if _store is None or _store_name != name:
+        _store, _store_name = FEED_STORES[name](), name
+    return _store
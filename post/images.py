@@ -0,0 +1,209 @@
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image as PILImage, ImageOps, UnidentifiedImageError
+
+from .cache import invalidate_posts
+from .models import Image, ImageVariant
+
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name and file extension of each variant format.
+FORMATS = {
+    ImageVariant.WEBP: ('WEBP', 'webp'),
+    ImageVariant.JPEG: ('JPEG', 'jpg'),
+}
+
+
+def get_variant_settings():
+    return {
+        'WIDTHS': (320, 640, 1280),
+        'FORMATS': (ImageVariant.WEBP, ImageVariant.JPEG),
+        'QUALITY': 80,
+        'MAX_PIXELS': 40_000_000,
+        'WORKERS': 2,
+        **getattr(settings, 'IMAGE_VARIANTS', {}),
+    }
+
+
+def variant_widths(width, widths):
+    """
+    Return the configured widths narrower than the original, or just the
+    original width when it is narrower than all of them: variants are
+    never upscaled.
+    """
+    smaller = sorted(w for w in widths if w < width)
+    return smaller or [width]
+
+
+def encode(source, width, format, quality):
+    height = max(1, round(source.height * width / source.width))
+    resized = source.resize((width, height), PILImage.LANCZOS) if width != source.width else source
+    pil_format, _ = FORMATS[format]
+    if pil_format == 'JPEG' and resized.mode != 'RGB':
+        resized = resized.convert('RGB')
+    buffer = io.BytesIO()
+    resized.save(buffer, pil_format, quality=quality, optimize=pil_format == 'JPEG')
+    return height, buffer.getvalue()
+
+
+def open_source(image, max_pixels):
+    """
+    Load the original, upright, refusing images over `max_pixels` before
+    decoding them.
+    """
+    with image.image.open('rb') as f:
+        source = PILImage.open(f)
+        if source.width * source.height > max_pixels:
+            raise ValueError(f'{source.width}x{source.height} exceeds the {max_pixels} pixel budget')
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'A' in source.getbands() or 'transparency' in source.info else 'RGB')
+        source.load()
+    return source
+
+
+def generate_variants(image, force=False):
+    """
+    Create the missing variants of `image` and record its dimensions.
+    With `force` the existing variants are rebuilt. Returns the number of
+    variants written; an unreadable or oversized original is logged and
+    marked processed so it is not retried.
+    """
+    config = get_variant_settings()
+    if force:
+        image.variants.all().delete()
+    existing = set(image.variants.values_list('width', 'format'))
+
+    written = 0
+    if image.image:
+        try:
+            source = open_source(image, config['MAX_PIXELS'])
+        except (OSError, ValueError, UnidentifiedImageError, PILImage.DecompressionBombError) as error:
+            logger.warning('Cannot create variants of image %s (%s): %s', image.pk, image.image.name, error)
+        else:
+            image.width, image.height = source.width, source.height
+            for width in variant_widths(source.width, config['WIDTHS']):
+                for format in config['FORMATS']:
+                    if (width, format) in existing:
+                        continue
+                    height, data = encode(source, width, format, config['QUALITY'])
+                    variant = ImageVariant(image=image, width=width, height=height, format=format, size=len(data))
+                    variant.file.save(f'{image.pk}/{width}.{FORMATS[format][1]}', ContentFile(data), save=False)
+                    variant.save()
+                    written += 1
+
+    image.processed_at = timezone.now()
+    Image.objects.filter(pk=image.pk).update(width=image.width, height=image.height, processed_at=image.processed_at)
+    if written or force:
+        invalidate_posts(image.posts.values_list('pk', flat=True))
+    return written
+
+
+def process_images(image_ids, force=False):
+    written = 0
+    for image in Image.objects.filter(pk__in=image_ids):
+        written += generate_variants(image, force=force)
+    return written
+
+
+class WorkerPool:
+    """
+    Variants are generated by a pool of threads in this process once the
+    upload commits. Nothing is persisted: images still queued when the
+    process exits stay unprocessed until `generate_image_variants` runs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def put(self, image_ids):
+        transaction.on_commit(lambda: self.submit(image_ids))
+
+    def submit(self, image_ids):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=get_variant_settings()['WORKERS'], thread_name_prefix='image-variants',
+                )
+        for image_id in image_ids:
+            self.executor.submit(self.run, image_id)
+
+    def run(self, image_id):
+        close_old_connections()
+        try:
+            process_images([image_id])
+        except Exception:
+            logger.exception('Failed to create variants of image %s', image_id)
+        finally:
+            close_old_connections()
+
+
+class SynchronousQueue:
+    """
+    Generate right after the upload commits, in the request thread. Useful
+    for development and tests.
+    """
+
+    def put(self, image_ids):
+        transaction.on_commit(lambda: process_images(image_ids))
+
+
+class CommandQueue:
+    """
+    Leave new images to `generate_image_variants`, which picks up every
+    image not processed yet.
+    """
+
+    def put(self, image_ids):
+        pass
+
+
+QUEUES = {
+    'pool': WorkerPool,
+    'sync': SynchronousQueue,
+    'command': CommandQueue,
+}
+
+_queue = None
+_queue_name = None
+
+
+def get_queue():
+    global _queue, _queue_name
+    name = getattr(settings, 'IMAGE_VARIANT_QUEUE', 'pool')
+    if _queue is None or _queue_name != name:
+        _queue, _queue_name = QUEUES[name](), name
+    return _queue
+
+
+def schedule_variants(images):
+    # Images saved without their ids coming back wait for the command.
+    image_ids = [image.pk for image in images if image.pk is not None and image.image]
+    if image_ids:
+        get_queue().put(image_ids)
+
+
+def run_with_budget(images, seconds=None, force=False):
+    """
+    Process `images` in order until `seconds` have been spent, and return
+    (images processed, variants written). What is left is picked up by the
+    next run.
+    """
+    deadline = None if seconds is None else time.monotonic() + seconds
+    processed = written = 0
+    for image in images:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        written += generate_variants(image, force=force)
+        processed += 1
+    return processed, written
@@ -0,0 +1,96 @@
+import hashlib
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from post.blobs import FILE_FIELDS, acquire_existing, collect_blobs, collect_orphans
+from post.models import Attachment, Blob, Image
+
+
+class Command(BaseCommand):
+    help = (
+        'Move existing attachments and images onto content-addressed blobs: the first file with some content '
+        'becomes its blob, later copies point at it and are deleted. Safe to run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be reclaimed.')
+        parser.add_argument('--collect', action='store_true',
+                            help='Also delete attachments and images no post uses, and unreferenced blobs.')
+        parser.add_argument('--grace', type=int, default=24 * 60 * 60,
+                            help='Seconds a completed upload is kept for its post before --collect removes it.')
+
+    def handle(self, *args, batch_size, dry_run, collect, grace, **options):
+        self.digests = {}
+        seen = {sha256: name for sha256, name in Blob.objects.values_list('sha256', 'file')}
+        rows = duplicates = reclaimed = missing = 0
+        for model, field_name in FILE_FIELDS.items():
+            pending = model.objects.filter(blob__isnull=True).exclude(**{field_name: ''}).order_by('pk')
+            storage = model._meta.get_field(field_name).storage
+            last_pk = 0
+            while True:
+                batch = list(pending.filter(pk__gt=last_pk).only('pk', field_name)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                for row in batch:
+                    name = getattr(row, field_name).name
+                    if not storage.exists(name):
+                        missing += 1
+                        continue
+                    sha256, size = self.hash(storage, name)
+                    rows += 1
+                    first = seen.setdefault(sha256, name)
+                    if first != name:
+                        duplicates += 1
+                        reclaimed += size
+                    if not dry_run:
+                        self.adopt(model, field_name, row.pk, name, sha256, size)
+            self.stdout.write(f'Checked {model._meta.verbose_name_plural}')
+
+        if not dry_run:
+            self.delete_copies(seen)
+        verb = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{rows} files hashed, {duplicates} duplicates; {verb} {reclaimed} bytes. {missing} files missing.'
+        ))
+
+        if collect and not dry_run:
+            with transaction.atomic():
+                orphans = collect_orphans(grace=grace)
+                blobs = collect_blobs()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {orphans} unused media rows and {blobs} blobs.'))
+
+    def hash(self, storage, name):
+        if name not in self.digests:
+            digest = hashlib.sha256()
+            size = 0
+            with storage.open(name, 'rb') as f:
+                for chunk in f.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+            self.digests[name] = (digest.hexdigest(), size)
+        return self.digests[name]
+
+    def adopt(self, model, field_name, pk, name, sha256, size):
+        with transaction.atomic():
+            blob = acquire_existing(sha256)
+            if blob is None:
+                # The first copy stays where it is and becomes the blob.
+                blob = Blob.objects.create(sha256=sha256, size=size, file=name, ref_count=1)
+            model.objects.filter(pk=pk).update(**{field_name: blob.file.name, 'blob': blob})
+
+    def delete_copies(self, blob_names):
+        """
+        Delete every hashed file that is not a blob and no row uses any more.
+        """
+        kept = set(blob_names.values())
+        for name in set(self.digests) - kept:
+            if Attachment.objects.filter(file=name).exists() or Image.objects.filter(image=name).exists():
+                continue
+            for model, field_name in FILE_FIELDS.items():
+                storage = model._meta.get_field(field_name).storage
+                if storage.exists(name):
+                    storage.delete(name)
+                    break
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from post.export import iter_json_array, iter_ndjson, parse_watermark
+
+
+class Command(BaseCommand):
+    help = 'Stream posts with their comments and relation ids as NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='File to write to. Defaults to stdout.')
+        parser.add_argument('--since-date', help='Only export posts after this pub_date (ISO 8601).')
+        parser.add_argument('--since-id', help='Tie-breaker id for --since-date, from the last exported row.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--json', action='store_true', help='Write a JSON array instead of NDJSON.')
+
+    def handle(self, *args, output, since_date, since_id, chunk_size, json, **options):
+        try:
+            watermark = parse_watermark(since_date, since_id)
+        except ValueError as error:
+            raise CommandError(error)
+
+        rows = (iter_json_array if json else iter_ndjson)(watermark, chunk_size)
+        if output:
+            with open(output, 'w', encoding='utf-8') as stream:
+                stream.writelines(rows)
+        else:
+            for row in rows:
+                self.stdout.write(row, ending='')
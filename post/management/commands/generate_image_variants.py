@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from post.images import run_with_budget
+from post.models import Image
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the WebP/JPEG variants of uploaded images. Only images not processed yet are handled unless '
+        '--all is given; existing variants are kept unless --force is given, so runs can be repeated safely.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Check every image for missing variants.')
+        parser.add_argument('--force', action='store_true', help='Rebuild existing variants (implies --all).')
+        parser.add_argument('--budget', type=float, default=None,
+                            help='Stop starting new images after this many seconds; the rest wait for the next run.')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, all, force, budget, batch_size, **options):
+        images = Image.objects.exclude(image='').order_by('pk')
+        if not (all or force):
+            images = images.filter(processed_at__isnull=True)
+
+        def batches():
+            last_pk = 0
+            while True:
+                batch = list(images.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    return
+                yield from batch
+                last_pk = batch[-1].pk
+
+        processed, written = run_with_budget(batches(), seconds=budget, force=force)
+        remaining = images.filter(processed_at__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} images and wrote {written} variants; {remaining} images still pending.'
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from post.models import Upload
+
+
+class Command(BaseCommand):
+    help = 'Delete upload sessions that expired before completing, with their partial files.'
+
+    def handle(self, *args, **options):
+        expired = Upload.objects.filter(status=Upload.PENDING, expires_at__lte=timezone.now())
+        count = 0
+        for upload in expired.iterator():
+            upload.delete()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired uploads.'))
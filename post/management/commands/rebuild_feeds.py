@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from post.feeds import add_posts, feeds_changed
+from post.models import FeedEntry, Post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the category and author feeds of posts in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, batch_size, **options):
+        FeedEntry.objects.all().delete()
+        feeds_changed(None)
+        posts = Post.objects.only('id', 'author_id', 'pub_date').order_by('pk')
+        last_pk, total = 0, 0
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                add_posts(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write(f'Added {total} posts')
+
+        self.stdout.write(self.style.SUCCESS(f'Feeds rebuilt with {total} posts.'))
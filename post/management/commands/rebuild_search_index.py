@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from post.cache import invalidate_all_posts
+from post.models import Post
+from post.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of posts in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, batch_size, database, **options):
+        backend = get_search_backend(database)
+        if backend is None:
+            raise CommandError(f'No full-text search backend for database "{database}".')
+
+        backend.create_index()
+        backend.clear()
+        posts = Post.objects.using(database).only('id', 'title', 'content').order_by('pk')
+        last_pk, total = 0, 0
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic(using=database):
+                backend.index(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write(f'Indexed {total} posts')
+
+        invalidate_all_posts()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {total} posts.'))
@@ -0,0 +1,158 @@
+import random
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from notification.inbox import add_unread
+from notification.models import Notification, Subscription
+from post.cache import invalidate_all_posts
+from post.feeds import add_posts
+from post.models import Category, Comment, Post, Tag
+from post.search import get_search_backend
+from post.threads import set_root_paths
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a reproducible synthetic dataset with bulk inserts: users, categories, tags, posts with '
+        'likes and dislikes, comments, subscriptions and notifications. The same --seed and sizes always '
+        'produce the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=5, help='Average comments per post.')
+        parser.add_argument('--reactions', type=int, default=10, help='Average likes and dislikes per post.')
+        parser.add_argument('--subscriptions', type=int, default=2, help='Subscriptions per user.')
+        parser.add_argument('--notifications', type=int, default=10, help='Notifications per user.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='seed', help='Prefix of the generated usernames and names.')
+        parser.add_argument('--password', default='seed-password', help='Password of every generated user.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-user-').exists():
+            raise CommandError(f'Users prefixed "{prefix}-user-" already exist; pick another --prefix.')
+        if options['users'] < 1 and (options['posts'] or options['notifications']):
+            raise CommandError('Posts and notifications need at least one user.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            users = self.create_users(options)
+            categories = Category.objects.bulk_create(
+                Category(name=f'{prefix} category {i}') for i in range(options['categories'])
+            )
+            tags = Tag.objects.bulk_create(Tag(name=f'{prefix}-tag-{i}') for i in range(options['tags']))
+            posts = self.create_posts(options, users, categories, tags)
+            comments = self.create_comments(options, users, posts)
+            subscriptions = self.create_subscriptions(options, users, categories)
+            notifications = self.create_notifications(options, users)
+        invalidate_all_posts()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(categories)} categories, {len(tags)} tags, {len(posts)} posts, '
+            f'{comments} comments, {subscriptions} subscriptions and {notifications} notifications.'
+        ))
+
+    def create_users(self, options):
+        # One hash for everyone: hashing per user would dominate the run.
+        password = make_password(options['password'])
+        return User.objects.bulk_create(
+            [
+                User(username=f'{options["prefix"]}-user-{i}', email=f'{options["prefix"]}-user-{i}@example.com',
+                     password=password)
+                for i in range(options['users'])
+            ],
+            batch_size=self.batch_size,
+        )
+
+    def create_posts(self, options, users, categories, tags):
+        rng = self.rng
+        user_ids = [user.pk for user in users]
+        posts, relations = [], []
+        for i in range(options['posts']):
+            reactors = rng.sample(user_ids, min(len(user_ids), rng.randint(0, 2 * options['reactions'])))
+            split = rng.randint(0, len(reactors))
+            likes, dislikes = reactors[:split], reactors[split:]
+            posts.append(Post(
+                title=f'{options["prefix"]} post {i}',
+                content=' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))),
+                author_id=rng.choice(user_ids),
+                like_count=len(likes),
+                dislike_count=len(dislikes),
+            ))
+            relations.append({
+                'categories': [category.pk for category in rng.sample(categories, min(len(categories), rng.randint(1, 2)))],
+                'tags': [tag.pk for tag in rng.sample(tags, min(len(tags), rng.randint(0, 3)))],
+                'likes': likes,
+                'dislikes': dislikes,
+            })
+
+        search = get_search_backend()
+        created = []
+        for start in range(0, len(posts), self.batch_size):
+            batch = Post.objects.bulk_create(posts[start:start + self.batch_size])
+            for name in ('categories', 'tags', 'likes', 'dislikes'):
+                field = Post._meta.get_field(name)
+                source, target = field.m2m_column_name(), field.m2m_reverse_name()
+                field.remote_field.through.objects.bulk_create([
+                    field.remote_field.through(**{source: post.pk, target: pk})
+                    for post, related in zip(batch, relations[start:start + self.batch_size])
+                    for pk in related[name]
+                ])
+            # bulk_create skips the signals that maintain feeds and the index.
+            add_posts(batch)
+            if search is not None:
+                search.index(batch)
+            created += batch
+            self.stdout.write(f'Created {len(created)} posts')
+        return created
+
+    def create_comments(self, options, users, posts):
+        rng = self.rng
+        comments = [
+            Comment(post_id=post.pk, author_id=rng.choice(users).pk,
+                    text=' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))))
+            for post in posts
+            for _ in range(rng.randint(0, 2 * options['comments']))
+        ]
+        Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+        # bulk_create skips the signal that places comments in their thread.
+        set_root_paths(Comment.objects.all())
+        return len(comments)
+
+    def create_subscriptions(self, options, users, categories):
+        rng = self.rng
+        names = [category.name for category in categories] + [None]
+        subscriptions = [
+            Subscription(user_id=user.pk, category=rng.choice(names), is_post_update=rng.random() < 0.3)
+            for user in users
+            for _ in range(options['subscriptions'])
+        ]
+        Subscription.objects.bulk_create(subscriptions, batch_size=self.batch_size)
+        return len(subscriptions)
+
+    def create_notifications(self, options, users):
+        rng = self.rng
+        notifications = [
+            Notification(user_id=user.pk, message=f'Seeded notification {i}', is_read=rng.random() < 0.3)
+            for user in users
+            for i in range(options['notifications'])
+        ]
+        Notification.objects.bulk_create(notifications, batch_size=self.batch_size)
+        add_unread(Counter(notification.user_id for notification in notifications if not notification.is_read))
+        return len(notifications)
+
+
+WORDS = (
+    'django rest api blog post comment category tag feed cache query index page cursor author reader '
+    'latency throughput benchmark seed notification subscription search token user data model view'
+).split()
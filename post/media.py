@@ -0,0 +1,201 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+
+from .models import Attachment, Blob, Image, ImageVariant
+from .permissions import IsReaderOrReadOnly
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_media_settings():
+    return {
+        'BACKEND': 'django',
+        'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+        'MAX_AGE': 60 * 60,
+        'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+        'BLOCK_SIZE': 64 * 1024,
+        **getattr(settings, 'MEDIA_SERVING', {}),
+    }
+
+
+def find_media(name):
+    """
+    Return the ETag of the stored file `name`, if known up front, and
+    whether its content can never change. Only files a blob, attachment,
+    image or variant uses are served: anything else under MEDIA_ROOT, such
+    as partial uploads, is a 404.
+    """
+    if name.startswith(Blob._meta.get_field('file').upload_to):
+        sha256 = os.path.splitext(os.path.basename(name))[0]
+        if Blob.objects.filter(sha256=sha256, file=name).exists():
+            # Content addressed: the name changes whenever the bytes do.
+            return f'"{sha256}"', True
+    if (ImageVariant.objects.filter(file=name).exists() or Attachment.objects.filter(file=name).exists()
+            or Image.objects.filter(image=name).exists()):
+        return None, False
+    raise Http404('No such media file.')
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) byte positions, inclusive, of a single-range
+    `Range` header, None when the header should be ignored, or False when
+    it cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple or non-byte ranges: answer with the whole file.
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def iter_range(f, start, length, block_size):
+    try:
+        f.seek(start)
+        while length:
+            data = f.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+class DjangoMediaBackend:
+    """
+    Stream the file from this process: whole files through FileResponse,
+    which lets the server use sendfile(), and single byte ranges in
+    BLOCK_SIZE pieces.
+    """
+
+    def serve(self, request, storage, name, size, content_type, partial):
+        byte_range = None
+        header = request.META.get('HTTP_RANGE')
+        if header and partial and request.method == 'GET':
+            byte_range = parse_range(header, size)
+        if byte_range is False:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+            response['Content-Length'] = size
+        elif byte_range is None:
+            response = FileResponse(storage.open(name, 'rb'), content_type=content_type)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                iter_range(storage.open(name, 'rb'), start, length, get_media_settings()['BLOCK_SIZE']),
+                status=status.HTTP_206_PARTIAL_CONTENT, content_type=content_type,
+            )
+            response['Content-Length'] = length
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+
+class AccelRedirectBackend:
+    """
+    Hand the file to nginx with X-Accel-Redirect: ACCEL_REDIRECT_PREFIX
+    must be an `internal` location aliased to MEDIA_ROOT. nginx handles
+    ranges itself and keeps the cache headers set here.
+    """
+    header = 'X-Accel-Redirect'
+
+    def serve(self, request, storage, name, size, content_type, partial):
+        response = HttpResponse(content_type=content_type)
+        response[self.header] = self.target(storage, name)
+        return response
+
+    def target(self, storage, name):
+        return get_media_settings()['ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/' + quote(name)
+
+
+class SendfileBackend(AccelRedirectBackend):
+    """
+    Hand the file to Apache (mod_xsendfile) or lighttpd with X-Sendfile.
+    """
+    header = 'X-Sendfile'
+
+    def target(self, storage, name):
+        return storage.path(name)
+
+
+MEDIA_BACKENDS = {
+    'django': DjangoMediaBackend,
+    'x-accel-redirect': AccelRedirectBackend,
+    'x-sendfile': SendfileBackend,
+}
+
+
+def serve_media(request, path):
+    """
+    Serve an uploaded file with validators, long-lived cache headers and
+    byte ranges, under the same read permission as posts.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    if not IsReaderOrReadOnly().has_permission(request, None):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+
+    name = os.path.normpath(path).replace(os.sep, '/')
+    if name.startswith(('../', '/')) or name == '..':
+        raise Http404('No such media file.')
+    etag, immutable = find_media(name)
+
+    storage = default_storage
+    try:
+        stat = os.stat(storage.path(name))
+    except FileNotFoundError:
+        raise Http404('No such media file.')
+    last_modified = int(stat.st_mtime)
+    if etag is None:
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    config = get_media_settings()
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        # If-Range: send part of the file only if the client still has this version of it.
+        if_range = request.META.get('HTTP_IF_RANGE')
+        partial = if_range is None or (
+            if_range == etag if if_range.startswith('"') else parse_http_date_safe(if_range) == last_modified
+        )
+        content_type, encoding = mimetypes.guess_type(name)
+        content_type = content_type or 'application/octet-stream'
+        backend = MEDIA_BACKENDS[config['BACKEND']]()
+        response = backend.serve(request, storage, name, stat.st_size, content_type, partial)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if immutable:
+        response['Cache-Control'] = f'public, max-age={config["IMMUTABLE_MAX_AGE"]}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={config["MAX_AGE"]}'
+    return response
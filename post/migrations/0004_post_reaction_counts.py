@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:54
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_reaction_counts(apps, schema_editor):
+    Post = apps.get_model('post', 'Post')
+    for field, counter in (('likes', 'like_count'), ('dislikes', 'dislike_count')):
+        through = Post._meta.get_field(field).remote_field.through
+        counts = (
+            through.objects.filter(post_id=OuterRef('pk'))
+            .values('post_id')
+            .annotate(total=Count('*'))
+            .values('total')
+        )
+        Post.objects.update(**{counter: Coalesce(Subquery(counts), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_reaction_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Written by hand: the full-text index is a side table the models do not
+# describe. Its DDL and the text normalization are copied from post/search.py
+# as they were when this migration was written, so later changes there do
+# not change it; `manage.py rebuild_search_index` reindexes with the current
+# code, and is the way to build the index for a POST_SEARCH_BACKEND of
+# another kind.
+
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations
+
+
+SEARCH_TABLE = 'post_search'
+
+ARABIC_MARKS = re.compile('[\u0610-\u061a\u0640\u064b-\u065f\u0670\u06d6-\u06dc\u06df-\u06e8\u06ea-\u06ed]')
+ARABIC_LETTER_FORMS = str.maketrans({
+    '\u0622': '\u0627',
+    '\u0623': '\u0627',
+    '\u0625': '\u0627',
+    '\u0671': '\u0627',
+    '\u0649': '\u064a',
+    '\u0629': '\u0647',
+})
+
+CREATE_INDEX = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+        f"USING fts5(title, content, tokenize = 'unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+        f'post_id bigint PRIMARY KEY REFERENCES post_post (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+        f'document tsvector NOT NULL)',
+        f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)',
+    ],
+}
+
+INSERT_DOCUMENT = {
+    'sqlite': f'INSERT INTO {SEARCH_TABLE} (rowid, title, content) VALUES (%s, %s, %s)',
+    'postgresql': (
+        f'INSERT INTO {SEARCH_TABLE} (post_id, document) VALUES (%s, '
+        f"setweight(to_tsvector(%s::regconfig, %s), 'A') || setweight(to_tsvector(%s::regconfig, %s), 'B')) "
+        f'ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document'
+    ),
+}
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', text or '')
+    text = ARABIC_MARKS.sub('', text)
+    return text.translate(ARABIC_LETTER_FORMS).lower()
+
+
+def get_vendor(schema_editor):
+    if getattr(settings, 'POST_SEARCH_BACKEND', None):
+        return None
+    vendor = schema_editor.connection.vendor
+    return vendor if vendor in CREATE_INDEX else None
+
+
+def create_search_index(apps, schema_editor):
+    vendor = get_vendor(schema_editor)
+    if vendor is None:
+        return
+    for statement in CREATE_INDEX[vendor]:
+        schema_editor.execute(statement)
+
+    config = getattr(settings, 'POST_SEARCH_CONFIG', 'simple')
+    Post = apps.get_model('post', 'Post')
+    posts = Post.objects.using(schema_editor.connection.alias).only('id', 'title', 'content').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last_pk)[:500])
+        if not batch:
+            break
+        documents = [(post.pk, normalize_text(post.title), normalize_text(post.content)) for post in batch]
+        if vendor == 'postgresql':
+            documents = [(pk, config, title, config, content) for pk, title, content in documents]
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(INSERT_DOCUMENT[vendor], documents)
+        last_pk = batch[-1].pk
+
+
+def drop_search_index(apps, schema_editor):
+    if get_vendor(schema_editor) is not None:
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0004_post_reaction_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
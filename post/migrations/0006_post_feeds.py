@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_feeds(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Post = apps.get_model('post', 'Post')
+    FeedEntry = apps.get_model('post', 'FeedEntry')
+    PostCategory = Post.categories.through
+
+    posts = Post.objects.using(db_alias).order_by('pk').values_list('pk', 'author_id', 'pub_date')
+    last_pk = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last_pk)[:500])
+        if not batch:
+            break
+        pub_dates = {pk: pub_date for pk, _, pub_date in batch}
+        entries = [
+            FeedEntry(kind='author', key=author_id, post_id=pk, pub_date=pub_date)
+            for pk, author_id, pub_date in batch
+        ]
+        entries += [
+            FeedEntry(kind='category', key=category_id, post_id=post_id, pub_date=pub_dates[post_id])
+            for post_id, category_id in PostCategory.objects.using(db_alias)
+            .filter(post_id__in=pub_dates).values_list('post_id', 'category_id')
+        ]
+        FeedEntry.objects.using(db_alias).bulk_create(entries)
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0005_post_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('category', 'Category'), ('author', 'Author')], max_length=10)),
+                ('key', models.PositiveBigIntegerField()),
+                ('pub_date', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='post.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'key', '-pub_date', '-post'], name='feed_entry_page_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('kind', 'key', 'post'), name='feed_entry_unique'),
+        ),
+        migrations.RunPython(populate_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0010_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(blank=True, db_index=True, upload_to='attachments/'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='imagevariant',
+            name='file',
+            field=models.FileField(db_index=True, upload_to='images/variants/'),
+        ),
+    ]
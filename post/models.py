@@ -1,3 +1,6 @@
+import math
+import uuid
+
 from django.db import models
 
 from user.models import User
@@ -9,39 +12,208 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+class Blob(models.Model):
+    """
+    One stored copy of some file content, shared by every Attachment and
+    Image with the same SHA-256. `ref_count` is the number of those rows;
+    see post.blobs.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count'], condition=models.Q(ref_count=0), name='blob_unreferenced_idx'),
+        ]
+
+    def __str__(self):
+        return self.file.name
+
 class Attachment(models.Model):
-    file = models.FileField(upload_to='attachments/',blank=True)
+    file = models.FileField(upload_to='attachments/',blank=True,db_index=True)
+    blob = models.ForeignKey(Blob, null=True, blank=True, editable=False, on_delete=models.PROTECT, related_name='attachments')
 
     def __str__(self):
         return self.file.name
 
 class Image(models.Model):
-    image = models.ImageField(upload_to='images/',blank=True)
+    image = models.ImageField(upload_to='images/',blank=True,db_index=True)
+    blob = models.ForeignKey(Blob, null=True, blank=True, editable=False, on_delete=models.PROTECT, related_name='images')
+    # Filled in when the variants are generated (see post.images).
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    processed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.image.name
 
+class ImageVariant(models.Model):
+    """
+    A width-bounded WebP or JPEG rendition of an uploaded image, served to
+    clients in place of the original.
+    """
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+    FORMAT_CHOICES = [
+        (WEBP, 'WebP'),
+        (JPEG, 'JPEG'),
+    ]
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='variants')
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    file = models.FileField(upload_to='images/variants/', db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'format', 'width'], name='image_variant_unique'),
+        ]
+
+    def __str__(self):
+        return self.file.name
+
+
+class Upload(models.Model):
+    """
+    A chunked, resumable upload session. Chunks of `chunk_size` bytes (the
+    last one may be shorter) are written into a partial file in any order;
+    completing the session checks the SHA-256 and turns it into an
+    Attachment or Image that posts can reference by the session's id.
+    """
+    ATTACHMENT = 'attachment'
+    IMAGE = 'image'
+    KIND_CHOICES = [
+        (ATTACHMENT, 'Attachment'),
+        (IMAGE, 'Image'),
+    ]
+    PENDING = 'pending'
+    COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (COMPLETE, 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attachment = models.OneToOneField(Attachment, null=True, blank=True, on_delete=models.SET_NULL, related_name='upload')
+    image = models.OneToOneField(Image, null=True, blank=True, on_delete=models.SET_NULL, related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    @property
+    def chunk_count(self):
+        return math.ceil(self.size / self.chunk_size)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def __str__(self):
+        return f'{self.filename} ({self.status})'
+
+class UploadChunk(models.Model):
+    upload = models.ForeignKey(Upload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['upload', 'index'], name='upload_chunk_unique'),
+        ]
+
 
 class Post(models.Model):
     title = models.CharField(max_length=255)
     content = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
     categories = models.ManyToManyField(Category, related_name='posts')
+    tags = models.ManyToManyField(Tag, related_name='posts', blank=True)
     attachments = models.ManyToManyField(Attachment, related_name='posts')
     images = models.ManyToManyField(Image, related_name='posts')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
     dislikes = models.ManyToManyField(User, related_name='disliked_posts', blank=True)
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='post_pub_date_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
     
 
 class Comment(models.Model):
+    """
+    A comment on a post, or a reply to another comment of the same post.
+    `path`, `depth` and `reply_count` place it in its thread; see
+    post.threads.
+    """
     post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    path = models.CharField(max_length=255, blank=True, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_id_idx'),
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            models.Index(fields=['post', 'parent', 'created_at', 'id'], name='comment_post_parent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author.username} - {self.text[:50]}"
+
+
+class FeedEntry(models.Model):
+    """
+    A post's place in a precomputed category, author or tag feed, kept
+    sorted by the same (pub_date, id) key as the post list so a feed page,
+    with or without a date range, is a single index range scan. See
+    post.feeds.
+    """
+    CATEGORY = 'category'
+    AUTHOR = 'author'
+    TAG = 'tag'
+    KIND_CHOICES = [
+        (CATEGORY, 'Category'),
+        (AUTHOR, 'Author'),
+        (TAG, 'Tag'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    key = models.PositiveBigIntegerField()
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='feed_entries')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key', 'post'], name='feed_entry_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'key', '-pub_date', '-post'], name='feed_entry_page_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.key} - {self.post_id}'
@@ -0,0 +1,222 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Seek pagination over a composite, unique ordering such as
+    ('-pub_date', '-id').
+
+    The cursor stores the ordering values of the row at the page boundary,
+    so every page is one range scan on the matching index and deep pages
+    cost the same as the first one. Views may override the ordering by
+    defining `get_keyset_ordering(queryset)`.
+    """
+    ordering = ('-pk',)
+    # The page ordering seek() already applied the cursor for, if any.
+    sought = None
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+
+        def fetch(position, reverse, limit):
+            return list(self.get_page_queryset(queryset, position, reverse, limit))
+
+        return self.paginate(fetch, request)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views: the rows are read with the
+        async ORM before the page is built around them.
+        """
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        position, reverse = self.decode_cursor(request)
+        rows = [row async for row in self.get_page_queryset(queryset, position, reverse, page_size + 1)]
+        return self.paginate(lambda position, reverse, limit: rows, request)
+
+    def seek(self, queryset, request, view=None):
+        """
+        Apply the cursor to `queryset` ahead of the filters a view adds
+        next, rather than after them in paginate_queryset(). SQLite bounds
+        an index range with the first usable predicate on each column, and
+        on a deep page of a filtered range (say ?publication_date__lte=...)
+        the seek is the tighter one. The ordering must not depend on those
+        filters.
+        """
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+        position, reverse = self.decode_cursor(request)
+        if position is None:
+            return queryset
+        self.sought = self.get_page_ordering(reverse)
+        return seek_queryset(queryset, self.sought, position)
+
+    def get_page_ordering(self, reverse):
+        return [invert_ordering(field) for field in self.ordering] if reverse else list(self.ordering)
+
+    def get_page_queryset(self, queryset, position, reverse, limit):
+        ordering = self.get_page_ordering(reverse)
+        rows = queryset.order_by(*ordering)
+        if position is not None and ordering != self.sought:
+            rows = seek_queryset(rows, ordering, position)
+        return rows[:limit]
+
+    def paginate(self, fetch, request):
+        """
+        Build the page from `fetch(position, reverse, limit)`, which returns
+        up to `limit` rows strictly after `position` in `self.ordering`, or
+        in the inverted ordering when `reverse` is set.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+
+        results = fetch(position, reverse, self.page_size + 1)
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        get_keyset_ordering = getattr(view, 'get_keyset_ordering', None)
+        if get_keyset_ordering is not None:
+            return tuple(get_keyset_ordering(queryset))
+        return tuple(self.ordering)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_position(self, instance):
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, position, reverse=False):
+        payload = {'p': [encode_value(value) for value in position]}
+        if reverse:
+            payload['r'] = 1
+        cursor = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor.decode('ascii'))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values = payload['p']
+            reverse = bool(payload.get('r'))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.decode_value(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def decode_value(self, name, value):
+        opts = self.model._meta
+        try:
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations are compared as the raw JSON value.
+            return value
+        return field.to_python(value)
+
+
+def invert_ordering(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+def build_seek_filter(ordering, position):
+    """
+    Build the row-value comparison `(a, b, c) > (x, y, z)` for the given
+    ordering as an OR of equality prefixes, plus a leading range on the
+    first column so the planner can seek straight into the index.
+    """
+    first = ordering[0]
+    first_lookup = 'lte' if first.startswith('-') else 'gte'
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f'{name}__{lookup}': position[index]})
+        for prefix, value in zip(ordering[:index], position[:index]):
+            clause &= Q(**{prefix.lstrip('-'): value})
+        condition |= clause
+    return Q(**{f'{first.lstrip("-")}__{first_lookup}': position[0]}) & condition
+
+
+def seek_queryset(queryset, ordering, position):
+    """
+    Filter `queryset` to the rows after `position` in `ordering`.
+    """
+    return queryset.filter(build_seek_filter(ordering, position))
+
+
+def encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class PostPagination(KeysetPagination):
+    ordering = ('-pub_date', '-id')
+
+    def paginate_feed(self, store, kind, key, queryset, request, since=None, until=None):
+        """
+        Paginate a materialized feed (see post.feeds), optionally limited to
+        a pub_date range: the store returns the post ids of the page and
+        only those posts are loaded from `queryset`. Cursors are
+        interchangeable with the plain list's.
+        """
+        self.ordering = type(self).ordering
+        self.model = queryset.model
+
+        def fetch(position, reverse, limit):
+            post_ids = store.page(kind, key, position, reverse, limit, since, until)
+            posts = queryset.in_bulk(post_ids)
+            return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+        return self.paginate(fetch, request)
+
+
+class CommentPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
@@ -1,16 +1,54 @@
+from asgiref.sync import sync_to_async
 from rest_framework import permissions
 
+
+# DRF permissions that only read the request, so async views can check
+# them on the event loop. Ours declare `async_safe = True` instead.
+ASYNC_SAFE_PERMISSIONS = (
+    permissions.AllowAny,
+    permissions.IsAuthenticated,
+    permissions.IsAdminUser,
+    permissions.IsAuthenticatedOrReadOnly,
+)
+
+
+def is_async_safe(permission):
+    return getattr(permission, 'async_safe', False) or isinstance(permission, ASYNC_SAFE_PERMISSIONS)
+
+
+async def acheck_permissions(view, request, obj=None):
+    """
+    APIView.check_permissions(), or check_object_permissions() given `obj`,
+    for async views: async-safe permissions are checked inline, any other
+    in a thread.
+    """
+    for permission in view.get_permissions():
+        if obj is None:
+            check, args = permission.has_permission, (request, view)
+        else:
+            check, args = permission.has_object_permission, (request, view, obj)
+        allowed = check(*args) if is_async_safe(permission) else await sync_to_async(check)(*args)
+        if not allowed:
+            view.permission_denied(
+                request,
+                message=getattr(permission, 'message', None),
+                code=getattr(permission, 'code', None),
+            )
+
+
 class IsAdminOrReadOnly(permissions.BasePermission):
     """
     Custom permission to allow full access to admin users,
     read-only access to others.
     """
+    async_safe = True
 
     def has_permission(self, request, view):
         return request.user and request.user.is_authenticated
 
     def has_object_permission(self, request, view, obj):
-        return request.user and (request.user.is_staff or request.user == obj.author)
+        # Compare ids so the author is never loaded.
+        return request.user and (request.user.is_staff or obj.author_id == request.user.pk)
 
 
 class IsAuthorOrReadOnly(permissions.BasePermission):
@@ -18,15 +56,17 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
     Custom permission to allow full access to the author of an object,
     read-only access to others.
     """
+    async_safe = True
 
     def has_object_permission(self, request, view, obj):
-        return request.user and (request.user.is_staff or request.user == obj.author)
+        return request.user and (request.user.is_staff or obj.author_id == request.user.pk)
 
 
 class IsReaderOrReadOnly(permissions.BasePermission):
     """
     Custom permission to allow read-only access to all users.
     """
+    async_safe = True
 
     def has_permission(self, request, view):
         return request.method in permissions.SAFE_METHODS
@@ -0,0 +1,214 @@
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+from .models import Post
+
+
+SEARCH_TABLE = 'post_search'
+
+# Harakat, Quranic annotation marks and tatweel carry no meaning for matching.
+ARABIC_MARKS = re.compile('[\u0610-\u061a\u0640\u064b-\u065f\u0670\u06d6-\u06dc\u06df-\u06e8\u06ea-\u06ed]')
+ARABIC_LETTER_FORMS = str.maketrans({
+    '\u0622': '\u0627',  # alef with madda -> alef
+    '\u0623': '\u0627',  # alef with hamza above -> alef
+    '\u0625': '\u0627',  # alef with hamza below -> alef
+    '\u0671': '\u0627',  # alef wasla -> alef
+    '\u0649': '\u064a',  # alef maksura -> yeh
+    '\u0629': '\u0647',  # teh marbuta -> heh
+})
+
+
+def normalize_text(text):
+    """
+    Fold the spelling variants of Arabic script (and Unicode compatibility
+    forms in general) so that indexed text and queries meet halfway.
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    text = ARABIC_MARKS.sub('', text)
+    return text.translate(ARABIC_LETTER_FORMS).lower()
+
+
+class SearchBackend:
+    """
+    Keeps a full-text index of post titles and content in a side table and
+    answers ranked queries against it. `search` annotates the queryset with
+    `search_rank`, where higher is more relevant.
+    """
+    vendor = None
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def create_index(self):
+        raise NotImplementedError
+
+    def index(self, posts):
+        raise NotImplementedError
+
+    def remove(self, post_ids):
+        raise NotImplementedError
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+    def search(self, queryset, terms):
+        raise NotImplementedError
+
+    def get_documents(self, posts):
+        return [(post.pk, normalize_text(post.title), normalize_text(post.content)) for post in posts]
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    FTS5 virtual table keyed by the post id, ranked with BM25 weighting
+    title matches above content matches.
+    """
+    vendor = 'sqlite'
+    tokenizer = "unicode61 remove_diacritics 2"
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                f"USING fts5(title, content, tokenize = '{self.tokenizer}')"
+            )
+
+    def index(self, posts):
+        documents = self.get_documents(posts)
+        if not documents:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(doc[0],) for doc in documents])
+            cursor.executemany(f'INSERT INTO {SEARCH_TABLE} (rowid, title, content) VALUES (%s, %s, %s)', documents)
+
+    def remove(self, post_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(pk,) for pk in post_ids])
+
+    def build_query(self, terms):
+        # Quote every term so FTS5 operators in user input stay literal, and
+        # prefix-match it to stay close to the old icontains behaviour.
+        return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+    def search(self, queryset, terms):
+        match = self.build_query(terms)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match]),
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({SEARCH_TABLE}, 2.0, 1.0) FROM {SEARCH_TABLE} '
+                f'WHERE {SEARCH_TABLE} MATCH %s AND rowid = "{table}"."id"',
+                [match],
+                output_field=FloatField(),
+            ),
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Weighted tsvector documents in a side table with a GIN index.
+    """
+    vendor = 'postgresql'
+
+    @property
+    def config(self):
+        return getattr(settings, 'POST_SEARCH_CONFIG', 'simple')
+
+    def create_index(self):
+        post_table = Post._meta.db_table
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                f'post_id bigint PRIMARY KEY REFERENCES {post_table} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)')
+
+    def index(self, posts):
+        documents = [(pk, self.config, title, self.config, content) for pk, title, content in self.get_documents(posts)]
+        if not documents:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (post_id, document) VALUES (%s, '
+                f"setweight(to_tsvector(%s::regconfig, %s), 'A') || setweight(to_tsvector(%s::regconfig, %s), 'B')) "
+                f'ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document',
+                documents,
+            )
+
+    def remove(self, post_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE post_id = ANY(%s)', [list(post_ids)])
+
+    def build_query(self, terms):
+        return ' & '.join("'{}':*".format(term.replace("'", "''").replace('\\', '')) for term in terms)
+
+    def search(self, queryset, terms):
+        query = self.build_query(terms)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            pk__in=RawSQL(
+                f'SELECT post_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery(%s::regconfig, %s)',
+                [self.config, query],
+            ),
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT ts_rank(document, to_tsquery(%s::regconfig, %s)) FROM {SEARCH_TABLE} '
+                f'WHERE post_id = "{table}"."id"',
+                [self.config, query],
+                output_field=FloatField(),
+            ),
+        )
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    """
+    Return the search backend for the `using` database: the class named by
+    the POST_SEARCH_BACKEND setting, or the one matching the database vendor.
+    None means full-text search is unavailable and callers should fall back
+    to plain `icontains` filtering.
+    """
+    backend_path = getattr(settings, 'POST_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)(using)
+    backend_class = SEARCH_BACKENDS.get(connections[using].vendor)
+    if backend_class is None:
+        return None
+    return backend_class(using)
+
+
+class PostSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter that answers `?search=` from the full-text index when the
+    database has one, ranking results by relevance.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        backend = get_search_backend(queryset.db)
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        terms = [normalize_text(term) for term in self.get_search_terms(request)]
+        terms = [term for term in terms if term.strip()]
+        if not terms:
+            return queryset
+        return backend.search(queryset, terms)
@@ -1,11 +1,80 @@
+import os
+from collections import defaultdict
+from collections.abc import Mapping
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections, router, transaction
+from django.utils.functional import cached_property
 from rest_framework import serializers
-from .models import Category, Attachment, Image, Post, Comment
+from Blog.fieldsets import SparseFieldsetsMixin
+from Blog.serializers import PlainRepresentationMixin
+from .blobs import ingest
+from .feeds import add_posts
+from .images import schedule_variants
+from .models import Category, Attachment, Image, Post, Comment, Upload
+from .uploads import default_expiry, get_upload_settings, missing_chunks
+from .signals import posts_bulk_created
+from .threads import get_comment_thread_settings
 from user.models import User
 
-class UserSerializer(serializers.ModelSerializer):
+POST_M2M_FIELDS = ('categories', 'tags', 'likes', 'dislikes')
+# Characters of content in a post summary's excerpt.
+EXCERPT_LENGTH = 280
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolve primary keys from the objects `preload_related` fetched for the
+    whole payload, falling back to a lookup of its own.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded_related', {}).get(self.queryset.model, {})
+        try:
+            return preloaded[self.queryset.model._meta.pk.to_python(data)]
+        except (KeyError, TypeError, DjangoValidationError):
+            return super().to_internal_value(data)
+
+
+def preload_related(serializer, items):
+    """
+    Fetch every object referenced by the writable many-related fields of
+    `serializer` across `items` with one query per model.
+    """
+    preloaded = serializer.context.setdefault('preloaded_related', {})
+    wanted = defaultdict(set)
+    querysets = {}
+    for name, field in serializer.fields.items():
+        if field.read_only or not isinstance(field, serializers.ManyRelatedField):
+            continue
+        if not isinstance(field.child_relation, PreloadedPrimaryKeyRelatedField):
+            continue
+        queryset = field.child_relation.get_queryset()
+        querysets[queryset.model] = queryset
+        for item in items:
+            if hasattr(item, 'getlist'):
+                values = item.getlist(name)
+            elif isinstance(item, Mapping):
+                values = item.get(name)
+            else:
+                continue
+            if not isinstance(values, (list, tuple)):
+                continue
+            for value in values:
+                try:
+                    wanted[queryset.model].add(queryset.model._meta.pk.to_python(value))
+                except (TypeError, DjangoValidationError):
+                    pass
+    for model, pks in wanted.items():
+        preloaded.setdefault(model, {}).update(querysets[model].in_bulk(pks))
+
+class UserSerializer(PlainRepresentationMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
+    """
+    The public part of a user, for `?expand=author`.
+    """
     class Meta:
         model = User
-        fields = ['id']
+        fields = ['id', 'username', 'first_name', 'last_name']
         ref_name='PostUserSerializer'
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -13,59 +82,303 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = '__all__'
 
-class AttachmentSerializer(serializers.ModelSerializer):
+class AttachmentSerializer(PlainRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = Attachment
-        fields = '__all__'
+        fields = ['id', 'file']
+
+class ImageSerializer(PlainRepresentationMixin, serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
 
-class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
-        fields = '__all__'
+        fields = ['id', 'image', 'width', 'height', 'srcset']
+
+    def get_srcset(self, image):
+        """
+        Map each variant format to an HTML `srcset` of its widths, e.g.
+        {"webp": "/media/images/variants/1/320.webp 320w, ..."}. Empty until
+        the variants have been generated.
+        """
+        request = self.context.get('request')
+        candidates = defaultdict(list)
+        for variant in sorted(image.variants.all(), key=lambda variant: variant.width):
+            url = variant.file.url
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            candidates[variant.format].append(f'{url} {variant.width}w')
+        return {format: ', '.join(urls) for format, urls in candidates.items()}
+
+class UploadSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(min_value=1)
+    chunk_size = serializers.IntegerField(required=False)
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
+    chunk_count = serializers.IntegerField(read_only=True)
+    missing_chunks = serializers.SerializerMethodField()
 
-class CommentSerializer(serializers.ModelSerializer):
-    author = serializers.ReadOnlyField(source='author.id', read_only=True)
-    post = serializers.ReadOnlyField(source='post.id', read_only=True)
+    class Meta:
+        model = Upload
+        fields = [
+            'id', 'kind', 'filename', 'size', 'chunk_size', 'chunk_count', 'checksum', 'status', 'missing_chunks',
+            'attachment', 'image', 'created_at', 'expires_at',
+        ]
+        read_only_fields = ['status', 'attachment', 'image', 'created_at', 'expires_at']
+
+    def get_missing_chunks(self, upload):
+        if upload.status == Upload.COMPLETE:
+            return []
+        return missing_chunks(upload, [chunk.index for chunk in upload.chunks.all()])
+
+    def validate(self, attrs):
+        config = get_upload_settings()
+        if attrs['size'] > config['MAX_SIZE']:
+            raise serializers.ValidationError({'size': f'Uploads are limited to {config["MAX_SIZE"]} bytes.'})
+        chunk_size = attrs.setdefault('chunk_size', config['CHUNK_SIZE'])
+        if not config['MIN_CHUNK_SIZE'] <= chunk_size <= config['MAX_CHUNK_SIZE']:
+            raise serializers.ValidationError({
+                'chunk_size': f'Chunk size must be between {config["MIN_CHUNK_SIZE"]} and {config["MAX_CHUNK_SIZE"]} bytes.',
+            })
+        attrs['filename'] = os.path.basename(attrs['filename'])
+        if 'checksum' in attrs:
+            attrs['checksum'] = attrs['checksum'].lower()
+        attrs['expires_at'] = default_expiry()
+        return attrs
+
+class UploadCompleteSerializer(serializers.Serializer):
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False,
+                                      help_text='SHA-256 of the whole file, unless given when the upload was created.')
+
+class UploadRelatedField(PreloadedPrimaryKeyRelatedField):
+    """
+    Completed uploads of the requesting user.
+    """
+
+    def get_queryset(self):
+        request = self.context.get('request')
+        owner = request.user.pk if request is not None else None
+        return super().get_queryset().filter(owner_id=owner)
+
+class CommentSerializer(PlainRepresentationMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
+    author = serializers.ReadOnlyField(source='author_id', read_only=True)
+    post = serializers.ReadOnlyField(source='post_id', read_only=True)
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=Comment.objects.only('id', 'post_id', 'path', 'depth'), required=False, allow_null=True,
+    )
     class Meta:
         model = Comment
-        fields = '__all__'
+        fields = ['id', 'post', 'author', 'parent', 'text', 'created_at', 'depth', 'reply_count']
+        expandable_fields = {
+            'author': (UserSerializer, {}),
+        }
+
+    def validate_parent(self, parent):
+        if self.instance is not None and getattr(parent, 'pk', None) != self.instance.parent_id:
+            raise serializers.ValidationError('A comment cannot move to another thread.')
+        if parent is None:
+            return parent
+        view = self.context.get('view')
+        post_pk = view.kwargs.get('post_pk') if view is not None else None
+        if post_pk is not None and parent.post_id != int(post_pk):
+            raise serializers.ValidationError('Replies must be to a comment on the same post.')
+        max_nesting = get_comment_thread_settings()['MAX_NESTING']
+        if parent.depth >= max_nesting:
+            raise serializers.ValidationError(f'Replies cannot be nested more than {max_nesting} levels deep.')
+        return parent
+
+
+class CommentThreadSerializer(CommentSerializer):
+    """
+    A comment with the replies post.threads.attach_replies() loaded for it,
+    rendered alike.
+    """
+    replies = serializers.SerializerMethodField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['replies']
+
+    @cached_property
+    def replies_serializer(self):
+        return type(self)(many=True, context=self.context, fields=self.requested_fields, expand=self.requested_expand)
 
-class PostSerializer(serializers.ModelSerializer):
+    def get_replies(self, comment):
+        return self.replies_serializer.to_representation(getattr(comment, 'thread_replies', []))
+
+def create_posts(posts_data):
+    """
+    Create posts with their attachments, images and M2M relations using one
+    bulk insert per table, inside a single transaction, so the number of
+    queries does not depend on how many posts or related items there are.
+    """
+    posts, relations = [], []
+    for data in posts_data:
+        data = dict(data)
+        attachments = [Attachment(**item) for item in data.pop('attachments', []) if dict(item)]
+        images = [Image(**item) for item in data.pop('images', []) if dict(item)]
+        uploads = list({upload.pk: upload for upload in data.pop('uploads', [])}.values())
+        related = {name: set(data.pop(name, [])) for name in POST_M2M_FIELDS}
+        posts.append(Post(
+            like_count=len(related['likes']),
+            dislike_count=len(related['dislikes']),
+            **data,
+        ))
+        relations.append((related, attachments, images, uploads))
+
+    using = router.db_for_write(Post)
+    with transaction.atomic(using=using):
+        bulk_insert = connections[using].features.can_return_rows_from_bulk_insert
+        if bulk_insert:
+            Post.objects.bulk_create(posts)
+        else:
+            # Without RETURNING the ids only come back from save(), whose
+            # post_save signal then does the work of posts_bulk_created.
+            for post in posts:
+                post.save()
+        new_attachments = [item for _, attachments, _, _ in relations for item in attachments]
+        new_images = [item for _, _, images, _ in relations for item in images]
+        # bulk_create skips the pre_save and post_save receivers that do these.
+        for item in new_attachments + new_images:
+            ingest(item)
+        Attachment.objects.bulk_create(new_attachments)
+        Image.objects.bulk_create(new_images)
+        schedule_variants(new_images)
+
+        through_rows = {name: [] for name in POST_M2M_FIELDS + ('attachments', 'images')}
+        for post, (related, attachments, images, uploads) in zip(posts, relations):
+            related = {
+                **related,
+                'attachments': attachments + [Attachment(pk=u.attachment_id) for u in uploads if u.attachment_id],
+                'images': images + [Image(pk=u.image_id) for u in uploads if u.image_id],
+            }
+            for name, objs in related.items():
+                field = Post._meta.get_field(name)
+                source, target = field.m2m_column_name(), field.m2m_reverse_name()
+                through_rows[name].extend(
+                    field.remote_field.through(**{source: post.pk, target: obj.pk}) for obj in objs
+                )
+        for name, rows in through_rows.items():
+            getattr(Post, name).through.objects.bulk_create(rows)
+
+        if bulk_insert:
+            posts_bulk_created.send(sender=Post, posts=posts, using=using)
+        else:
+            # post_save ran before the category rows existed.
+            add_posts(posts)
+    return posts
+
+
+class PostListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            preload_related(self.child, data)
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        return create_posts(validated_data)
+
+
+class PostSerializer(PlainRepresentationMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
     attachments = AttachmentSerializer(many=True,required=False)
     images = ImageSerializer(many=True,required=False)
     comments = CommentSerializer(many=True, read_only=True)
-    author = serializers.ReadOnlyField(source='author.id', read_only=True)
+    author = serializers.ReadOnlyField(source='author_id', read_only=True)
+    uploads = UploadRelatedField(many=True, write_only=True, required=False,
+                                 queryset=Upload.objects.filter(status=Upload.COMPLETE),
+                                 help_text='Ids of completed uploads to attach to the post.')
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
     class Meta:
         model = Post
         fields = "__all__"
+        read_only_fields = ['like_count', 'dislike_count']
+        list_serializer_class = PostListSerializer
+        extra_kwargs = {
+            'likes': {'write_only': True},
+            'dislikes': {'write_only': True},
+        }
+        expandable_fields = {
+            'author': (UserSerializer, {}),
+        }
+
+    def to_internal_value(self, data):
+        if 'preloaded_related' not in self.context:
+            preload_related(self, [data])
+        return super().to_internal_value(data)
 
     def create(self, validated_data):
-        attachments_data = validated_data.pop('attachments', [])
-        images_data = validated_data.pop('images', [])
-        categories_data = validated_data.pop('categories', [])
-        likes_data = validated_data.pop('likes', [])
-        dislikes_data = validated_data.pop('dislikes', [])
-
-
-        post = Post.objects.create(**validated_data)
-        for category_data in categories_data:
-            post.categories.add(category_data)
-
-        for like_data in likes_data:
-            post.likes.add(like_data)
-
-        for dislike_data in dislikes_data:
-            post.categories.add(dislike_data)
-        
-        for attachment_data in attachments_data:
-            if dict(attachment_data) != {}:
-                attachment = Attachment.objects.create(**attachment_data)
-                post.attachments.add(attachment)
-        for image_data in images_data:
-            if dict(image_data) != {}:
-                image = Image.objects.create(**image_data)
-                post.images.add(image)
-        return post
-    
+        return create_posts([validated_data])[0]
+
+    def update(self, instance, validated_data):
+        counts = {}
+        if 'likes' in validated_data:
+            counts['like_count'] = len(set(validated_data['likes']))
+        if 'dislikes' in validated_data:
+            counts['dislike_count'] = len(set(validated_data['dislikes']))
+
+        uploads = validated_data.pop('uploads', [])
+        instance = super().update(instance, validated_data)
+        instance.attachments.add(*[upload.attachment_id for upload in uploads if upload.attachment_id])
+        instance.images.add(*[upload.image_id for upload in uploads if upload.image_id])
+        if counts:
+            Post.objects.filter(pk=instance.pk).update(**counts)
+            for name, value in counts.items():
+                setattr(instance, name, value)
+        return instance
+
+
+class PostSummarySerializer(PlainRepresentationMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
+    """
+    The compact post `list` returns by default: an excerpt instead of the
+    content, a comment count instead of the comments and only the first
+    image. The rest can be asked for with `?fields=` and `?expand=`.
+    """
+    author = serializers.ReadOnlyField(source='author_id')
+    excerpt = serializers.SerializerMethodField()
+    comment_count = serializers.SerializerMethodField()
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Post
+        fields = [
+            'id', 'title', 'excerpt', 'content', 'author', 'pub_date', 'categories', 'tags',
+            'like_count', 'dislike_count', 'comment_count', 'image',
+        ]
+        default_fields = [
+            'id', 'title', 'excerpt', 'author', 'pub_date', 'categories', 'tags',
+            'like_count', 'dislike_count', 'comment_count', 'image',
+        ]
+        read_only_fields = fields
+        expandable_fields = {
+            'author': (UserSerializer, {}),
+            'comments': (CommentSerializer, {'many': True}),
+            'attachments': (AttachmentSerializer, {'many': True}),
+            'images': (ImageSerializer, {'many': True}),
+        }
+
+    def get_excerpt(self, post):
+        # PostViewSet loads only the start of the content (see build_read_queryset).
+        content = getattr(post, 'content_excerpt', None)
+        if content is None:
+            content = post.content
+        if len(content) <= EXCERPT_LENGTH:
+            return content
+        # A plain slice: Truncator's per-character walk dominated list serialization.
+        return content[:EXCERPT_LENGTH - 1] + '…'
+
+    def get_comment_count(self, post):
+        count = getattr(post, 'comment_count', None)
+        return post.comments.count() if count is None else count
+
+    def get_image(self, post):
+        images = post.images.all()
+        if 'images' not in getattr(post, '_prefetched_objects_cache', {}):
+            images = images.order_by('id')[:1]
+        image = next(iter(images), None)
+        return None if image is None else self.image_serializer.to_representation(image)
+
+    @cached_property
+    def image_serializer(self):
+        # One instance for the whole page: building its fields is the costly part.
+        return ImageSerializer(context=self.context)
+
+
 class PostIdSerializer(serializers.Serializer):
     post_id = serializers.IntegerField()
\ No newline at end of file
@@ -0,0 +1,210 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from .cache import invalidate_all_posts, invalidate_posts
+from .blobs import collect_orphans, ingest, release
+from .feeds import add_entries, add_posts, feeds_changed, move_author, remove_entries
+from .images import schedule_variants
+from .models import Attachment, Category, Comment, FeedEntry, Image, ImageVariant, Post, Tag, Upload
+from .search import get_search_backend
+from .threads import place_comment, remove_comment
+from .uploads import remove_part
+
+
+# Sent with `posts` and `using` after create_posts() inserts posts with
+# bulk_create, which bypasses post_save.
+posts_bulk_created = Signal()
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    backend = get_search_backend(using)
+    if backend is not None:
+        backend.index([instance])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, using='default', **kwargs):
+    backend = get_search_backend(using)
+    if backend is not None:
+        backend.remove([instance.pk])
+
+
+@receiver(posts_bulk_created, sender=Post)
+def index_bulk_created_posts(sender, posts, using='default', **kwargs):
+    backend = get_search_backend(using)
+    if backend is not None:
+        backend.index(posts)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    invalidate_posts([instance.pk])
+
+
+@receiver(posts_bulk_created, sender=Post)
+def invalidate_bulk_created_posts(sender, posts, **kwargs):
+    invalidate_posts([post.pk for post in posts])
+
+
+@receiver(post_save, sender=Comment)
+def thread_comment(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        place_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unthread_comment(sender, instance, origin=None, **kwargs):
+    remove_comment(instance, origin)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_post(sender, instance, **kwargs):
+    invalidate_posts([instance.post_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_category(sender, instance, **kwargs):
+    # Category and tag names drive list filtering, so any change can move
+    # posts in and out of cached pages.
+    invalidate_all_posts()
+
+
+@receiver(post_save, sender=Attachment)
+@receiver(pre_delete, sender=Attachment)
+@receiver(post_save, sender=Image)
+@receiver(pre_delete, sender=Image)
+def invalidate_media_posts(sender, instance, **kwargs):
+    # pre_delete: the through rows are gone by the time post_delete fires.
+    invalidate_posts(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(pre_save, sender=Attachment)
+@receiver(pre_save, sender=Image)
+def store_media_blob(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = ingest(instance)
+    if previous is not None:
+        release([previous])
+
+
+@receiver(post_delete, sender=Attachment)
+@receiver(post_delete, sender=Image)
+def release_media_blob(sender, instance, **kwargs):
+    release([instance.blob_id])
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_media(sender, instance, **kwargs):
+    # The through rows are gone by the time post_delete fires.
+    instance._media_ids = (
+        list(instance.attachments.values_list('pk', flat=True)),
+        list(instance.images.values_list('pk', flat=True)),
+    )
+
+
+@receiver(post_delete, sender=Post)
+def delete_orphaned_media(sender, instance, **kwargs):
+    attachment_ids, image_ids = getattr(instance, '_media_ids', ([], []))
+    if attachment_ids or image_ids:
+        collect_orphans(attachment_ids, image_ids)
+
+
+@receiver(post_save, sender=Image)
+def create_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw and instance.processed_at is None:
+        schedule_variants([instance])
+
+
+@receiver(post_delete, sender=ImageVariant)
+def delete_variant_file(sender, instance, **kwargs):
+    if instance.file:
+        transaction.on_commit(lambda: instance.file.delete(save=False))
+
+
+@receiver(post_delete, sender=Upload)
+def delete_upload_part(sender, instance, **kwargs):
+    # The instance's pk is cleared once the delete finishes.
+    upload_id = instance.pk
+    transaction.on_commit(lambda: remove_part(upload_id))
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+@receiver(m2m_changed, sender=Post.tags.through)
+@receiver(m2m_changed, sender=Post.attachments.through)
+@receiver(m2m_changed, sender=Post.images.through)
+@receiver(m2m_changed, sender=Post.likes.through)
+@receiver(m2m_changed, sender=Post.dislikes.through)
+def invalidate_post_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_posts([instance.pk])
+    elif pk_set is not None:
+        invalidate_posts(pk_set)
+    else:
+        invalidate_all_posts()
+
+
+@receiver(post_save, sender=Post)
+def update_post_feeds(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        # Categories can only be added once the post exists; m2m_changed or
+        # posts_bulk_created covers them.
+        add_entries([
+            FeedEntry(kind=FeedEntry.AUTHOR, key=instance.author_id, post_id=instance.pk, pub_date=instance.pub_date),
+        ])
+    else:
+        move_author(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_left_feeds(sender, instance, **kwargs):
+    # The entries go with the post through the foreign key.
+    feeds_changed(None)
+
+
+@receiver(posts_bulk_created, sender=Post)
+def add_bulk_created_posts_to_feeds(sender, posts, **kwargs):
+    add_posts(posts)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def remove_feed(sender, instance, **kwargs):
+    kind = FeedEntry.CATEGORY if sender is Category else FeedEntry.TAG
+    remove_entries(kind, keys=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_relation_feeds(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    kind = FeedEntry.CATEGORY if sender is Post.categories.through else FeedEntry.TAG
+    if not reverse:
+        if action == 'post_add':
+            add_entries(
+                FeedEntry(kind=kind, key=pk, post_id=instance.pk, pub_date=instance.pub_date)
+                for pk in pk_set
+            )
+        else:
+            remove_entries(kind, keys=pk_set, post_ids=[instance.pk])
+    elif action == 'post_add':
+        add_entries(
+            FeedEntry(kind=kind, key=instance.pk, post_id=pk, pub_date=pub_date)
+            for pk, pub_date in Post.objects.filter(pk__in=pk_set).values_list('pk', 'pub_date')
+        )
+    else:
+        remove_entries(kind, keys=[instance.pk], post_ids=pk_set)
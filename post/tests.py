@@ -1,8 +1,40 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from contextlib import ExitStack
+from io import BytesIO, StringIO
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.utils import ConnectionHandler
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from PIL import Image as PILImage
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Post, Category, Attachment, Image
+from Blog.database import SQLITE_PRAGMAS, database_from_env, parse_database_url
+from Blog.instrumentation import QueryBudgetExceeded, registry
+from Blog.replicas import written_key
+from notification.models import Notification, NotificationInbox
+from user.authentication import ClaimsRefreshToken
+from .cache import GLOBAL_GENERATION, invalidate_posts, post_generation_key
+from .permissions import IsAuthorOrReadOnly
+from .models import Post, Category, Attachment, Blob, Image, Comment, FeedEntry, Tag, Upload, UploadChunk
+from .pagination import seek_queryset
+from .search import SEARCH_TABLE
+from .serializers import PostSerializer
+from .uploads import get_upload_settings
 from django.utils.translation import activate
 
 User = get_user_model()
@@ -91,6 +123,29 @@ class PostModelTest(TestCase):
         response_dislike = self.client.post(f'/api/posts/{post.pk}/dislike/', **headers_user3)
         self.assertEqual(response_dislike.status_code, status.HTTP_200_OK)
         self.assertEqual(post.dislikes.count(), 1)
+
+    def test_reaction_toggles_keep_counters_in_step(self):
+        post = Post.objects.create(title='Test Post', content='Content.', author=self.user)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {self.access_token}'}
+
+        response = self.client.post(f'/api/posts/{post.pk}/like/', **headers)
+        self.assertEqual(response.data['like_count'], 1)
+        self.assertTrue(response.data['active'])
+
+        # Disliking moves the reaction over in one step.
+        response = self.client.post(f'/api/posts/{post.pk}/dislike/', **headers)
+        self.assertEqual((response.data['like_count'], response.data['dislike_count']), (0, 1))
+        self.assertEqual(post.likes.count(), 0)
+
+        # A second dislike undoes it.
+        response = self.client.post(f'/api/posts/{post.pk}/dislike/', **headers)
+        self.assertFalse(response.data['active'])
+        self.assertEqual(response.data['dislike_count'], 0)
+        self.assertEqual(post.dislikes.count(), 0)
+
+        post.refresh_from_db()
+        self.assertEqual((post.like_count, post.dislike_count), (0, 0))
+
     def test_delete_post_with_jwt_auth(self):
         # Create a post for testing
         post = Post.objects.create(
@@ -157,6 +212,1359 @@ class PostModelTest(TestCase):
         response = self.client.get(f'/api/posts/{nonexistent_post_id}/')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+# Keep authentication out of the query counts compared below.
+@override_settings(AUTH_USER_CACHE={'TTL': 0})
+class PostBulkCreateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.readers = [User.objects.create_user(username=f'reader{i}', password='pass') for i in range(3)]
+        self.categories = [Category.objects.create(name=f'Category {i}') for i in range(5)]
+        refresh = RefreshToken.for_user(self.user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {refresh.access_token}'}
+
+    def payload(self, count):
+        return [
+            {
+                'title': f'Bulk post {i}',
+                'content': 'Imported content.',
+                'categories': [category.pk for category in self.categories],
+                'likes': [self.readers[0].pk, self.readers[1].pk],
+                'dislikes': [self.readers[2].pk],
+            }
+            for i in range(count)
+        ]
+
+    def bulk_create(self, count):
+        return self.client.post('/api/posts/bulk/', self.payload(count), content_type='application/json', **self.headers)
+
+    def test_bulk_create(self):
+        response = self.bulk_create(3)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+
+        post = Post.objects.get(pk=response.data[0]['id'])
+        self.assertEqual(post.author, self.user)
+        self.assertEqual(post.categories.count(), 5)
+        self.assertEqual(list(post.dislikes.all()), [self.readers[2]])
+        self.assertEqual((post.like_count, post.dislike_count), (2, 1))
+        self.assertEqual(response.data[0]['like_count'], 2)
+
+        # Bulk-created posts are searchable straight away.
+        search = self.client.get('/api/posts/', {'search': 'imported'})
+        self.assertEqual(len(search.data['results']), 3)
+
+    def test_bulk_create_query_count_is_bounded(self):
+        with CaptureQueriesContext(connection) as small:
+            self.bulk_create(2)
+        with CaptureQueriesContext(connection) as large:
+            self.bulk_create(20)
+        self.assertEqual(len(small), len(large))
+
+    def test_single_create_query_count_does_not_grow_with_relations(self):
+        def create(categories):
+            data = {'title': 'Post', 'content': 'Content.', 'categories': [c.pk for c in categories]}
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/posts/', data, **self.headers)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(create(self.categories[:1]), create(self.categories))
+
+    def test_bulk_create_is_atomic(self):
+        payload = self.payload(2)
+        payload[1]['title'] = ''
+        response = self.client.post('/api/posts/bulk/', payload, content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Post.objects.exists())
+
+class PostExportTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='pass', is_staff=True)
+        self.category = Category.objects.create(name='News')
+        self.posts = []
+        for i in range(5):
+            post = Post.objects.create(title=f'Post {i}', content='\u0645\u0631\u062d\u0628\u0627', author=self.admin)
+            post.categories.add(self.category)
+            Comment.objects.create(post=post, author=self.admin, text=f'Comment {i}')
+            self.posts.append(post)
+        refresh = RefreshToken.for_user(self.admin)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {refresh.access_token}'}
+
+    def read_rows(self, response):
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_export_streams_ndjson(self):
+        response = self.client.get('/api/posts/export/', **self.headers)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = self.read_rows(response)
+        self.assertEqual([row['id'] for row in rows], [post.pk for post in self.posts])
+        self.assertEqual(rows[0]['categories'], [self.category.pk])
+        self.assertEqual(rows[0]['comments'][0]['text'], 'Comment 0')
+        self.assertEqual(rows[0]['content'], self.posts[0].content)
+
+    def test_incremental_export_from_watermark(self):
+        rows = self.read_rows(self.client.get('/api/posts/export/', **self.headers))
+        # Posts sharing the watermark's pub_date are split by id.
+        Post.objects.filter(pk__in=[p.pk for p in self.posts[2:]]).update(pub_date=self.posts[2].pub_date)
+        last = rows[2]
+        response = self.client.get(
+            '/api/posts/export/', {'since_date': self.posts[2].pub_date.isoformat(), 'since_id': last['id']}, **self.headers)
+        self.assertEqual([row['id'] for row in self.read_rows(response)], [p.pk for p in self.posts[3:]])
+
+    def test_export_requires_staff(self):
+        reader = User.objects.create_user(username='reader', password='pass')
+        refresh = RefreshToken.for_user(reader)
+        response = self.client.get('/api/posts/export/', HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_posts', chunk_size=2, json=True, stdout=out)
+        self.assertEqual([row['id'] for row in json.loads(out.getvalue())], [post.pk for post in self.posts])
+
+        with self.assertRaises(CommandError):
+            call_command('export_posts', since_date='yesterday', stdout=StringIO())
+
+class PostQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.category = Category.objects.create(name='Test Category')
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(title=f'Post {i}', content='Content.', author=self.user)
+            post.categories.add(self.category)
+            post.attachments.add(Attachment.objects.create(file=f'attachment_{i}.txt'))
+            post.images.add(Image.objects.create(image=f'image_{i}.jpg'))
+            post.likes.add(self.user)
+            Comment.objects.create(post=post, author=self.user, text='A comment')
+            Comment.objects.create(post=post, author=self.user, text='Another comment')
+        return post
+
+    def test_list_query_count_is_independent_of_page_size(self):
+        self.create_posts(1)
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/posts/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.create_posts(10)
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/posts/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_query_count(self):
+        post = self.create_posts(3)
+        with self.assertNumQueries(7):
+            response = self.client.get(f'/api/posts/{post.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['comments']), 2)
+        self.assertEqual(response.data['comments'][0]['author'], self.user.pk)
+        self.assertNotIn('likes', response.data)
+
+class PostFieldsetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass', email='private@example.com')
+        self.post = Post.objects.create(title='Long', content='word ' * 200, author=self.user)
+        self.post.images.add(Image.objects.create(image='first.jpg'), Image.objects.create(image='second.jpg'))
+        self.post.attachments.add(Attachment.objects.create(file='notes.txt'))
+        Comment.objects.create(post=self.post, author=self.user, text='A comment')
+
+    def test_list_returns_summaries(self):
+        post = self.client.get('/api/posts/').data['results'][0]
+        self.assertNotIn('content', post)
+        self.assertNotIn('comments', post)
+        self.assertNotIn('attachments', post)
+        self.assertLessEqual(len(post['excerpt']), 280)
+        self.assertTrue(post['excerpt'].endswith('…'))
+        self.assertEqual(post['comment_count'], 1)
+        self.assertTrue(post['image']['image'].endswith('first.jpg'))
+
+    def test_fields_and_expand(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/posts/', {'fields': 'id,title,comment_count'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'comment_count'})
+
+        # One extra query per expanded relation, and the authors are joined.
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/posts/', {'expand': 'author,comments.author'})
+        post = response.data['results'][0]
+        self.assertEqual(post['author'], {'id': self.user.pk, 'username': 'testuser', 'first_name': '', 'last_name': ''})
+        self.assertEqual(post['comments'][0]['author']['username'], 'testuser')
+
+        response = self.client.get(f'/api/posts/{self.post.pk}/', {'fields': 'id,comments.text'})
+        self.assertEqual(response.data, {'id': self.post.pk, 'comments': [{'text': 'A comment'}]})
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/api/posts/', {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/posts/', {'expand': 'likes'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class PostPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.posts = [
+            Post.objects.create(title=f'Post {i}', content='Searchable content.' if i % 2 else 'Other.', author=self.user)
+            for i in range(7)
+        ]
+        # Give several posts the same pub_date so the id tie-breaker matters.
+        Post.objects.filter(pk__in=[p.pk for p in self.posts[2:5]]).update(pub_date=self.posts[2].pub_date)
+
+    def collect_pages(self, url):
+        ids, previous = [], None
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(post['id'] for post in response.data['results'])
+            url, previous = response.data['next'], response.data['previous']
+        return ids, previous
+
+    def test_cursor_walks_every_post_once_in_order(self):
+        ids, previous = self.collect_pages('/api/posts/?page_size=2')
+        expected = list(Post.objects.order_by('-pub_date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertIsNotNone(previous)
+
+    def test_previous_link_returns_preceding_page(self):
+        first = self.client.get('/api/posts/?page_size=3').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([p['id'] for p in back['results']], [p['id'] for p in first['results']])
+
+    def test_cursor_keeps_search_parameters(self):
+        ids, _ = self.collect_pages('/api/posts/?search=Searchable&page_size=1')
+        expected = [p.pk for p in self.posts if p.content.startswith('Searchable')]
+        self.assertEqual(sorted(ids), sorted(expected))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_seek_keeps_or_filters(self):
+        ordering = ['-pub_date', '-id']
+        posts = list(Post.objects.order_by(*ordering))
+        position = [posts[1].pub_date, posts[1].pk]
+        expected = [p.pk for p in posts[2:] if p.title == 'Post 1' or p.content == 'Other.']
+        either = Q(title='Post 1') | Q(content='Other.')
+        for queryset in (
+            Post.objects.filter(either),
+            Post.objects.filter(either, author=self.user),
+            Post.objects.filter(title='Post 1') | Post.objects.filter(content='Other.'),
+        ):
+            rows = seek_queryset(queryset.order_by(*ordering), ordering, position)
+            self.assertEqual([p.pk for p in rows], expected)
+
+    def test_cursor_is_applied_before_filters(self):
+        newest, boundary = self.posts[6], self.posts[5]
+        params = {'publication_date__lte': newest.pub_date.isoformat(), 'page_size': 2}
+        first = self.client.get('/api/posts/', params).data
+        self.assertEqual([p['id'] for p in first['results']], [newest.pk, boundary.pk])
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(first['next']).data
+        expected = list(Post.objects.order_by('-pub_date', '-id').values_list('id', flat=True)[2:4])
+        self.assertEqual([p['id'] for p in second['results']], expected)
+
+        # The seek from the boundary comes before the filter's bound.
+        sql = next(q['sql'] for q in queries if q['sql'].startswith('SELECT "post_post"'))
+        where = sql.split(' FROM "post_post" WHERE ')[1]
+        seek_bound, filter_bound = (str(post.pub_date.replace(tzinfo=None)) for post in (boundary, newest))
+        self.assertLess(where.index(seek_bound), where.index(filter_bound))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/posts/?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_comments_are_scoped_to_post_and_paginated(self):
+        post, other = self.posts[0], self.posts[1]
+        comments = [Comment.objects.create(post=post, author=self.user, text=f'Comment {i}') for i in range(3)]
+        Comment.objects.create(post=other, author=self.user, text='Elsewhere')
+
+        response = self.client.get(f'/api/posts/{post.pk}/comments/?page_size=2')
+        self.assertEqual([c['id'] for c in response.data['results']], [c.pk for c in comments[:2]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([c['id'] for c in response.data['results']], [comments[2].pk])
+        self.assertIsNone(response.data['next'])
+
+class CommentThreadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.post = Post.objects.create(title='Threads', content='Content.', author=self.user)
+        self.other = Post.objects.create(title='Elsewhere', content='Content.', author=self.user)
+        token = RefreshToken.for_user(self.user).access_token
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        self.url = f'/api/posts/{self.post.pk}/comments/'
+
+    def reply(self, parent, text):
+        return Comment.objects.create(post=self.post, author=self.user, parent=parent, text=text)
+
+    def test_replies_get_paths_depths_and_counts(self):
+        root = self.reply(None, 'Root')
+        response = self.client.post(self.url, {'text': 'Reply', 'parent': root.pk}, format='json', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['parent'], response.data['depth']), (root.pk, 1))
+
+        reply = Comment.objects.get(pk=response.data['id'])
+        nested = self.reply(reply, 'Nested')
+        nested.refresh_from_db()
+        self.assertEqual(nested.path, f'{root.pk:010d}/{reply.pk:010d}/{nested.pk:010d}/')
+        self.assertEqual(nested.depth, 2)
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 1)
+
+        nested.delete()
+        reply.refresh_from_db()
+        self.assertEqual(reply.reply_count, 0)
+        self.post.delete()
+        self.assertFalse(Comment.objects.exists())
+
+    def test_invalid_parents(self):
+        elsewhere = Comment.objects.create(post=self.other, author=self.user, text='Elsewhere')
+        response = self.client.post(self.url, {'text': 'Reply', 'parent': elsewhere.pk}, format='json', **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('parent', response.data)
+
+        reply = self.reply(self.reply(None, 'Root'), 'Reply')
+        with self.settings(COMMENT_THREADS={'MAX_NESTING': 1}):
+            response = self.client.post(self.url, {'text': 'Too deep', 'parent': reply.pk}, format='json',
+                                        **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(f'{self.url}?parent=first')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_parent_lists_direct_replies(self):
+        root = self.reply(None, 'Root')
+        replies = [self.reply(root, f'Reply {i}') for i in range(3)]
+        self.reply(replies[0], 'Nested')
+
+        response = self.client.get(f'{self.url}?parent={root.pk}&page_size=2')
+        self.assertEqual([c['id'] for c in response.data['results']], [c.pk for c in replies[:2]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([c['id'] for c in response.data['results']], [replies[2].pk])
+
+    def test_depth_nests_replies_in_one_query(self):
+        first, second = self.reply(None, 'First'), self.reply(None, 'Second')
+        replies = [self.reply(first, f'Reply {i}') for i in range(3)]
+        nested = self.reply(replies[0], 'Nested')
+        self.reply(nested, 'Too deep')
+        # Under the reply cut by ?replies=2.
+        self.reply(replies[2], 'Hidden')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'{self.url}?depth=2&replies=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([c['id'] for c in results], [first.pk, second.pk])
+        self.assertEqual(results[0]['reply_count'], 3)
+        self.assertEqual([c['id'] for c in results[0]['replies']], [c.pk for c in replies[:2]])
+        self.assertEqual([c['id'] for c in results[0]['replies'][0]['replies']], [nested.pk])
+        self.assertEqual(results[0]['replies'][0]['replies'][0]['replies'], [])
+        self.assertEqual(results[1]['replies'], [])
+
+        response = self.client.get(f'{self.url}?parent={first.pk}&depth=1')
+        self.assertEqual([c['id'] for c in response.data['results']], [c.pk for c in replies])
+        self.assertEqual([c['id'] for c in response.data['results'][0]['replies']], [nested.pk])
+
+class PostFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.other = User.objects.create_user(username='other', password='testpass')
+        self.news = Category.objects.create(name='News')
+        self.sport = Category.objects.create(name='Sport')
+        self.posts = []
+        for i in range(6):
+            post = Post.objects.create(title=f'Post {i}', content='Content.', author=self.user if i % 2 else self.other)
+            post.categories.add(self.news if i < 4 else self.sport)
+            self.posts.append(post)
+
+    def feed_ids(self, **params):
+        ids, url = [], '/api/posts/'
+        params.setdefault('page_size', 2)
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(post['id'] for post in response.data['results'])
+            url, params = response.data['next'], {}
+        return ids
+
+    def expected(self, **filters):
+        return list(Post.objects.filter(**filters).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def test_category_and_author_pages_read_the_feed(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/', {'categories': 'News'})
+        self.assertTrue(any('post_feedentry' in query['sql'] for query in queries))
+        self.assertEqual(len(response.data['results'][0]['categories']), 1)
+
+        self.assertEqual(self.feed_ids(categories='News'), self.expected(categories=self.news))
+        self.assertEqual(self.feed_ids(author='testuser'), self.expected(author=self.user))
+
+    def test_previous_link_on_feed(self):
+        first = self.client.get('/api/posts/', {'categories': 'News', 'page_size': 2}).data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([p['id'] for p in back['results']], [p['id'] for p in first['results']])
+
+    def test_feeds_follow_category_changes(self):
+        post = self.posts[0]
+        post.categories.add(self.sport)
+        self.assertIn(post.pk, self.feed_ids(categories='Sport'))
+        post.categories.remove(self.news)
+        self.assertNotIn(post.pk, self.feed_ids(categories='News'))
+        self.sport.posts.remove(post)
+        self.assertNotIn(post.pk, self.feed_ids(categories='Sport'))
+        self.sport.posts.add(post)
+        self.assertIn(post.pk, self.feed_ids(categories='Sport'))
+        post.categories.clear()
+        self.assertNotIn(post.pk, self.feed_ids(categories='Sport'))
+
+        self.posts[1].delete()
+        self.assertEqual(self.feed_ids(categories='News'), self.expected(categories=self.news))
+        self.sport.delete()
+        self.assertFalse(FeedEntry.objects.filter(kind=FeedEntry.CATEGORY, key=self.sport.pk).exists())
+
+    def test_author_change_moves_post(self):
+        post = self.posts[0]
+        post.author = self.user
+        post.save()
+        self.assertIn(post.pk, self.feed_ids(author='testuser'))
+        self.assertNotIn(post.pk, self.feed_ids(author='other'))
+
+    def test_created_posts_join_feeds(self):
+        refresh = RefreshToken.for_user(self.user)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {refresh.access_token}'}
+        response = self.client.post('/api/posts/', {'title': 'New', 'content': 'Content.', 'categories': [self.sport.pk]}, **headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        payload = [{'title': 'Bulk', 'content': 'Content.', 'categories': [self.sport.pk]}]
+        bulk = self.client.post('/api/posts/bulk/', payload, content_type='application/json', **headers)
+        self.assertEqual(self.feed_ids(categories='Sport')[:2], [bulk.data[0]['id'], response.data['id']])
+        self.assertEqual(self.feed_ids(author='testuser'), self.expected(author=self.user))
+
+    def test_ambiguous_names_fall_back_to_filtering(self):
+        duplicate = Category.objects.create(name='News')
+        self.posts[5].categories.add(duplicate)
+        self.assertEqual(
+            sorted(self.feed_ids(categories='News')),
+            sorted(self.expected(categories__name='News')),
+        )
+
+    @override_settings(POST_FEED_STORE='memory')
+    def test_memory_store(self):
+        self.assertEqual(self.feed_ids(categories='News'), self.expected(categories=self.news))
+        new = Post.objects.create(title='Fresh', content='Content.', author=self.user)
+        new.categories.add(self.news)
+        cache.clear()
+        # The write dropped the feed, so it is loaded once more...
+        with self.assertNumQueries(6):
+            ids = self.feed_ids(categories='News', page_size=100)
+        self.assertEqual(ids, self.expected(categories=self.news))
+        # ...and then served from memory.
+        cache.clear()
+        with self.assertNumQueries(5):
+            self.feed_ids(categories='News', page_size=100)
+
+        first = self.client.get('/api/posts/', {'categories': 'News', 'page_size': 2}).data
+        back = self.client.get(self.client.get(first['next']).data['previous']).data
+        self.assertEqual([p['id'] for p in back['results']], [p['id'] for p in first['results']])
+
+    def test_rebuild_command(self):
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.feed_ids(categories='News'), self.expected(categories=self.news))
+        self.assertEqual(self.feed_ids(author='other'), self.expected(author=self.other))
+
+class PostFilterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.news = Category.objects.create(name='News')
+        self.tag = Tag.objects.create(name='django')
+        self.posts = []
+        for i in range(6):
+            post = Post.objects.create(title=f'Post {i}', content='Content.', author=self.user)
+            post.categories.add(self.news)
+            if i % 2:
+                post.tags.add(self.tag)
+            self.posts.append(post)
+        self.since, self.until = self.posts[1].pub_date, self.posts[4].pub_date
+
+    def ids(self, **params):
+        response = self.client.get('/api/posts/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['id'] for post in response.data['results']]
+
+    def expected(self, **filters):
+        return list(Post.objects.filter(**filters).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def test_publication_date_range(self):
+        ids = self.ids(publication_date__gte=self.since.isoformat(), publication_date__lte=self.until.isoformat())
+        self.assertEqual(ids, self.expected(pub_date__range=(self.since, self.until)))
+        self.assertEqual(len(ids), 4)
+
+        response = self.client.get('/api/posts/', {'publication_date__gte': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tags(self):
+        self.assertEqual(self.ids(tags='django'), self.expected(tags=self.tag))
+        self.assertEqual(self.ids(tags='django', search='Post'), self.expected(tags=self.tag))
+        self.assertEqual(self.ids(tags='missing'), [])
+
+        refresh = RefreshToken.for_user(self.user)
+        response = self.client.post(
+            '/api/posts/', {'title': 'Tagged', 'content': 'Content.', 'categories': [self.news.pk], 'tags': [self.tag.pk]},
+            HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}',
+        )
+        self.assertEqual(response.data['tags'], [self.tag.pk])
+        self.assertEqual(self.ids(tags='django')[0], response.data['id'])
+
+    def feed_range(self, **params):
+        params.update(publication_date__gte=self.since.isoformat(), publication_date__lte=self.until.isoformat())
+        with CaptureQueriesContext(connection) as queries:
+            ids = self.ids(**params)
+        self.assertTrue(any('post_feedentry' in query['sql'] for query in queries))
+        return ids
+
+    def test_date_range_reads_the_feed(self):
+        expected = self.expected(pub_date__range=(self.since, self.until))
+        self.assertEqual(self.feed_range(categories='News'), expected)
+        self.assertEqual(self.feed_range(author='testuser'), expected)
+        self.assertEqual(
+            self.feed_range(tags='django'),
+            self.expected(tags=self.tag, pub_date__range=(self.since, self.until)),
+        )
+
+    @override_settings(POST_FEED_STORE='memory')
+    def test_date_range_in_memory_store(self):
+        expected = self.expected(pub_date__range=(self.since, self.until))
+        self.assertEqual(self.feed_range(categories='News'), expected)
+        first = self.client.get('/api/posts/', {
+            'categories': 'News', 'page_size': 2, 'publication_date__gte': self.since.isoformat(),
+        }).data
+        second = self.client.get(first['next']).data
+        third = self.client.get(second['next']).data
+        self.assertIsNone(third['next'])
+        self.assertEqual(
+            [p['id'] for p in first['results'] + second['results'] + third['results']],
+            self.expected(pub_date__gte=self.since),
+        )
+
+class PostSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+
+    def search(self, term):
+        response = self.client.get('/api/posts/', {'search': term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['id'] for post in response.data['results']]
+
+    def test_title_matches_rank_above_content_matches(self):
+        in_content = Post.objects.create(title='Weekly notes', content='A few words about django.', author=self.user)
+        in_title = Post.objects.create(title='Django tips', content='Some django tricks.', author=self.user)
+        Post.objects.create(title='Unrelated', content='Nothing to see.', author=self.user)
+
+        self.assertEqual(self.search('django'), [in_title.pk, in_content.pk])
+        self.assertEqual(self.search('djan'), [in_title.pk, in_content.pk])
+
+    def test_arabic_search_ignores_diacritics_and_letter_forms(self):
+        post = Post.objects.create(title='\u0627\u0644\u0645\u064e\u0643\u0652\u062a\u064e\u0628\u064e\u0629', content='\u0623\u062d\u0645\u062f', author=self.user)
+        self.assertEqual(self.search('\u0627\u0644\u0645\u0643\u062a\u0628\u0647'), [post.pk])
+        self.assertEqual(self.search('\u0627\u062d\u0645\u062f'), [post.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = Post.objects.create(title='Old title', content='Content.', author=self.user)
+        post.title = 'New title'
+        post.save()
+        self.assertEqual(self.search('old'), [])
+        self.assertEqual(self.search('new'), [post.pk])
+
+        post.delete()
+        self.assertEqual(self.search('new'), [])
+
+    def test_rebuild_command(self):
+        post = Post.objects.create(title='Indexed later', content='Content.', author=self.user)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        self.assertEqual(self.search('indexed'), [])
+
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.search('indexed'), [post.pk])
+
+class PostCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.post = Post.objects.create(title='Cached post', content='Content.', author=self.user)
+        refresh = RefreshToken.for_user(self.user)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {refresh.access_token}'}
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first = self.client.get('/api/posts/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/posts/')
+        self.assertEqual(first.json(), second.json())
+
+        # Different query parameters are cached separately.
+        response = self.client.get('/api/posts/', {'search': 'nothing'})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_conditional_requests(self):
+        response = self.client.get(f'/api/posts/{self.post.pk}/')
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(f'/api/posts/{self.post.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Comment.objects.create(post=self.post, author=self.user, text='New comment')
+        response = self.client.get(f'/api/posts/{self.post.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_writes_invalidate_cached_pages(self):
+        self.client.get(f'/api/posts/{self.post.pk}/')
+        self.client.get('/api/posts/')
+
+        self.client.post(f'/api/posts/{self.post.pk}/like/', **self.headers)
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.pk}/').data['like_count'], 1)
+        self.assertEqual(self.client.get('/api/posts/').data['results'][0]['like_count'], 1)
+
+        self.client.post(f'/api/posts/{self.post.pk}/comments/', {'text': 'Hello'}, **self.headers)
+        self.assertEqual(len(self.client.get(f'/api/posts/{self.post.pk}/').data['comments']), 1)
+
+        category = Category.objects.create(name='News')
+        self.post.categories.add(category)
+        self.assertEqual(self.client.get('/api/posts/').data['results'][0]['categories'], [category.pk])
+
+        self.post.delete()
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.pk}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_other_posts_stay_cached(self):
+        other = Post.objects.create(title='Other post', content='Content.', author=self.user)
+        self.client.get(f'/api/posts/{other.pk}/')
+        Comment.objects.create(post=self.post, author=self.user, text='New comment')
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/posts/{other.pk}/')
+
+class JSONRenderingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.post = Post.objects.create(title='مرحبا', content='محتوى المقال بالعربية.', author=self.user)
+        Comment.objects.create(post=self.post, author=self.user, text='تعليق')
+
+    def test_responses_are_utf8_and_match_the_stdlib(self):
+        response = self.client.get(f'/api/posts/{self.post.pk}/')
+        self.assertIn('محتوى'.encode('utf-8'), response.content)
+        with override_settings(FAST_JSON=False):
+            cache.clear()
+            stdlib = self.client.get(f'/api/posts/{self.post.pk}/')
+        self.assertEqual(json.loads(response.content), json.loads(stdlib.content))
+
+        # Indented output falls back to the stdlib.
+        response = self.client.get(f'/api/posts/{self.post.pk}/', HTTP_ACCEPT='application/json; indent=4')
+        self.assertIn(b'\n    "id"', response.content)
+
+    def test_parser(self):
+        token = RefreshToken.for_user(self.user).access_token
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        response = self.client.post(f'/api/posts/{self.post.pk}/comments/', '{"text": "رد"}',
+                                    content_type='application/json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Comment.objects.latest('id').text, 'رد')
+        response = self.client.post(f'/api/posts/{self.post.pk}/comments/', '{"text": ',
+                                    content_type='application/json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_plain_representation_matches_drf(self):
+        post = Post.objects.get()
+        plain = PostSerializer(post).data
+        PostSerializer.plain_representation = False
+        try:
+            ordered = PostSerializer(post).data
+        finally:
+            PostSerializer.plain_representation = True
+        self.assertIs(type(plain['comments'][0]), dict)
+        self.assertEqual(json.dumps(plain), json.dumps(ordered))
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.post = Post.objects.create(title='Instrumented post', content='Content.', author=self.user)
+        Comment.objects.create(post=self.post, author=self.user, text='A comment')
+
+    def test_server_timing_header(self):
+        response = self.client.get(f'/api/posts/{self.post.pk}/')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="6 queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    @override_settings(QUERY_BUDGET_ACTION='raise')
+    def test_views_stay_within_their_query_budget(self):
+        self.client.get('/api/posts/')
+        self.client.get(f'/api/posts/{self.post.pk}/')
+        self.client.get(f'/api/posts/{self.post.pk}/comments/')
+
+    @override_settings(QUERY_BUDGET_ACTION='raise', QUERY_BUDGETS={'post-list': 1})
+    def test_query_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/posts/')
+
+    @override_settings(QUERY_BUDGETS={'post-list': 1})
+    def test_query_budget_exceeded_is_logged_by_default(self):
+        with self.assertLogs('Blog.instrumentation', level='WARNING'):
+            response = self.client.get('/api/posts/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/posts/')
+        self.client.get('/api/posts/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+        admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.client.force_login(admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE blog_db_queries histogram', body)
+        self.assertIn('blog_request_duration_seconds_count{route="post-list"} 2', body)
+        self.assertIn('blog_db_queries_bucket{route="post-list",le="+Inf"} 2', body)
+
+class DatabaseSettingsTest(TestCase):
+    def test_parse_database_url(self):
+        self.assertEqual(parse_database_url('sqlite:///db.sqlite3', '/srv/blog'), {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': '/srv/blog/db.sqlite3',
+            'PRAGMAS': SQLITE_PRAGMAS,
+        })
+        config = parse_database_url('sqlite:////var/lib/blog.db?journal_mode=wal', '/srv/blog')
+        self.assertEqual(config['NAME'], '/var/lib/blog.db')
+        self.assertEqual(config['PRAGMAS'], {**SQLITE_PRAGMAS, 'journal_mode': 'wal', 'synchronous': 'normal'})
+        config = parse_database_url('sqlite:////var/lib/blog.db?journal_mode=wal&synchronous=full', '/srv/blog')
+        self.assertEqual(config['PRAGMAS']['synchronous'], 'full')
+
+        self.assertEqual(parse_database_url('postgres://blog:p%40ss@db:5433/blog?sslmode=require', '/srv/blog'), {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': 'blog',
+            'USER': 'blog',
+            'PASSWORD': 'p@ss',
+            'HOST': 'db',
+            'PORT': '5433',
+            'OPTIONS': {'sslmode': 'require'},
+        })
+        with self.assertRaises(ImproperlyConfigured):
+            parse_database_url('mysql://db/blog', '/srv/blog')
+
+    def test_connections_persist_unless_disabled(self):
+        config = database_from_env('/srv/blog', environ={})
+        self.assertEqual(config['NAME'], '/srv/blog/db.sqlite3')
+        self.assertEqual(config['CONN_MAX_AGE'], 60)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+
+        config = database_from_env('/srv/blog', environ={'DATABASE_CONN_MAX_AGE': '0'})
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertFalse(config['CONN_HEALTH_CHECKS'])
+
+    def test_pools(self):
+        url = 'postgres://blog@db/blog'
+        config = database_from_env('/srv/blog', environ={'DATABASE_URL': url, 'DATABASE_POOL': 'pgbouncer'})
+        self.assertTrue(config['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual(config['CONN_MAX_AGE'], 60)
+
+        with self.assertRaises(ImproperlyConfigured):
+            database_from_env('/srv/blog', environ={'DATABASE_POOL': 'pgbouncer'})
+        with self.assertRaises(ImproperlyConfigured):
+            database_from_env('/srv/blog', environ={'DATABASE_URL': url, 'DATABASE_POOL': 'unknown'})
+
+    def pragmas(self, environ):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        handler = ConnectionHandler({'default': database_from_env(directory.name, environ=environ)})
+        self.addCleanup(handler.close_all)
+        with handler['default'].cursor() as cursor:
+            values = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                cursor.execute(f'PRAGMA {name}')
+                values[name] = cursor.fetchone()[0]
+        return values
+
+    def test_sqlite_pragmas_are_set_on_connect(self):
+        # WAL is opt-in: it would rewrite the database file itself.
+        self.assertEqual(self.pragmas({}), {
+            'journal_mode': 'delete',
+            'synchronous': 2,
+            'busy_timeout': 5000,
+            'mmap_size': SQLITE_PRAGMAS['mmap_size'],
+        })
+        self.assertEqual(self.pragmas({'DATABASE_URL': 'sqlite:///db.sqlite3?journal_mode=wal'}), {
+            'journal_mode': 'wal',
+            'synchronous': 1,
+            'busy_timeout': 5000,
+            'mmap_size': SQLITE_PRAGMAS['mmap_size'],
+        })
+
+@override_settings(READ_REPLICAS={'DATABASES': {'test-replica1': 1, 'test-replica2': 3}, 'STICKY_SECONDS': 5})
+class ReplicaRoutingTest(TestCase):
+    replicas = ('test-replica1', 'test-replica2')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Two more SQLite connections to the test database, like the mirrors
+        # the test runner makes of DATABASE_REPLICA_URLS. read_uncommitted
+        # lets them see what each test writes inside its transaction.
+        default = connections['default'].settings_dict
+        for alias in cls.replicas:
+            connections.settings[alias] = {
+                **default,
+                'TEST': {**default['TEST'], 'MIRROR': 'default'},
+                'PRAGMAS': {'read_uncommitted': 1},
+            }
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in cls.replicas:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.post = Post.objects.create(title='Replicated post', content='Content.', author=self.author)
+        Comment.objects.create(post=self.post, author=self.author, text='First')
+        # Claims tokens: safe requests authenticate without a query.
+        token = ClaimsRefreshToken.for_user(self.reader).access_token
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        self.comments = f'/api/posts/{self.post.pk}/comments/'
+
+    def read_from(self, path, **extra):
+        """
+        GET `path` and return the databases it queried.
+        """
+        with ExitStack() as stack:
+            captured = {alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in ('default', *self.replicas)}
+            response = self.client.get(path, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [alias for alias, queries in captured.items() if len(queries)]
+
+    def test_safe_requests_are_spread_over_the_replicas(self):
+        used = Counter(tuple(self.read_from(self.comments)) for _ in range(8))
+        self.assertEqual(used, {('test-replica1',): 2, ('test-replica2',): 6})
+
+    def test_writers_read_from_the_primary_for_a_while(self):
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in self.replicas]
+            response = self.client.post(self.comments, {'text': 'Mine'}, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([len(queries) for queries in captured], [0, 0])
+
+        self.assertEqual(self.read_from(self.comments, **self.headers), ['default'])
+        self.assertNotIn('default', self.read_from(self.comments))
+
+        cache.delete(written_key(self.reader.pk))
+        self.assertNotIn('default', self.read_from(self.comments, **self.headers))
+
+    def test_cached_posts_are_rebuilt_from_the_primary_after_a_change(self):
+        path = f'/api/posts/{self.post.pk}/'
+        # Changed a minute ago: the replicas have caught up.
+        changed = time.time_ns() - 60 * 1_000_000_000
+        cache.set_many({GLOBAL_GENERATION: changed, post_generation_key(self.post.pk): changed}, timeout=None)
+        self.assertNotIn('default', self.read_from(path, **self.headers))
+
+        invalidate_posts([self.post.pk])
+        self.assertEqual(self.read_from(path, **self.headers), ['default'])
+
+@override_settings(ROOT_URLCONF='Blog.asgi_urls')
+class AsyncViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.post = Post.objects.create(title='Async post', content='Content.', author=self.user)
+        Comment.objects.create(post=self.post, author=self.user, text='A comment')
+        token = RefreshToken.for_user(self.user).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def post_json(self, path, data=None, **kwargs):
+        return self.async_client.post(path, data or {}, content_type='application/json', **kwargs)
+
+    def queries(self, response):
+        return response['Server-Timing'].split('desc="')[1].split(' ')[0]
+
+    def sync_get(self, path):
+        cache.clear()
+        with self.settings(ROOT_URLCONF='Blog.urls'):
+            response = self.client.get(path)
+        cache.clear()
+        return response
+
+    async def test_reads_match_the_sync_views(self):
+        for path in ['/api/posts/', f'/api/posts/{self.post.pk}/', '/api/posts/?fields=id,title&page_size=1',
+                     f'/api/posts/{self.post.pk}/?expand=author']:
+            expected = await sync_to_async(self.sync_get)(path)
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), expected.json())
+            self.assertEqual(self.queries(response), self.queries(expected))
+            self.assertIn('ETag', response)
+
+        # Served from the cache, on the event loop.
+        response = await self.async_client.get(path)
+        self.assertEqual(self.queries(response), '0')
+        response = await self.async_client.get(path, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = await self.async_client.get('/api/posts/0/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_other_requests_are_delegated(self):
+        response = await self.async_client.get('/api/posts/', {'search': 'nothing'})
+        self.assertEqual(response.json()['results'], [])
+        response = await self.async_client.get('/api/posts/', {'author': 'testuser'})
+        self.assertEqual(len(response.json()['results']), 1)
+        response = await self.async_client.patch(f'/api/posts/{self.post.pk}/', {'title': 'Renamed'},
+                                                 content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await self.async_client.get(f'/api/posts/{self.post.pk}/')
+        self.assertEqual(response.json()['title'], 'Renamed')
+        response = await self.async_client.get(f'/api/posts/{self.post.pk}/comments/')
+        self.assertEqual(response.json()['results'][0]['text'], 'A comment')
+
+    async def test_comment_create(self):
+        path = f'/api/posts/{self.post.pk}/comments/'
+        response = await self.post_json(path, {'text': 'Hello'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('WWW-Authenticate', response)
+
+        response = await self.post_json(path, {'text': 'Hello'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['author'], self.user.pk)
+        self.assertEqual((await self.post.comments.alatest('id')).text, 'Hello')
+        response = await self.post_json(path, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.post_json(path, ['Hello'], headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.post_json('/api/posts/0/comments/', {'text': 'Hello'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        parent = await self.post.comments.alatest('id')
+        response = await self.post_json(path, {'text': 'Reply', 'parent': parent.pk}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['depth'], 1)
+
+    async def test_reactions(self):
+        path = f'/api/posts/{self.post.pk}/'
+        await self.async_client.get(path)
+        response = await self.post_json(f'{path}like/', headers=self.headers)
+        self.assertEqual(response.json(), {'status': 'success', 'active': True, 'like_count': 1, 'dislike_count': 0})
+        response = await self.post_json(f'{path}dislike/', headers=self.headers)
+        self.assertEqual(response.json()['like_count'], 0)
+        self.assertEqual((await self.async_client.get(path)).json()['dislike_count'], 1)
+        response = await self.post_json(f'{path}like/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_author_permission_compares_ids(self):
+        request = RequestFactory().put('/')
+        request.user = self.user
+        post = Post.objects.get(pk=self.post.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(IsAuthorOrReadOnly().has_object_permission(request, None, post))
+
+class ImageVariantTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, IMAGE_VARIANT_QUEUE='sync')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_login(self.user)
+
+    def upload(self, size=(800, 400), name='photo.png'):
+        buffer = BytesIO()
+        PILImage.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(image=SimpleUploadedFile(name, buffer.getvalue()))
+        image.refresh_from_db()
+        return image
+
+    def test_variants_are_generated_after_upload(self):
+        image = self.upload()
+        self.assertEqual((image.width, image.height), (800, 400))
+        self.assertIsNotNone(image.processed_at)
+        variants = {(v.format, v.width): v for v in image.variants.all()}
+        self.assertEqual(set(variants), {('webp', 320), ('webp', 640), ('jpeg', 320), ('jpeg', 640)})
+        self.assertEqual(variants['webp', 320].height, 160)
+        self.assertLess(variants['webp', 320].size, image.image.size)
+
+        post = Post.objects.create(title='Photo', content='Content.', author=self.user)
+        post.images.add(image)
+        data = self.client.get(f'/api/posts/{post.pk}/').data['images'][0]
+        self.assertEqual((data['width'], data['height']), (800, 400))
+        self.assertRegex(data['srcset']['webp'], r'^http://testserver/media/images/variants/\S+ 320w, \S+ 640w$')
+
+    def test_small_originals_are_not_upscaled(self):
+        image = self.upload(size=(100, 80))
+        self.assertEqual(set(image.variants.values_list('width', flat=True)), {100})
+
+    def test_command_is_idempotent(self):
+        with override_settings(IMAGE_VARIANT_QUEUE='command'):
+            image = self.upload()
+        self.assertFalse(image.variants.exists())
+
+        out = StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn('wrote 4 variants; 0 images still pending', out.getvalue())
+        first = set(image.variants.values_list('pk', flat=True))
+
+        call_command('generate_image_variants', all=True, stdout=out)
+        self.assertEqual(set(image.variants.values_list('pk', flat=True)), first)
+
+        call_command('generate_image_variants', force=True, stdout=out)
+        self.assertEqual(image.variants.count(), 4)
+        self.assertFalse(set(image.variants.values_list('pk', flat=True)) & first)
+
+    def test_processing_budget(self):
+        with override_settings(IMAGE_VARIANTS={'MAX_PIXELS': 1000}):
+            image = self.upload()
+        self.assertIsNotNone(image.processed_at)
+        self.assertFalse(image.variants.exists())
+
+        with override_settings(IMAGE_VARIANT_QUEUE='command'):
+            self.upload(name='second.png')
+        out = StringIO()
+        call_command('generate_image_variants', budget=0, stdout=out)
+        self.assertIn('Processed 0 images and wrote 0 variants; 1 images still pending', out.getvalue())
+
+class UploadTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.partial = os.path.join(media.name, 'partial')
+        settings = override_settings(
+            MEDIA_ROOT=media.name,
+            IMAGE_VARIANT_QUEUE='command',
+            UPLOADS={'CHUNK_SIZE': 4, 'MIN_CHUNK_SIZE': 1, 'DIRECTORY': self.partial},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.category = Category.objects.create(name='News')
+        self.client.force_login(self.user)
+
+    def start(self, content, kind='attachment', filename='notes.txt'):
+        response = self.client.post('/api/uploads/', {'kind': kind, 'filename': filename, 'size': len(content)})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def put_chunk(self, upload_id, index, data, **headers):
+        return self.client.put(f'/api/uploads/{upload_id}/chunks/{index}/', data,
+                               content_type='application/octet-stream', **headers)
+
+    def complete(self, upload_id, content):
+        return self.client.post(f'/api/uploads/{upload_id}/complete/',
+                                {'checksum': hashlib.sha256(content).hexdigest()})
+
+    def test_interrupted_upload_resumes(self):
+        content = b'0123456789'
+        upload = self.start(content)
+        self.assertEqual((upload['chunk_size'], upload['chunk_count'], upload['missing_chunks']), (4, 3, [0, 1, 2]))
+
+        self.assertEqual(self.put_chunk(upload['id'], 2, content[8:]).status_code, status.HTTP_204_NO_CONTENT)
+        self.put_chunk(upload['id'], 0, content[:4])
+        self.assertEqual(self.client.get(f'/api/uploads/{upload["id"]}/').data['missing_chunks'], [1])
+        self.assertEqual(self.complete(upload['id'], content).status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.put_chunk(upload['id'], 1, content[4:8])
+        response = self.complete(upload['id'], content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], Upload.COMPLETE)
+        attachment = Attachment.objects.get(pk=response.data['attachment'])
+        with attachment.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.partial), [])
+
+        response = self.client.post('/api/posts/', {
+            'title': 'With upload', 'content': 'Content.', 'categories': [self.category.pk], 'uploads': [upload['id']],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(Post.objects.get().attachments.all()), [attachment])
+
+    def test_chunks_and_checksums_are_checked(self):
+        content = b'0123456789'
+        upload = self.start(content)
+        self.assertEqual(self.put_chunk(upload['id'], 0, b'012').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(upload['id'], 3, b'0').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.put_chunk(upload['id'], 0, b'0123', HTTP_X_CHUNK_SHA256=hashlib.sha256(b'xxxx').hexdigest())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadChunk.objects.exists())
+
+        for index in range(3):
+            self.put_chunk(upload['id'], index, content[index * 4:index * 4 + 4])
+        self.assertEqual(self.complete(upload['id'], b'something else').status_code, status.HTTP_400_BAD_REQUEST)
+
+        # A corrupted resend overwrote the good bytes, so the chunk is missing again.
+        response = self.put_chunk(upload['id'], 1, b'xxxx', HTTP_X_CHUNK_SHA256=hashlib.sha256(b'4567').hexdigest())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload["id"]}/').data['missing_chunks'], [1])
+        self.put_chunk(upload['id'], 1, b'4567')
+
+        other = User.objects.create_user(username='other', password='otherpass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload["id"]}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_login(self.user)
+        self.assertEqual(self.complete(upload['id'], content).status_code, status.HTTP_200_OK)
+
+        self.client.force_login(other)
+        response = self.client.post('/api/posts/', {
+            'title': 'Stolen', 'content': 'Content.', 'categories': [self.category.pk], 'uploads': [upload['id']],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('uploads', response.data)
+
+    def test_lost_partial_file_asks_for_every_chunk(self):
+        content = b'0123456789'
+        upload = self.start(content)
+        for index in range(3):
+            self.put_chunk(upload['id'], index, content[index * 4:index * 4 + 4])
+        os.remove(os.path.join(self.partial, f'{upload["id"]}.part'))
+
+        response = self.complete(upload['id'], content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('chunks', response.data)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload["id"]}/').data['missing_chunks'], [0, 1, 2])
+
+    def test_image_upload(self):
+        buffer = BytesIO()
+        PILImage.new('RGB', (20, 10)).save(buffer, 'PNG')
+        content = buffer.getvalue()
+        upload = self.start(content, kind='image', filename='../photo.png')
+        for index in range(upload['chunk_count']):
+            self.put_chunk(upload['id'], index, content[index * 4:index * 4 + 4])
+        response = self.complete(upload['id'], content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        image = Image.objects.get(pk=response.data['image'])
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(image.image.name, f'blobs/{digest[:2]}/{digest}.png')
+
+        not_an_image = self.start(b'text', kind='image')
+        self.put_chunk(not_an_image['id'], 0, b'text')
+        self.assertEqual(self.complete(not_an_image['id'], b'text').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_purge_expired_uploads(self):
+        upload = self.start(b'0123')
+        self.put_chunk(upload['id'], 0, b'0123')
+        Upload.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.client.get(f'/api/uploads/{upload["id"]}/').status_code, status.HTTP_404_NOT_FOUND)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('purge_uploads', stdout=StringIO())
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(self.partial), [])
+
+class MediaBlobTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=media.name, IMAGE_VARIANT_QUEUE='command',
+                                     UPLOADS={'CHUNK_SIZE': 4, 'MIN_CHUNK_SIZE': 1})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.category = Category.objects.create(name='News')
+
+    def stored_files(self, directory):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(os.path.join(self.media, directory)) for name in names
+        )
+
+    def test_identical_files_share_one_blob(self):
+        posts = []
+        for name in ('report.pdf', 'copy.pdf'):
+            post = Post.objects.create(title=name, content='Content.', author=self.user)
+            post.attachments.add(Attachment.objects.create(file=SimpleUploadedFile(name, b'%PDF same bytes')))
+            posts.append(post)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(set(Attachment.objects.values_list('file', flat=True)), {blob.file.name})
+        self.assertEqual(self.stored_files('blobs'), [blob.file.name])
+        self.assertEqual(self.stored_files('attachments'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[0].delete()
+        self.assertEqual(Attachment.objects.count(), 1)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[1].delete()
+        self.assertFalse(Attachment.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(self.stored_files('blobs'), [])
+
+    def test_known_upload_needs_no_chunks(self):
+        self.client.force_login(self.user)
+        content = b'0123456789'
+        checksum = hashlib.sha256(content).hexdigest()
+        data = {'kind': 'attachment', 'filename': 'notes.txt', 'size': len(content), 'checksum': checksum}
+        first = self.client.post('/api/uploads/', data).data
+        self.assertEqual(first['status'], Upload.PENDING)
+        for index in range(first['chunk_count']):
+            self.client.put(f'/api/uploads/{first["id"]}/chunks/{index}/', content[index * 4:index * 4 + 4],
+                            content_type='application/octet-stream')
+        self.client.post(f'/api/uploads/{first["id"]}/complete/')
+
+        second = self.client.post('/api/uploads/', data).data
+        self.assertEqual(second['status'], Upload.COMPLETE)
+        self.assertNotEqual(second['attachment'], first['attachment'])
+        self.assertEqual(Blob.objects.get(sha256=checksum).ref_count, 2)
+
+        # Another user still has to send the bytes.
+        other = User.objects.create_user(username='other', password='otherpass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.post('/api/uploads/', data).data['status'], Upload.PENDING)
+
+    def test_dedupe_media_command(self):
+        storage = Attachment._meta.get_field('file').storage
+        for name, content in (('attachments/a.txt', b'same'), ('attachments/b.txt', b'same'), ('images/c.txt', b'other')):
+            storage.save(name, ContentFile(content))
+        first = Attachment.objects.create(file='attachments/a.txt')
+        second = Attachment.objects.create(file='attachments/b.txt')
+        image = Image.objects.create(image='images/c.txt')
+        Post.objects.create(title='Post', content='Content.', author=self.user).attachments.add(first, second)
+
+        out = StringIO()
+        call_command('dedupe_media', dry_run=True, stdout=out)
+        self.assertIn('3 files hashed, 1 duplicates; Would reclaim 4 bytes', out.getvalue())
+        self.assertFalse(Blob.objects.exists())
+
+        call_command('dedupe_media', stdout=out)
+        second.refresh_from_db()
+        image.refresh_from_db()
+        self.assertEqual(second.file.name, 'attachments/a.txt')
+        self.assertEqual(Blob.objects.get(sha256=hashlib.sha256(b'same').hexdigest()).ref_count, 2)
+        self.assertEqual(image.blob.ref_count, 1)
+        self.assertEqual(self.stored_files('attachments'), ['attachments/a.txt'])
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', collect=True, grace=0, stdout=out)
+        self.assertIn('0 files hashed', out.getvalue())
+        # The image belongs to no post.
+        self.assertIn('Deleted 1 unused media rows', out.getvalue())
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(self.stored_files('images'), [])
+
+class MediaServingTest(TestCase):
+    content = b'0123456789abcdefghij'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=media.name, IMAGE_VARIANT_QUEUE='command')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.attachment = Attachment.objects.create(file=SimpleUploadedFile('notes.txt', self.content))
+        self.url = f'/media/{self.attachment.file.name}'
+
+    def test_serves_blob_with_immutable_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(self.content).hexdigest()}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.post(self.url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5-9')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), b'56789')
+        self.assertEqual(response['Content-Range'], 'bytes 5-9/20')
+        self.assertEqual(response['Content-Length'], '5')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), b'ghij')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */20')
+
+        # A stale If-Range gets the whole file.
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_only_referenced_files_are_served(self):
+        directory = get_upload_settings()['DIRECTORY']
+        self.assertEqual(directory, os.path.join(self.media, 'uploads', 'partial'))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'secret.part'), 'wb') as f:
+            f.write(b'partial')
+        self.assertEqual(self.client.get('/media/uploads/partial/secret.part').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/media/../db.sqlite3').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_proxy_backends(self):
+        with override_settings(MEDIA_SERVING={'BACKEND': 'x-accel-redirect', 'ACCEL_REDIRECT_PREFIX': '/internal/'}):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/internal/{self.attachment.file.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+        with override_settings(MEDIA_SERVING={'BACKEND': 'x-sendfile'}):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.attachment.file.path)
+
+class SeedBlogCommandTest(TestCase):
+    options = {'users': 8, 'categories': 3, 'tags': 4, 'posts': 12, 'comments': 2, 'reactions': 3,
+               'subscriptions': 1, 'notifications': 3, 'batch_size': 5, 'stdout': StringIO()}
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by('pk').values_list('title', 'content', 'author__username', 'like_count')),
+            list(Comment.objects.order_by('pk').values_list('post__title', 'text')),
+            sorted(Post.likes.through.objects.values_list('post__title', 'user__username')),
+        )
+
+    def test_seed_is_reproducible(self):
+        call_command('seed_blog', seed=3, **self.options)
+        first = self.snapshot()
+        self.assertEqual(Post.objects.count(), 12)
+        post = Post.objects.order_by('?').first()
+        self.assertEqual(post.like_count, post.likes.count())
+        self.assertEqual(post.dislike_count, post.dislikes.count())
+        self.assertEqual(FeedEntry.objects.filter(kind=FeedEntry.AUTHOR).count(), 12)
+        self.assertFalse(Comment.objects.filter(path='').exists())
+        user = User.objects.get(username='seed-user-0')
+        self.assertTrue(user.check_password('seed-password'))
+        self.assertEqual(
+            NotificationInbox.objects.get(user=user).unread_count,
+            Notification.objects.filter(user=user, is_read=False).count(),
+        )
+
+        with self.assertRaises(CommandError):
+            call_command('seed_blog', seed=3, **self.options)
+
+        for model in (Post, Category, Tag, User):
+            model.objects.all().delete()
+        call_command('seed_blog', seed=3, **self.options)
+        self.assertEqual(self.snapshot(), first)
+
 class CategoryModelTest(TestCase):
     def test_create_category(self):
         category_data = {'name': 'Test Category'}
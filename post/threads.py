@@ -0,0 +1,132 @@
+"""
+Threaded comments, stored as a materialized path.
+
+A comment's `path` is its ancestors' ids and its own, each zero-padded to
+PATH_WIDTH digits and followed by '/', so a subtree is the contiguous range
+of paths starting with its root's and is read with one index range scan
+on (post, path). `depth` counts the ancestors and `reply_count` the direct
+replies; both are kept up to date as comments are added and removed, so
+neither needs a query to render.
+"""
+from django.conf import settings
+from django.db.models import CharField, F, Q, Value, Window
+from django.db.models.functions import Cast, Concat, LPad, RowNumber
+
+from .models import Comment, Post
+
+
+PATH_WIDTH = 10
+
+
+def get_comment_thread_settings():
+    return {
+        # Deepest reply that can be posted; the path column holds 23 levels.
+        'MAX_NESTING': 20,
+        # Levels of replies a list can nest, and how many per comment.
+        'MAX_DEPTH': 5,
+        'REPLIES': 5,
+        'MAX_REPLIES': 50,
+        **getattr(settings, 'COMMENT_THREADS', {}),
+    }
+
+
+def get_thread_options(params):
+    """
+    The (depth, replies) of a threaded comment list from its query
+    parameters, or None for a flat list.
+    """
+    if 'depth' not in params:
+        return None
+    options = get_comment_thread_settings()
+    return (
+        bounded_int(params.get('depth'), 1, options['MAX_DEPTH']),
+        bounded_int(params.get('replies'), options['REPLIES'], options['MAX_REPLIES']),
+    )
+
+
+def bounded_int(value, default, maximum):
+    try:
+        return max(0, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
+
+
+def path_segment(comment_id):
+    return f'{comment_id:0{PATH_WIDTH}d}/'
+
+
+def subtree_filter(path):
+    """
+    Match the comment at `path` and everything below it. Paths are digits
+    and slashes, and '0' sorts right after '/'.
+    """
+    return Q(path__gte=path, path__lt=path[:-1] + '0')
+
+
+def place_comment(comment):
+    """
+    Set the path and depth of a newly saved comment and count it as a reply
+    to its parent.
+    """
+    parent = comment.parent if comment.parent_id is not None else None
+    comment.path = (parent.path if parent is not None else '') + path_segment(comment.pk)
+    comment.depth = parent.depth + 1 if parent is not None else 0
+    Comment.objects.filter(pk=comment.pk).update(path=comment.path, depth=comment.depth)
+    if parent is not None:
+        Comment.objects.filter(pk=parent.pk).update(reply_count=F('reply_count') + 1)
+
+
+def set_root_paths(queryset):
+    """
+    Give the top-level comments in `queryset` that have no path yet theirs,
+    in a single UPDATE; for comments inserted with bulk_create.
+    """
+    segment = Concat(LPad(Cast('id', CharField()), PATH_WIDTH, Value('0')), Value('/'))
+    return queryset.filter(parent=None, path='').update(path=segment, depth=0)
+
+
+def remove_comment(comment, origin=None):
+    """
+    Stop counting a deleted comment as a reply. Deleting a post or an
+    ancestor removes the parent too, so nothing is left to update.
+    """
+    if comment.parent_id is None or isinstance(origin, Post):
+        return
+    if isinstance(origin, Comment) and origin.pk != comment.pk:
+        return
+    Comment.objects.filter(pk=comment.parent_id).update(reply_count=F('reply_count') - 1)
+
+
+def attach_replies(comments, queryset, depth, replies):
+    """
+    Set `thread_replies` on each of `comments`, which must be siblings, to
+    its first `replies` replies in (created_at, id) order, each carrying
+    its own down to `depth` levels below `comments`. The whole forest is
+    read in one query from `queryset`. A reply left out by the `replies`
+    limit may still have replies of its own in the rows read; they are
+    dropped.
+    """
+    for comment in comments:
+        comment.thread_replies = []
+    if not comments or depth < 1:
+        return comments
+
+    level = comments[0].depth
+    subtrees = Q()
+    for comment in comments:
+        subtrees |= subtree_filter(comment.path)
+    rank = Window(RowNumber(), partition_by=[F('parent_id')], order_by=[F('created_at').asc(), F('id').asc()])
+    rows = (
+        queryset.filter(subtrees, depth__gt=level, depth__lte=level + depth)
+        .annotate(sibling_rank=rank)
+        .filter(sibling_rank__lte=replies)
+        .order_by('depth', 'created_at', 'id')
+    )
+    nodes = {comment.pk: comment for comment in comments}
+    for row in rows:
+        parent = nodes.get(row.parent_id)
+        if parent is not None:
+            row.thread_replies = []
+            parent.thread_replies.append(row)
+            nodes[row.pk] = row
+    return comments
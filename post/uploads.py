@@ -0,0 +1,172 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image as PILImage, UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+from .blobs import acquire_existing, acquire_path
+from .models import Attachment, Image, Upload, UploadChunk
+
+
+def get_upload_settings():
+    return {
+        'CHUNK_SIZE': 5 * 1024 * 1024,
+        'MIN_CHUNK_SIZE': 256 * 1024,
+        'MAX_CHUNK_SIZE': 64 * 1024 * 1024,
+        'MAX_SIZE': 2 * 1024 * 1024 * 1024,
+        'TTL': 24 * 60 * 60,
+        'DIRECTORY': os.path.join(settings.MEDIA_ROOT, 'uploads', 'partial'),
+        'BUFFER_SIZE': 64 * 1024,
+        **getattr(settings, 'UPLOADS', {}),
+    }
+
+
+def part_path(upload_id):
+    return os.path.join(get_upload_settings()['DIRECTORY'], f'{upload_id}.part')
+
+
+def default_expiry():
+    return timezone.now() + timedelta(seconds=get_upload_settings()['TTL'])
+
+
+def write_chunk(upload, index, stream, length, sha256=None):
+    """
+    Copy chunk `index` from `stream` into the upload's partial file in
+    BUFFER_SIZE pieces, so memory use does not depend on the chunk size.
+    Writing a chunk again replaces it; when that fails (short or not
+    matching `sha256`) the chunk is no longer counted as received, since
+    its bytes in the file were overwritten.
+    """
+    if not 0 <= index < upload.chunk_count:
+        raise ValidationError({'index': f'Chunk index must be between 0 and {upload.chunk_count - 1}.'})
+    expected = upload.chunk_length(index)
+    if length != expected:
+        raise ValidationError({'size': f'Chunk {index} must be {expected} bytes, got {length}.'})
+
+    config = get_upload_settings()
+    os.makedirs(config['DIRECTORY'], exist_ok=True)
+    digest = hashlib.sha256()
+    try:
+        # O_CREAT without O_TRUNC: chunks may arrive in any order and in parallel.
+        with os.fdopen(os.open(part_path(upload.pk), os.O_RDWR | os.O_CREAT, 0o600), 'r+b') as f:
+            f.seek(index * upload.chunk_size)
+            remaining = length
+            while remaining:
+                data = stream.read(min(config['BUFFER_SIZE'], remaining))
+                if not data:
+                    raise ValidationError({'size': f'Chunk {index} ended after {length - remaining} bytes.'})
+                f.write(data)
+                digest.update(data)
+                remaining -= len(data)
+
+        if sha256 and digest.hexdigest() != sha256.lower():
+            raise ValidationError({'checksum': f'Chunk {index} does not match its SHA-256.'})
+    except ValidationError:
+        UploadChunk.objects.filter(upload=upload, index=index).delete()
+        raise
+    UploadChunk.objects.bulk_create([UploadChunk(upload=upload, index=index)], ignore_conflicts=True)
+
+
+def missing_chunks(upload, received=None):
+    if received is None:
+        received = upload.chunks.values_list('index', flat=True)
+    return sorted(set(range(upload.chunk_count)) - set(received))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    buffer_size = get_upload_settings()['BUFFER_SIZE']
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(buffer_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete_upload(upload, checksum=None):
+    """
+    Check that every chunk arrived and that the file matches `checksum` (or
+    the one given when the session was created), then store it as the
+    session's Attachment or Image, sharing the blob of any identical file
+    already stored. Completing twice returns the same object.
+    """
+    with transaction.atomic():
+        upload = Upload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status == Upload.COMPLETE:
+            return upload
+
+        missing = missing_chunks(upload)
+        if missing:
+            raise ValidationError({'chunks': f'Missing chunks: {missing[:20]}.'})
+        checksum = (checksum or upload.checksum).lower()
+        if not checksum:
+            raise ValidationError({'checksum': 'A SHA-256 checksum is required.'})
+        path = part_path(upload.pk)
+        lost = not os.path.exists(path)
+        if lost:
+            # Removed under the session, say by hand: the chunks it held
+            # have to be sent again.
+            upload.chunks.all().delete()
+        else:
+            if os.path.getsize(path) != upload.size or file_sha256(path) != checksum:
+                raise ValidationError({'checksum': 'The uploaded file does not match its SHA-256.'})
+            store_upload(upload, path, checksum)
+    if lost:
+        raise ValidationError({'chunks': f'The partial file is gone; missing chunks: {missing_chunks(upload)[:20]}.'})
+    remove_part(upload.pk)
+    return upload
+
+
+def store_upload(upload, path, checksum):
+    if upload.kind == Upload.IMAGE:
+        try:
+            with PILImage.open(path) as image:
+                image.verify()
+        except (OSError, UnidentifiedImageError, PILImage.DecompressionBombError):
+            raise ValidationError({'kind': 'The uploaded file is not a valid image.'})
+
+    blob = acquire_path(path, checksum, upload.size, upload.filename)
+    if upload.kind == Upload.IMAGE:
+        upload.image = Image.objects.create(image=blob.file.name, blob=blob)
+    else:
+        upload.attachment = Attachment.objects.create(file=blob.file.name, blob=blob)
+    upload.status = Upload.COMPLETE
+    upload.checksum = checksum
+    upload.save(update_fields=['status', 'checksum', 'attachment', 'image'])
+    upload.chunks.all().delete()
+
+
+def complete_known_upload(upload):
+    """
+    Complete a new session without any transfer when its owner already
+    uploaded the same content (same kind, size and SHA-256) and the blob is
+    still stored. Returns whether it did.
+    """
+    if not upload.checksum:
+        return False
+    known = Upload.objects.filter(
+        owner_id=upload.owner_id, kind=upload.kind, size=upload.size, checksum=upload.checksum, status=Upload.COMPLETE,
+    ).exclude(pk=upload.pk)
+    if not known.exists():
+        return False
+    with transaction.atomic():
+        blob = acquire_existing(upload.checksum)
+        if blob is None:
+            return False
+        if upload.kind == Upload.IMAGE:
+            upload.image = Image.objects.create(image=blob.file.name, blob=blob)
+        else:
+            upload.attachment = Attachment.objects.create(file=blob.file.name, blob=blob)
+        upload.status = Upload.COMPLETE
+        upload.save(update_fields=['status', 'attachment', 'image'])
+    return True
+
+
+def remove_part(upload_id):
+    try:
+        os.remove(part_path(upload_id))
+    except FileNotFoundError:
+        pass
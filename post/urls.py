@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, CommentViewSet
+from .views import PostViewSet, CommentViewSet, UploadViewSet
 
 router = DefaultRouter()
 router.register(r'posts', PostViewSet, basename="post")
+router.register(r'uploads', UploadViewSet, basename="upload")
 urlpatterns = [
     path('api/posts/<int:post_pk>/comments/', CommentViewSet.as_view({'get': 'list', 'post': 'create'}), name='post-comments'),
     path('api/', include(router.urls)),
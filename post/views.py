@@ -1,15 +1,35 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce, Substr
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, filters, permissions, status
+from Blog.fieldsets import SparseFieldsetsViewMixin
+from Blog.instrumentation import InstrumentedViewMixin
+from Blog.replicas import ReplicaReadMixin
+from django.utils import timezone
+from rest_framework import mixins, viewsets, permissions, status
 
 from post.permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly, IsReaderOrReadOnly
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import BaseSerializer
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
-from .models import Post, Comment
-from .serializers import CommentSerializer, PostIdSerializer, PostSerializer
+from .models import Attachment, FeedEntry, Image, ImageVariant, Post, Comment, Tag, Upload, UploadChunk
+from .cache import CachedReadMixin, invalidate_posts
+from .export import iter_json_array, iter_ndjson, parse_watermark
+from .feeds import get_feed_store, resolve_feed
+from .pagination import CommentPagination, PostPagination
+from .search import PostSearchFilter
+from .serializers import (
+    EXCERPT_LENGTH, CommentSerializer, CommentThreadSerializer, PostIdSerializer, PostSerializer,
+    PostSummarySerializer, UploadCompleteSerializer, UploadSerializer,
+)
+from .threads import attach_replies, get_thread_options
+from .uploads import complete_known_upload, complete_upload, write_chunk
 import django_filters.rest_framework
 from .models import Category
 from django.utils.translation import activate
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg.utils import no_body, swagger_auto_schema
 
 from rest_framework.response import Response
 from rest_framework.decorators import action 
@@ -21,8 +41,8 @@ class CategoryFilter(django_filters.FilterSet):
 
 class PostFilter(django_filters.FilterSet):
     author = django_filters.CharFilter(field_name='author__username')
-    publication_date__gte = django_filters.DateTimeFilter(field_name='publication_date', lookup_expr='gte')
-    publication_date__lte = django_filters.DateTimeFilter(field_name='publication_date', lookup_expr='lte')
+    publication_date__gte = django_filters.DateTimeFilter(field_name='pub_date', lookup_expr='gte')
+    publication_date__lte = django_filters.DateTimeFilter(field_name='pub_date', lookup_expr='lte')
     categories = django_filters.CharFilter(field_name='categories__name')
     tags = django_filters.CharFilter(field_name='tags__name')
 
@@ -31,11 +51,122 @@ class PostFilter(django_filters.FilterSet):
         fields = ['author', 'publication_date__gte', 'publication_date__lte', 'categories', 'tags']
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+REACTION_COUNTERS = {
+    'likes': ('like_count', 'dislikes', 'dislike_count'),
+    'dislikes': ('dislike_count', 'likes', 'like_count'),
+}
+
+
+def toggle_reaction(post, user, reaction):
+    """
+    Toggle `user`'s like or dislike on `post`, clearing the opposite
+    reaction, and keep the stored counters in step.
+
+    Rows are removed and inserted on the through tables directly so the
+    check never loads the other reactors.
+    """
+    counter, opposite, opposite_counter = REACTION_COUNTERS[reaction]
+    through = getattr(Post, reaction).through
+    opposite_through = getattr(Post, opposite).through
+    posts = Post.objects.filter(pk=post.pk)
+
+    with transaction.atomic():
+        removed, _ = through.objects.filter(post_id=post.pk, user_id=user.pk).delete()
+        if removed:
+            posts.update(**{counter: F(counter) - removed})
+            active = False
+        else:
+            try:
+                with transaction.atomic():
+                    through.objects.create(post_id=post.pk, user_id=user.pk)
+            except IntegrityError:
+                # A concurrent request from the same user got there first.
+                pass
+            else:
+                cleared, _ = opposite_through.objects.filter(post_id=post.pk, user_id=user.pk).delete()
+                posts.update(**{counter: F(counter) + 1, opposite_counter: F(opposite_counter) - cleared})
+            active = True
+        counts = posts.values('like_count', 'dislike_count').get()
+
+    invalidate_posts([post.pk])
+    return {'status': 'success', 'active': active, **counts}
+
+
+def comment_queryset(serializer):
+    """
+    Comments with the columns `serializer` renders, and their authors when
+    it expands them.
+    """
+    if isinstance(serializer.fields.get('author'), BaseSerializer):
+        return Comment.objects.select_related('author')
+    return Comment.objects.only('id', 'post_id', 'author_id', 'parent_id', 'text', 'created_at', 'depth', 'reply_count')
+
+
+class CommentViewSet(SparseFieldsetsViewMixin, InstrumentedViewMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     activate('ar')
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = CommentPagination
+    query_budget = {'list': 4, 'retrieve': 4}
+
+    def get_comment_queryset(self):
+        queryset = super().get_queryset()
+        post_id = self.kwargs.get('post_pk')
+        if post_id is not None:
+            queryset = queryset.filter(post_id=post_id)
+        if self.action in ('list', 'retrieve') and isinstance(self.get_serializer().fields.get('author'), BaseSerializer):
+            queryset = queryset.select_related('author')
+        return queryset
+
+    def get_queryset(self):
+        """
+        All the post's comments, or with `?parent=<id>` the replies to one
+        of them. A threaded list (`?depth=`) without a parent starts from
+        the top-level comments.
+        """
+        queryset = self.get_comment_queryset()
+        if self.action != 'list':
+            return queryset
+        parent = self.request.query_params.get('parent')
+        if parent is not None:
+            try:
+                return queryset.filter(parent_id=int(parent))
+            except ValueError:
+                raise ValidationError({'parent': 'A comment id.'})
+        if self.get_thread_options() is not None:
+            return queryset.filter(parent=None)
+        return queryset
+
+    def get_thread_options(self):
+        request = getattr(self, 'request', None)
+        if self.action != 'list' or request is None:
+            return None
+        return get_thread_options(request.query_params)
+
+    def get_serializer_class(self):
+        if self.get_thread_options() is not None:
+            return CommentThreadSerializer
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        """
+        With `?depth=<levels>`, nest up to that many levels of replies in
+        each comment listed, at most `?replies=<count>` per comment; their
+        `reply_count` tells whether there are more to page through with
+        `?parent=<id>`.
+        """
+        options = self.get_thread_options()
+        if options is None:
+            return super().list(request, *args, **kwargs)
+        depth, replies = options
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        comments = attach_replies(list(queryset) if page is None else page, self.get_comment_queryset(), depth, replies)
+        serializer = self.get_serializer(comments, many=True)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     def perform_create(self, serializer):
         post_id = self.kwargs.get('post_pk')
@@ -44,21 +175,145 @@ class CommentViewSet(viewsets.ModelViewSet):
 
 
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(SparseFieldsetsViewMixin, InstrumentedViewMixin, ReplicaReadMixin, CachedReadMixin,
+                  viewsets.ModelViewSet):
     activate('ar')
     queryset = Post.objects.all()
     serializer_class = PostSerializer
-    filter_backends = [django_filters.rest_framework.DjangoFilterBackend, filters.SearchFilter]
+    serializer_classes = {
+        'list': PostSummarySerializer,
+    }
+    filter_backends = [django_filters.rest_framework.DjangoFilterBackend, PostSearchFilter]
     filterset_class = PostFilter
     search_fields = ['title', 'content']
     permission_classes = [IsAuthenticated]
+    pagination_class = PostPagination
+    bulk_max_posts = 500
+    query_budget = {'list': 10, 'retrieve': 9, 'like': 12, 'dislike': 12}
+    queryset_builders = {
+        'list': 'build_read_queryset',
+        'retrieve': 'build_read_queryset',
+    }
+    feed_filters = {
+        'categories': FeedEntry.CATEGORY,
+        'tags': FeedEntry.TAG,
+        'author': FeedEntry.AUTHOR,
+    }
+    feed_range_filters = {
+        'publication_date__gte': 'since',
+        'publication_date__lte': 'until',
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        builder = self.queryset_builders.get(self.action)
+        if builder is not None:
+            queryset = getattr(self, builder)(queryset)
+        return queryset
+
+    def get_serializer_class(self):
+        return self.serializer_classes.get(self.action, self.serializer_class)
+
+    def build_read_queryset(self, queryset):
+        """
+        Load what the serializer will render, after `?fields=` and
+        `?expand=`, and nothing else: one prefetch of the columns it reads
+        per relation, so a page costs the same number of queries whatever
+        its size.
+        """
+        fields = self.get_serializer().fields
+        prefetches = []
+        if 'attachments' in fields:
+            prefetches.append(Prefetch('attachments', queryset=Attachment.objects.only('id', 'file')))
+        if 'images' in fields or 'image' in fields:
+            prefetches.append(Prefetch(
+                'images',
+                queryset=Image.objects.only('id', 'image', 'width', 'height').order_by('id').prefetch_related(
+                    Prefetch('variants', queryset=ImageVariant.objects.only('id', 'image_id', 'format', 'width', 'file')),
+                ),
+            ))
+        if 'comments' in fields:
+            comments = comment_queryset(fields['comments'].child).order_by('created_at', 'id')
+            prefetches.append(Prefetch('comments', queryset=comments))
+        if 'categories' in fields:
+            prefetches.append(Prefetch('categories', queryset=Category.objects.only('id')))
+        if 'tags' in fields:
+            prefetches.append(Prefetch('tags', queryset=Tag.objects.only('id')))
+        queryset = queryset.prefetch_related(*prefetches)
+
+        if isinstance(fields.get('author'), BaseSerializer):
+            queryset = queryset.select_related('author')
+        if 'comment_count' in fields:
+            counts = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(count=Count('*'))
+            queryset = queryset.annotate(
+                comment_count=Coalesce(Subquery(counts.values('count'), output_field=IntegerField()), 0),
+            )
+        if 'content' not in fields:
+            queryset = queryset.defer('content')
+            if 'excerpt' in fields:
+                # One character more than the excerpt shows, so it knows to add an ellipsis.
+                queryset = queryset.annotate(content_excerpt=Substr('content', 1, EXCERPT_LENGTH + 1))
+        return queryset
+
+    def get_feed(self):
+        """
+        Return the feed arguments (kind, key and optional pub_date bounds) of
+        the materialized feed answering this list request, when it filters
+        on a single category, tag or author and at most a date range.
+        """
+        if self.action != 'list':
+            return None
+        params = set(self.request.query_params) - {
+            self.paginator.cursor_query_param,
+            self.paginator.page_size_query_param,
+        }
+        feed_params = params & set(self.feed_filters)
+        if len(feed_params) != 1 or params - feed_params - set(self.feed_range_filters):
+            return None
+        name = feed_params.pop()
+        values = self.request.query_params.getlist(name)
+        if len(values) != 1:
+            return None
+
+        filterset = self.filterset_class(self.request.query_params, queryset=Post.objects.none(), request=self.request)
+        if not filterset.is_valid():
+            return None
+        key = resolve_feed(self.feed_filters[name], values[0])
+        if key is None:
+            return None
+        feed = {'kind': self.feed_filters[name], 'key': key}
+        for param, bound in self.feed_range_filters.items():
+            feed[bound] = filterset.form.cleaned_data.get(param)
+        return feed
+
+    def filter_queryset(self, queryset):
+        # The cursor goes first (see KeysetPagination.seek), unless a search
+        # orders the list by rank.
+        if self.action == 'list' and not self.request.query_params.get(PostSearchFilter.search_param):
+            queryset = self.paginator.seek(queryset, self.request, self)
+        return super().filter_queryset(queryset)
+
+    def paginate_queryset(self, queryset):
+        feed = self.get_feed()
+        if feed is None:
+            return super().paginate_queryset(queryset)
+        return self.paginator.paginate_feed(
+            get_feed_store(), queryset=self.build_read_queryset(Post.objects.all()), request=self.request, **feed,
+        )
+
+    def get_keyset_ordering(self, queryset):
+        if 'search_rank' in queryset.query.annotations:
+            return ('-search_rank', '-id')
+        return self.pagination_class.ordering
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             permission_classes = [IsReaderOrReadOnly]
+        elif self.action == 'export':
+            permission_classes = [IsAdminUser]
         elif self.action in ["like", 'dislike']:
             permission_classes = [IsAuthenticated]
-        elif self.action in ['create', 'update', 'partial_update', 'destroy']:
+        elif self.action in ['create', 'bulk', 'update', 'partial_update', 'destroy']:
             permission_classes = [IsAuthenticated, IsAuthorOrReadOnly]
         else:
             permission_classes = [IsAdminOrReadOnly]
@@ -68,30 +323,92 @@ class PostViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=True, permission_classes=[IsAuthenticated])
-    def like(self, request, pk=None):        
-        post = self.get_object()
-        user = request.user
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.bulk_max_posts)
+        serializer.is_valid(raise_exception=True)
+        posts = serializer.save(author=request.user)
+        created = self.build_read_queryset(Post.objects.filter(pk__in=[post.pk for post in posts]).order_by('pk'))
+        return Response(self.get_serializer(created, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Stream every post with its comments and relation ids as NDJSON, or
+        as a JSON array with `?output=json`. Pass the last row's pub_date
+        and id back as `since_date`/`since_id` for an incremental export.
+        """
+        try:
+            watermark = parse_watermark(request.query_params.get('since_date'), request.query_params.get('since_id'))
+        except ValueError as error:
+            raise ValidationError({'since': str(error)})
 
-        if user in post.likes.all():
-            post.likes.remove(user)
+        if request.query_params.get('output') == 'json':
+            rows, content_type = iter_json_array(watermark), 'application/json'
         else:
-            post.likes.add(user)
-            post.dislikes.remove(user)
+            rows, content_type = iter_ndjson(watermark), 'application/x-ndjson'
+        return StreamingHttpResponse(rows, content_type=f'{content_type}; charset=utf-8')
 
-        post.save()
-        return Response({'status': 'success'}, status=status.HTTP_200_OK)
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk=None):
+        post = self.get_object()
+        return Response(toggle_reaction(post, request.user, 'likes'), status=status.HTTP_200_OK)
 
-    @action(detail=True, permission_classes=[IsAuthenticated])
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def dislike(self, request, pk=None):
         post = self.get_object()
-        user = request.user
+        return Response(toggle_reaction(post, request.user, 'dislikes'), status=status.HTTP_200_OK)
 
-        if user in post.dislikes.all():
-            post.dislikes.remove(user)
-        else:
-            post.dislikes.add(user)
-            post.likes.remove(user)
 
-        post.save()
-        return Response({'status': 'success'}, status=status.HTTP_200_OK)
+class UploadViewSet(InstrumentedViewMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                    mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Chunked, resumable uploads. Create a session with the file's name, kind
+    and size, PUT each chunk's raw bytes to `chunks/<index>/` (in any order,
+    optionally with an X-Chunk-SHA256 header), then POST the file's SHA-256
+    to `complete/`. An interrupted transfer resumes by sending only the
+    session's `missing_chunks`. A session created with the checksum of a
+    file the user already uploaded comes back complete.
+    """
+    serializer_class = UploadSerializer
+    permission_classes = [IsAuthenticated]
+    query_budget = {'create': 12, 'retrieve': 6, 'chunk': 6, 'complete': 16}
+
+    def get_queryset(self):
+        queryset = Upload.objects.filter(owner_id=self.request.user.pk).filter(
+            Q(status=Upload.COMPLETE) | Q(expires_at__gt=timezone.now())
+        )
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(Prefetch('chunks', queryset=UploadChunk.objects.only('upload_id', 'index')))
+        return queryset
+
+    def perform_create(self, serializer):
+        upload = serializer.save(owner=self.request.user)
+        # A file this user has sent before needs no chunks at all.
+        complete_known_upload(upload)
+
+    def perform_destroy(self, instance):
+        if instance.status == Upload.COMPLETE:
+            raise ValidationError({'status': 'Completed uploads cannot be deleted.'})
+        instance.delete()
+
+    @swagger_auto_schema(request_body=no_body)
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        upload = self.get_object()
+        if upload.status == Upload.COMPLETE:
+            raise ValidationError({'status': 'The upload is already complete.'})
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        write_chunk(upload, int(index), request.stream, length, request.META.get('HTTP_X_CHUNK_SHA256'))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @swagger_auto_schema(request_body=UploadCompleteSerializer)
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        serializer = UploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = complete_upload(self.get_object(), serializer.validated_data.get('checksum'))
+        return Response(self.get_serializer(upload).data, status=status.HTTP_200_OK)
@@ -0,0 +1,289 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.utils.functional import cached_property
+from rest_framework.authentication import BaseAuthentication, SessionAuthentication, TokenAuthentication
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import AUTH_HEADER_TYPE_BYTES, JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User
+
+
+ROLE_GROUPS = ('Admin', 'Author', 'Reader')
+ROLES_CLAIM = 'groups'
+
+
+def get_user_claims(user):
+    """
+    Claims that let read requests authenticate without loading the user.
+    A role is held through a group of the matching Group subclass.
+    """
+    roles = set()
+    for row in user.groups.values_list('admin__pk', 'author__pk', 'reader__pk'):
+        roles.update(name for name, pk in zip(ROLE_GROUPS, row) if pk is not None)
+    return {
+        'username': user.get_username(),
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        ROLES_CLAIM: sorted(roles),
+    }
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token carrying `get_user_claims`; access tokens derived from it
+    copy them.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim, value in get_user_claims(user).items():
+            token[claim] = value
+        return token
+
+
+class ClaimsUser(TokenUser):
+    """
+    User built from the signed claims of an access token. Claims are only
+    as fresh as the token, so it is used for safe methods of users without
+    staff or superuser claims alone; writes and staff checks always see the
+    real user.
+    """
+
+    @cached_property
+    def roles(self):
+        return frozenset(self.token.get(ROLES_CLAIM, ()))
+
+    def in_group(self, name):
+        return name in self.roles
+
+    def __eq__(self, other):
+        if isinstance(other, models.Model):
+            return other._meta.concrete_model is User and other.pk == self.pk
+        return super().__eq__(other)
+
+    __hash__ = TokenUser.__hash__
+
+
+class UserCache:
+    """
+    Process-local LRU of users by id whose entries expire after `ttl`
+    seconds. Saving or deleting a user evicts it here; other processes
+    notice the change when the entry expires.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+        # Hand out copies so per-request state never leaks between requests.
+        return copy.copy(user)
+
+    def set(self, user_id, user):
+        with self.lock:
+            self.entries[user_id] = (copy.copy(user), time.monotonic() + self.ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_user_cache = None
+_user_cache_options = None
+
+
+def get_user_cache():
+    """
+    Return the user cache configured by AUTH_USER_CACHE, or None when it is
+    disabled (a MAX_SIZE or TTL of 0).
+    """
+    global _user_cache, _user_cache_options
+    options = {'MAX_SIZE': 1024, 'TTL': 60, **getattr(settings, 'AUTH_USER_CACHE', {})}
+    if not options['MAX_SIZE'] or not options['TTL']:
+        return None
+    if _user_cache is None or _user_cache_options != options:
+        _user_cache, _user_cache_options = UserCache(options['MAX_SIZE'], options['TTL']), options
+    return _user_cache
+
+
+def inactive_key(user_id):
+    return f'auth:inactive:{user_id}'
+
+
+def mark_inactive(user_id, inactive=True):
+    """
+    Record in the default cache, for as long as an access token lasts, that
+    a user was deactivated or deleted, so claims issued before are refused.
+    The cache has to be shared for this to hold across processes.
+    """
+    if inactive:
+        cache.set(inactive_key(user_id), True, api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    else:
+        cache.delete(inactive_key(user_id))
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that answers safe requests from the token claims and
+    loads users for other requests through the user cache. Tokens claiming
+    staff or superuser status always load the user, so a demotion counts
+    before the token expires.
+    """
+
+    def authenticate(self, request):
+        validated_token = self.get_request_token(request)
+        if validated_token is None:
+            return None
+        if self.uses_claims(request, validated_token):
+            return self.get_claims_user(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views: only a user missing from the user
+        cache is loaded, in a thread.
+        """
+        validated_token = self.get_request_token(request)
+        if validated_token is None:
+            return None
+        if self.uses_claims(request, validated_token):
+            return self.get_claims_user(validated_token), validated_token
+        user = self.get_cached_user(validated_token)
+        if user is None:
+            user = await sync_to_async(self.get_user)(validated_token)
+        return user, validated_token
+
+    def get_request_token(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        return self.get_validated_token(raw_token)
+
+    def uses_claims(self, request, validated_token):
+        return (request.method in SAFE_METHODS and ROLES_CLAIM in validated_token and
+                not validated_token.get('is_staff') and not validated_token.get('is_superuser'))
+
+    def get_claims_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        if cache.get(inactive_key(validated_token[api_settings.USER_ID_CLAIM])):
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return ClaimsUser(validated_token)
+
+    def get_cached_user(self, validated_token):
+        user_cache = get_user_cache()
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_cache is None or user_id is None or api_settings.CHECK_REVOKE_TOKEN:
+            return None
+        return user_cache.get(user_id)
+
+    def get_user(self, validated_token):
+        user_cache = get_user_cache()
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_cache is None or user_id is None or api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+        return user
+
+
+class AuthorizationSchemeAuthentication(BaseAuthentication):
+    """
+    Run only the authenticator the Authorization header names instead of
+    trying each in turn: JWT for the SIMPLE_JWT header types, DRF tokens for
+    `Token` (when rest_framework.authtoken is installed) and the session
+    when there is no header.
+    """
+
+    def __init__(self):
+        self.jwt = ClaimsJWTAuthentication()
+        self.token = TokenAuthentication()
+        self.session = SessionAuthentication()
+
+    def authenticate(self, request):
+        header = self.jwt.get_header(request)
+        parts = header.split() if header else []
+        if not parts:
+            return self.session.authenticate(request)
+        if parts[0] in AUTH_HEADER_TYPE_BYTES:
+            return self.jwt.authenticate(request)
+        if parts[0].lower() == self.token.keyword.lower().encode() and apps.is_installed('rest_framework.authtoken'):
+            return self.token.authenticate(request)
+        return None
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views: JWTs are checked on the event loop
+        and a request without credentials needs nothing, so only sessions,
+        DRF tokens and uncached users are loaded in a thread.
+        """
+        header = self.jwt.get_header(request)
+        parts = header.split() if header else []
+        if not parts and settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return None
+        if parts and parts[0] in AUTH_HEADER_TYPE_BYTES:
+            return await self.jwt.aauthenticate(request)
+        return await sync_to_async(self.authenticate)(request)
+
+    def authenticate_header(self, request):
+        return self.jwt.authenticate_header(request)
+
+
+async def aauthenticate_request(request):
+    """
+    Authenticate a DRF request the way Request.user would, for async views:
+    authenticators with an `aauthenticate` method run on the event loop,
+    the others in a thread.
+    """
+    for authenticator in request.authenticators:
+        try:
+            if hasattr(authenticator, 'aauthenticate'):
+                user_auth = await authenticator.aauthenticate(request)
+            else:
+                user_auth = await sync_to_async(authenticator.authenticate)(request)
+        except APIException:
+            request._not_authenticated()
+            raise
+        if user_auth is not None:
+            request._authenticator = authenticator
+            request.user, request.auth = user_auth
+            return
+    request._not_authenticated()
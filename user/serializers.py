@@ -1,10 +1,35 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from Blog.fieldsets import SparseFieldsetsMixin
 
+from .authentication import ClaimsRefreshToken, get_user_claims
 from .models import User
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     class Meta:
         model = User
         fields = ('id', 'username','password', 'email', 'first_name', 'last_name')
         ref_name='UserSerializer'
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Re-read the user's claims on refresh so role and staff changes reach
+    new access tokens without waiting for the refresh token to expire.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(pk=refresh.get(api_settings.USER_ID_CLAIM), is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed('User not found or inactive', code='user_not_found')
+        for claim, value in get_user_claims(user).items():
+            refresh[claim] = value
+        return super().validate({**attrs, 'refresh': str(refresh)})
@@ -0,0 +1,38 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import get_user_cache, mark_inactive
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_cached_user(sender, instance, **kwargs):
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        user_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def track_inactive_user(sender, instance, created, **kwargs):
+    if not (created and instance.is_active):
+        mark_inactive(instance.pk, not instance.is_active)
+
+
+@receiver(post_delete, sender=User)
+def track_deleted_user(sender, instance, **kwargs):
+    mark_inactive(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def evict_cached_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    user_cache = get_user_cache()
+    if user_cache is None or not action.startswith('post_'):
+        return
+    if not reverse:
+        user_cache.invalidate(instance.pk)
+    elif pk_set is None:
+        user_cache.clear()
+    else:
+        for user_id in pk_set:
+            user_cache.invalidate(user_id)
@@ -1,3 +1,113 @@
-from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-# Create your tests here.
+from post.models import Post
+from .authentication import ClaimsRefreshToken, ClaimsUser, get_user_cache
+from .models import Author, User
+
+
+class ClaimsAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_user_cache().clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Author.objects.create(name='Authors'), Group.objects.create(name='Plain'))
+        self.post = Post.objects.create(title='A post', content='Content.', author=self.user)
+
+    def bearer(self, token):
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_token_obtain_includes_claims(self):
+        response = self.client.post('/api/token/', {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = AccessToken(response.data['access'])
+        self.assertEqual(access['groups'], ['Author'])
+        self.assertFalse(access['is_staff'])
+
+    def test_refresh_picks_up_claim_changes(self):
+        refresh = ClaimsRefreshToken.for_user(self.user)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post('/api/token/refresh/', {'refresh': str(refresh)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(AccessToken(response.data['access'])['is_staff'])
+
+    def test_safe_requests_authenticate_without_queries(self):
+        headers = self.bearer(ClaimsRefreshToken.for_user(self.user).access_token)
+        self.client.get('/api/posts/', **headers)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/posts/', **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/notifications/unread_count/', **headers)
+        self.assertEqual(response.data, {'unread_count': 0})
+
+    def test_claims_user(self):
+        user = ClaimsUser(ClaimsRefreshToken.for_user(self.user).access_token)
+        self.assertTrue(user.in_group('Author'))
+        self.assertFalse(user.in_group('Admin'))
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_tokens_without_claims_load_the_user(self):
+        headers = self.bearer(RefreshToken.for_user(self.user).access_token)
+        self.client.get('/api/posts/', **headers)
+        self.assertIsNotNone(get_user_cache().get(self.user.pk))
+
+    def test_writes_use_cached_user_until_it_changes(self):
+        headers = self.bearer(ClaimsRefreshToken.for_user(self.user).access_token)
+        self.client.post(f'/api/posts/{self.post.pk}/like/', **headers)
+        self.assertIsNotNone(get_user_cache().get(self.user.pk))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(get_user_cache().get(self.user.pk))
+        response = self.client.post(f'/api/posts/{self.post.pk}/like/', **headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_staff_claims_are_checked_against_the_user(self):
+        self.user.is_staff = True
+        self.user.save()
+        headers = self.bearer(ClaimsRefreshToken.for_user(self.user).access_token)
+        self.assertEqual(self.client.get('/api/metrics/', **headers).status_code, status.HTTP_200_OK)
+
+        self.user.is_staff = False
+        self.user.save()
+        for path in ('/api/metrics/', '/api/posts/export/'):
+            response = self.client.get(path, **headers)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_deactivated_users_are_refused_before_their_token_expires(self):
+        headers = self.bearer(ClaimsRefreshToken.for_user(self.user).access_token)
+        self.assertEqual(self.client.get('/api/posts/', **headers).status_code, status.HTTP_200_OK)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/posts/', **headers).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get('/api/posts/', **headers).status_code, status.HTTP_200_OK)
+
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/posts/', **headers).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(AUTH_USER_CACHE={'TTL': 0})
+    def test_user_cache_can_be_disabled(self):
+        self.assertIsNone(get_user_cache())
+        headers = self.bearer(ClaimsRefreshToken.for_user(self.user).access_token)
+        response = self.client.post(f'/api/posts/{self.post.pk}/like/', **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_unknown_scheme_is_anonymous(self):
+        response = self.client.get('/api/notifications/', HTTP_AUTHORIZATION='Token abc')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+    def test_user_fields(self):
+        response = self.client.get(f'/api/users/{self.user.pk}/', {'fields': 'id,username'}, **self.bearer(
+            ClaimsRefreshToken.for_user(self.user).access_token))
+        self.assertEqual(response.data, {'id': self.user.pk, 'username': 'testuser'})
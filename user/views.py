@@ -1,12 +1,15 @@
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework import status,viewsets
+from Blog.fieldsets import SparseFieldsetsViewMixin
+from Blog.instrumentation import InstrumentedViewMixin
+from Blog.replicas import ReplicaReadMixin
 from .models import User
 from .serializers import UserSerializer
 from django.utils.translation import activate
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsetsViewMixin, InstrumentedViewMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     activate('ar')
     serializer_class = UserSerializer
     queryset = User.objects.all()